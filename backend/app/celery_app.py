@@ -3,8 +3,36 @@ Celery 应用配置
 """
 from celery import Celery
 from celery.schedules import crontab
+from kombu import Queue
 from app.config import settings
 
+# 转换任务队列，每个队列由单独的 worker 池消费（见 setup-lite.sh）：
+# - convert.paid：付费任务，独占进程，不会排在免费任务后面
+# - convert.render：免费的 CPU 密集型渲染任务（CELERY_RENDER_TASK_TYPES），进程数可单独调大
+# - convert.free：其它免费任务
+# 定时维护任务使用默认队列 celery。
+QUEUE_PAID = "convert.paid"
+QUEUE_FREE = "convert.free"
+QUEUE_RENDER = "convert.render"
+QUEUE_DEFAULT = "celery"
+
+# Redis 传输的优先级：数值越小越优先，队列内按 0/3/6/9 四档出队
+PRIORITY_PAID = 0
+PRIORITY_FREE_SMALL = 3
+PRIORITY_FREE = 6
+
+
+def convert_route(task_type: str, is_paid: bool, file_size: int = 0) -> dict:
+    """转换任务的队列和优先级，作为 apply_async 的参数；同一队列内小文件优先"""
+    if is_paid:
+        return {"queue": QUEUE_PAID, "priority": PRIORITY_PAID}
+
+    render_types = {name.strip() for name in settings.CELERY_RENDER_TASK_TYPES.split(",") if name.strip()}
+    queue = QUEUE_RENDER if task_type in render_types else QUEUE_FREE
+    small = (file_size or 0) <= settings.CELERY_SMALL_FILE_MB * 1024 * 1024
+    return {"queue": queue, "priority": PRIORITY_FREE_SMALL if small else PRIORITY_FREE}
+
+
 # 创建 Celery 应用
 celery_app = Celery(
     "pdfshift",
@@ -25,6 +53,13 @@ celery_app.conf.update(
     task_soft_time_limit=25 * 60,  # 25 分钟软超时
     worker_prefetch_multiplier=1,  # 每次只取一个任务
     worker_max_tasks_per_child=50,  # 每个 worker 最多处理 50 个任务后重启
+    task_queues=[Queue(QUEUE_DEFAULT), Queue(QUEUE_PAID), Queue(QUEUE_RENDER), Queue(QUEUE_FREE)],
+    task_default_queue=QUEUE_DEFAULT,
+    broker_transport_options={
+        "priority_steps": [PRIORITY_PAID, PRIORITY_FREE_SMALL, PRIORITY_FREE, 9],
+        # 同一 worker 消费多个队列时按 -Q 的顺序严格优先（默认轮询）；单 worker 部署时 celery（定时任务，量很小）排最前，其次是付费队列
+        "queue_order_strategy": "priority",
+    },
 )
 
 # 定时任务配置
@@ -34,9 +69,19 @@ celery_app.conf.beat_schedule = {
         "task": "app.tasks.cleanup_expired_files",
         "schedule": crontab(minute="*/10"),
     },
-    # 每小时统计数据
+    # 每 30 分钟清理过期的分片上传会话
+    "cleanup-stale-uploads": {
+        "task": "app.tasks.cleanup_stale_uploads",
+        "schedule": crontab(minute="*/30"),
+    },
+    # 每小时清理孤儿文件（避开整点统计）
+    "reconcile-orphan-files": {
+        "task": "app.tasks.reconcile_orphan_files",
+        "schedule": crontab(minute=35),
+    },
+    # 每 10 分钟刷新小时统计（管理后台统计的数据来源）
     "hourly-stats": {
         "task": "app.tasks.generate_hourly_stats",
-        "schedule": crontab(minute=0),
+        "schedule": crontab(minute="*/10"),
     },
 }
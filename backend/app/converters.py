@@ -0,0 +1,386 @@
+"""
+PDF 转换引擎
+"""
+import io
+import multiprocessing
+import os
+import zipfile
+from collections import deque
+from concurrent.futures import Executor, ProcessPoolExecutor
+from contextlib import contextmanager
+from typing import Callable, Iterable, Iterator, List, Optional, Tuple, Union
+
+import structlog
+
+from app.config import settings
+from app.progress import ProgressCallback
+
+logger = structlog.get_logger()
+
+
+def process_workers() -> int:
+    """转换进程池大小，CONVERT_PROCESS_WORKERS 为 0 时使用 CPU 核数"""
+    return settings.CONVERT_PROCESS_WORKERS or os.cpu_count() or 1
+
+
+@contextmanager
+def process_pool(max_workers: int) -> Iterator[ProcessPoolExecutor]:
+    """
+    进程池，在 Celery prefork 的子进程中也可以使用
+
+    prefork 子进程是 daemon 进程，multiprocessing 不允许其创建子进程
+    （AssertionError: daemonic processes are not allowed to have children）。
+    进程池存续期间临时清除当前进程的 daemon 标记；池中进程在 with 结束时全部退出，
+    父进程被杀死时它们读到管道 EOF 也会退出，不会残留。
+    """
+    config = multiprocessing.current_process()._config
+    daemon = config.pop("daemon", None)
+    try:
+        with ProcessPoolExecutor(max_workers=max_workers) as pool:
+            yield pool
+    finally:
+        if daemon is not None:
+            config["daemon"] = daemon
+
+
+def split_page_ranges(page_count: int, parts: int) -> List[Tuple[int, int]]:
+    """把 [0, page_count) 均分为不超过 parts 段的左闭右开区间"""
+    parts = max(1, min(parts, page_count))
+    size, extra = divmod(page_count, parts)
+    ranges = []
+    start = 0
+    for i in range(parts):
+        end = start + size + (1 if i < extra else 0)
+        ranges.append((start, end))
+        start = end
+    return ranges
+
+
+def bounded_ordered_map(pool: Executor, fn: Callable, args_iter: Iterable, max_in_flight: int) -> Iterator:
+    """
+    按提交顺序返回结果的 map，同时在途任务不超过 max_in_flight
+
+    Executor.map 会一次性提交全部任务，先完成的结果都堆在内存里等待按序取走；
+    这里边取边提交，内存占用只和窗口大小有关。
+    """
+    futures = deque()
+    for args in args_iter:
+        futures.append(pool.submit(fn, args))
+        if len(futures) >= max_in_flight:
+            yield futures.popleft().result()
+    while futures:
+        yield futures.popleft().result()
+
+
+def _parse_pdf2word_range(args) -> dict:
+    """子进程：解析一段页面，返回 pdf2docx 的中间结果"""
+    from pdf2docx import Converter
+
+    input_path, start, end, parse_settings = args
+    cv = Converter(input_path)
+    try:
+        cv.load_pages(start, end)
+        cv.parse_document(**parse_settings).parse_pages(**parse_settings)
+        return cv.store()
+    finally:
+        cv.close()
+
+
+def _parse_pages_sequential(cv, parse_settings: dict, progress: Optional[ProgressCallback]):
+    """单进程逐页解析，与 Converter.parse_pages 相同，但每页上报进度"""
+    from pdf2docx.converter import ConversionException
+
+    cv.load_pages().parse_document(**parse_settings)
+    pages = [page for page in cv.pages if not page.skip_parsing]
+    for i, page in enumerate(pages, start=1):
+        try:
+            page.parse(**parse_settings)
+        except Exception as e:
+            if parse_settings["debug"] or not parse_settings["ignore_page_error"]:
+                raise ConversionException(f"Error when parsing page {page.id + 1}: {e}")
+            logger.warning("Ignore page due to parsing error", page=page.id + 1, error=str(e))
+        if progress:
+            progress(i, len(pages), "parsing")
+
+
+def convert_pdf2word(input_path: str, output_path: str, progress: Optional[ProgressCallback] = None):
+    """
+    PDF 转 Word
+
+    页数达到 PDF2WORD_PARALLEL_MIN_PAGES 时按页拆分，在进程池中并行解析，
+    再把各段的解析结果合并后一次性生成 docx（版式、图片关系都由 pdf2docx 统一处理）。
+    页数较少时保持单进程转换。
+    """
+    from pdf2docx import Converter
+
+    cv = Converter(input_path)
+    try:
+        page_count = len(cv.fitz_doc)
+        workers = min(process_workers(), page_count)
+        parse_settings = cv.default_settings
+
+        if page_count < settings.PDF2WORD_PARALLEL_MIN_PAGES or workers <= 1:
+            _parse_pages_sequential(cv, parse_settings, progress)
+            if progress:
+                progress(page_count, page_count, "writing")
+            cv.make_docx(output_path, **parse_settings)
+            return
+
+        # 每个进程分多段，避免页面复杂度不均时个别进程拖尾
+        ranges = split_page_ranges(page_count, workers * 4)
+        logger.info("Parallel pdf2word conversion", pages=page_count, workers=workers, parts=len(ranges))
+
+        try:
+            with process_pool(workers) as pool:
+                results = pool.map(
+                    _parse_pdf2word_range, [(input_path, start, end, parse_settings) for start, end in ranges]
+                )
+                for (_, end), data in zip(ranges, results):
+                    cv.restore(data)
+                    if progress:
+                        progress(end, page_count, "parsing")
+        except (AssertionError, OSError) as e:
+            # 运行环境无法创建子进程（如进程数达到上限）时退回单进程
+            logger.warning("Process pool unavailable, fallback to single process", error=str(e))
+            _parse_pages_sequential(cv, parse_settings, progress)
+
+        if progress:
+            progress(page_count, page_count, "writing")
+        cv.make_docx(output_path, **parse_settings)
+    finally:
+        cv.close()
+
+
+def convert_pdf2ppt(input_path: str, output_path: str, progress: Optional[ProgressCallback] = None):
+    """
+    PDF 转 PPT（每页渲染为一张图片）
+
+    每次只渲染 PDF2PPT_RENDER_WINDOW 页，窗口内的页面由多个 pdftoppm 进程并行渲染；
+    图片按 PDF2PPT_IMAGE_FORMAT 编码到内存缓冲区后插入幻灯片，不写临时文件，渲染占用的内存与总页数无关。
+    """
+    from pdf2image import convert_from_path, pdfinfo_from_path
+    from pptx import Presentation
+    from pptx.util import Inches
+
+    page_count = pdfinfo_from_path(input_path)["Pages"]
+    window = max(settings.PDF2PPT_RENDER_WINDOW, 1)
+    threads = min(process_workers(), window)
+
+    image_format = settings.PDF2PPT_IMAGE_FORMAT.upper()
+    prs = Presentation()
+
+    for first_page in range(1, page_count + 1, window):
+        last_page = min(first_page + window - 1, page_count)
+        images = convert_from_path(
+            input_path,
+            dpi=settings.PDF2PPT_DPI,
+            first_page=first_page,
+            last_page=last_page,
+            thread_count=threads,
+        )
+
+        for img in images:
+            buffer = io.BytesIO()
+            if image_format == "JPEG":
+                if img.mode != "RGB":
+                    img = img.convert("RGB")
+                img.save(buffer, "JPEG", quality=settings.PDF2PPT_JPEG_QUALITY)
+            else:
+                img.save(buffer, "PNG")
+            img.close()
+            buffer.seek(0)
+
+            slide = prs.slides.add_slide(prs.slide_layouts[6])  # 空白布局
+            left = top = Inches(0)
+            slide.shapes.add_picture(buffer, left, top, width=prs.slide_width)
+
+        # 释放本窗口的位图后再渲染下一批
+        del images
+        if progress:
+            progress(last_page, page_count, "rendering")
+
+    prs.save(output_path)
+
+
+def _extract_tables_range(args) -> List[list]:
+    """提取一段页面中的全部表格（可在子进程中执行）"""
+    import pdfplumber
+
+    input_path, start, end = args
+    tables = []
+    with pdfplumber.open(input_path, pages=list(range(start + 1, end + 1))) as pdf:
+        for page in pdf.pages:
+            tables.extend(page.extract_tables())
+            # 释放页面对象缓存的解析结果
+            page.flush_cache()
+    return tables
+
+
+def _iter_pdf_tables(input_path: str, progress: Optional[ProgressCallback] = None) -> Iterator[list]:
+    """
+    按页顺序逐个产出表格
+
+    每 PDF2EXCEL_PAGES_PER_CHUNK 页重新打开一次文档，pdfminer 的文档级对象缓存随之释放，
+    内存只和单段页数有关；页数较多时各段在进程池中并行提取。
+    """
+    import pdfplumber
+    from pdfminer.pdftypes import resolve1
+
+    # 从页面树读取页数，不实例化所有页面对象
+    with pdfplumber.open(input_path) as pdf:
+        page_count = int(resolve1(resolve1(pdf.doc.catalog["Pages"])["Count"]))
+
+    chunk = max(settings.PDF2EXCEL_PAGES_PER_CHUNK, 1)
+    chunks = [(input_path, start, min(start + chunk, page_count)) for start in range(0, page_count, chunk)]
+    workers = min(process_workers(), page_count)
+    done = 0
+
+    if page_count >= settings.PDF2EXCEL_PARALLEL_MIN_PAGES and workers > 1:
+        logger.info("Parallel pdf2excel extraction", pages=page_count, workers=workers)
+        try:
+            with process_pool(workers) as pool:
+                results = bounded_ordered_map(pool, _extract_tables_range, chunks, workers * 2)
+                for (_, _, end), tables in zip(chunks, results):
+                    yield from tables
+                    done += 1
+                    if progress:
+                        progress(end, page_count, "extracting")
+            return
+        except (AssertionError, OSError) as e:
+            # 运行环境不允许创建子进程时，剩余的段在当前进程中提取
+            logger.warning("Process pool unavailable, fallback to single process", error=str(e), done=done)
+
+    for args in chunks[done:]:
+        yield from _extract_tables_range(args)
+        if progress:
+            progress(args[2], page_count, "extracting")
+
+
+def convert_pdf2excel(input_path: str, output_path: str, progress: Optional[ProgressCallback] = None):
+    """
+    PDF 表格提取为 Excel
+
+    逐页提取表格，直接写入 openpyxl 只写模式的工作簿（行数据随写随落到临时文件），
+    不经过 pandas，内存占用与文档页数无关。每个表格一个工作表；没有表格时输出一个空工作表。
+    """
+    from openpyxl import Workbook
+
+    wb = Workbook(write_only=True)
+    sheet_count = 0
+
+    for table in _iter_pdf_tables(input_path, progress):
+        sheet_count += 1
+        ws = wb.create_sheet(f"Sheet{sheet_count}")
+        for row in table:
+            ws.append(row)
+
+    if sheet_count == 0:
+        wb.create_sheet("Sheet1")
+
+    wb.save(output_path)
+
+
+def parse_page_ranges(spec: Union[str, List[str], None], page_count: Optional[int] = None) -> List[Tuple[int, int]]:
+    """
+    解析页码范围
+
+    Args:
+        spec: 如 "1-3,5,8-"（页码从 1 开始，闭区间，"8-" 表示到最后一页），也可以是字符串列表；
+              为空时每页一段
+        page_count: 文档页数，提供时校验范围并展开开放区间
+
+    Returns:
+        (起始页, 结束页) 列表，页码从 1 开始；page_count 未提供时开放区间的结束页为 0
+
+    Raises:
+        ValueError: 格式错误或超出页数
+    """
+    if not spec:
+        if page_count is None:
+            return []
+        return [(i, i) for i in range(1, page_count + 1)]
+
+    parts = spec if isinstance(spec, list) else str(spec).split(",")
+    ranges = []
+    for part in parts:
+        part = str(part).strip()
+        first, sep, last = part.partition("-")
+        try:
+            start = int(first)
+            end = (int(last) if last.strip() else 0) if sep else start
+        except ValueError:
+            raise ValueError(f"Invalid page range: {part}")
+
+        if start < 1 or (end and end < start):
+            raise ValueError(f"Invalid page range: {part}")
+
+        if page_count is not None:
+            end = end or page_count
+            if end > page_count:
+                raise ValueError(f"Page range {part} exceeds page count {page_count}")
+
+        ranges.append((start, end))
+
+    return ranges
+
+
+def merge_pdfs(input_paths: List[str], output_path: str, progress: Optional[ProgressCallback] = None):
+    """
+    按顺序合并多个 PDF
+
+    pikepdf 直接复制页面对象，内容流原样写出，不重新渲染或压缩，耗时与输入字节数成正比。
+    进度按已合并的文件数上报。
+    """
+    import pikepdf
+
+    sources = []
+    try:
+        with pikepdf.Pdf.new() as merged:
+            for path in input_paths:
+                src = pikepdf.open(path)
+                sources.append(src)
+                merged.pages.extend(src.pages)
+                if progress:
+                    progress(len(sources), len(input_paths), "merging")
+            # 源文件需保持打开直到写出，页面内容在保存时才从源文件读取
+            merged.save(output_path)
+    finally:
+        for src in sources:
+            src.close()
+
+
+def split_pdf(
+    input_path: str,
+    output_path: str,
+    page_ranges: Union[str, List[str], None] = None,
+    progress: Optional[ProgressCallback] = None,
+):
+    """
+    按页码范围拆分 PDF
+
+    指定了单个范围时输出单个 PDF；多个范围或未指定（每页一个文件，单页文档也一样）时输出 zip，
+    与 tasks.get_output_extension 按请求参数确定的扩展名一致；
+    zip 不再压缩，每个 PDF 直接写入 zip 条目，不落临时文件。
+    """
+    import pikepdf
+
+    stem = os.path.splitext(os.path.basename(input_path))[0]
+
+    with pikepdf.open(input_path) as src:
+        ranges = parse_page_ranges(page_ranges, len(src.pages))
+
+        if page_ranges and len(ranges) == 1:
+            start, end = ranges[0]
+            with pikepdf.Pdf.new() as part:
+                part.pages.extend(src.pages[start - 1:end])
+                part.save(output_path)
+            return
+
+        with zipfile.ZipFile(output_path, "w", compression=zipfile.ZIP_STORED) as zf:
+            for i, (start, end) in enumerate(ranges, start=1):
+                name = f"{stem}_p{start}.pdf" if start == end else f"{stem}_p{start}-{end}.pdf"
+                with pikepdf.Pdf.new() as part, zf.open(name, "w", force_zip64=True) as entry:
+                    part.pages.extend(src.pages[start - 1:end])
+                    part.save(entry)
+                if progress:
+                    progress(i, len(ranges), "splitting")
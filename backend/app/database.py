@@ -1,23 +1,95 @@
 """
 数据库配置
 """
-from sqlalchemy import create_engine, event
+import structlog
+from sqlalchemy import create_engine, event, inspect, text
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
 from app.config import settings
+from app.db_pool import InstrumentedAsyncQueuePool, InstrumentedQueuePool
+
+logger = structlog.get_logger()
+
+# 同步驱动对应的异步驱动
+ASYNC_DRIVERS = {
+    "sqlite": "sqlite+aiosqlite",
+    "postgresql": "postgresql+asyncpg",
+    "mysql": "mysql+aiomysql",
+}
+
+IS_SQLITE = make_url(settings.DATABASE_URL).get_backend_name() == "sqlite"
+
+
+def to_sync_url(url: str) -> str:
+    """未指定驱动的 PostgreSQL URL 使用 psycopg 3（支持服务端预处理语句）"""
+    parsed = make_url(url)
+    if parsed.drivername == "postgresql":
+        return parsed.set(drivername="postgresql+psycopg").render_as_string(hide_password=False)
+    return url
+
+
+def to_async_url(url: str) -> str:
+    """把同步数据库 URL 转换为异步驱动的 URL，已指定异步驱动时原样返回"""
+    parsed = make_url(url)
+    driver = ASYNC_DRIVERS.get(parsed.get_backend_name())
+    if driver is None or parsed.drivername in ASYNC_DRIVERS.values():
+        return url
+    return parsed.set(drivername=driver).render_as_string(hide_password=False)
+
+
+def _engine_options(is_async: bool) -> dict:
+    """
+    引擎参数
+
+    SQLite（轻量部署）保持默认连接池；其它数据库使用可配置、带等待时间统计的 QueuePool，
+    并开启驱动的预处理语句缓存（psycopg 的 prepare_threshold、asyncpg 的 prepared_statement_cache_size），
+    同一条参数化语句重复执行时只解析和规划一次。
+    """
+    if IS_SQLITE:
+        return {} if is_async else {"connect_args": {"check_same_thread": False}}
+
+    options = {
+        "poolclass": InstrumentedAsyncQueuePool if is_async else InstrumentedQueuePool,
+        "pool_size": settings.DB_POOL_SIZE,
+        "max_overflow": settings.DB_MAX_OVERFLOW,
+        "pool_timeout": settings.DB_POOL_TIMEOUT,
+        "pool_recycle": settings.DB_POOL_RECYCLE,
+        "pool_pre_ping": settings.DB_POOL_PRE_PING,
+    }
+
+    url = to_async_url(settings.DATABASE_URL) if is_async else to_sync_url(settings.DATABASE_URL)
+    driver = make_url(url).drivername
+    if driver == "postgresql+asyncpg":
+        options["connect_args"] = {"prepared_statement_cache_size": settings.DB_STATEMENT_CACHE_SIZE}
+    elif driver == "postgresql+psycopg":
+        options["connect_args"] = {"prepare_threshold": settings.DB_PREPARE_THRESHOLD}
+
+    return options
+
 
 # 创建数据库引擎
 engine = create_engine(
-    settings.DATABASE_URL,
-    connect_args={"check_same_thread": False} if "sqlite" in settings.DATABASE_URL else {},
+    to_sync_url(settings.DATABASE_URL),
+    echo=settings.APP_DEBUG,
+    **_engine_options(is_async=False),
+)
+
+# 异步引擎：供 FastAPI 路由使用，查询不阻塞事件循环
+async_engine = create_async_engine(
+    to_async_url(settings.DATABASE_URL),
     echo=settings.APP_DEBUG,
+    **_engine_options(is_async=True),
 )
 
-# SQLite 优化配置
+
+# SQLite 优化配置（同步与异步引擎共用）
 @event.listens_for(engine, "connect")
+@event.listens_for(async_engine.sync_engine, "connect")
 def set_sqlite_pragma(dbapi_conn, connection_record):
     """SQLite 性能优化"""
-    if "sqlite" in settings.DATABASE_URL:
+    if IS_SQLITE:
         cursor = dbapi_conn.cursor()
         cursor.execute("PRAGMA journal_mode=WAL")
         cursor.execute("PRAGMA synchronous=NORMAL")
@@ -26,9 +98,12 @@ def set_sqlite_pragma(dbapi_conn, connection_record):
         cursor.execute("PRAGMA busy_timeout=30000")
         cursor.close()
 
-# 创建会话工厂
+# 创建会话工厂（同步会话供 Celery 任务和脚本使用）
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
+# 异步会话工厂；提交后不过期对象，避免在响应序列化时触发隐式 IO
+AsyncSessionLocal = async_sessionmaker(async_engine, class_=AsyncSession, autoflush=False, expire_on_commit=False)
+
 # 创建基类
 Base = declarative_base()
 
@@ -42,6 +117,65 @@ def get_db():
         db.close()
 
 
+async def get_async_db():
+    """获取异步数据库会话（FastAPI 路由使用）"""
+    async with AsyncSessionLocal() as db:
+        yield db
+
+
+# create_all 只创建不存在的表，不会修改已有的表；已有表上新增的列和索引在这里登记，由 migrate 补齐
+MIGRATION_COLUMNS = {
+    "tasks": ["file_hash", "merge_file_keys"],
+}
+MIGRATION_INDEXES = {
+    "tasks": [
+        "ix_tasks_file_key_source",
+        "idx_tasks_status_expire",
+        "idx_tasks_client_created_id",
+        "idx_tasks_type_created_id",
+        "idx_tasks_status_created_id",
+        "idx_tasks_paid_created_id",
+        "idx_tasks_client_paid_created_id",
+    ],
+}
+
+
+def migrate(bind=engine):
+    """
+    为已有的表补齐新增的列和索引
+
+    只添加缺失的列（ALTER TABLE ... ADD COLUMN）和索引，已存在的跳过，可重复执行。
+    """
+    existing_tables = set(inspect(bind).get_table_names())
+    with bind.begin() as conn:
+        for table_name, column_names in MIGRATION_COLUMNS.items():
+            if table_name not in existing_tables:
+                continue
+            table = Base.metadata.tables[table_name]
+            existing = {column["name"] for column in inspect(conn).get_columns(table_name)}
+            for name in column_names:
+                if name in existing:
+                    continue
+                column_type = table.c[name].type.compile(dialect=conn.dialect)
+                conn.execute(text(f"ALTER TABLE {table_name} ADD COLUMN {name} {column_type}"))
+                logger.info("Column added", table=table_name, column=name)
+
+        for table_name, index_names in MIGRATION_INDEXES.items():
+            indexes = {index.name: index for index in Base.metadata.tables[table_name].indexes}
+            for name in index_names:
+                indexes[name].create(conn, checkfirst=True)
+
+
 def init_db():
-    """初始化数据库"""
+    """初始化数据库：创建缺失的表，补齐已有表的列和索引，注册收入台账监听器并在台账为空时重建"""
+    from app import revenue_ledger
+
     Base.metadata.create_all(bind=engine)
+    migrate()
+
+    revenue_ledger.register()
+    db = SessionLocal()
+    try:
+        revenue_ledger.ensure_built(db)
+    finally:
+        db.close()
@@ -0,0 +1,114 @@
+"""
+数据库连接池监控
+
+InstrumentedQueuePool 在 QueuePool 取连接时计时，记录等待时间与超时次数；
+配合池的当前占用（checkedout / pool_size + max_overflow）判断连接池是否饱和。
+池中没有空闲连接而新建连接时，等待时间包含建立连接的耗时。
+指标只在当前进程内统计，API 进程和 Celery worker 各自独立。
+"""
+import threading
+import time
+from typing import Optional
+
+from sqlalchemy import exc
+from sqlalchemy.pool import AsyncAdaptedQueuePool, Pool, QueuePool
+
+# 等待时间直方图的桶上限（毫秒），最后一个桶为 +Inf
+WAIT_BUCKETS_MS = (1, 5, 10, 50, 100, 500, 1000, 5000)
+
+
+class PoolMetrics:
+    """连接池取连接的等待时间统计"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.checkouts = 0
+            self.timeouts = 0
+            self.wait_total = 0.0
+            self.wait_max = 0.0
+            self.buckets = [0] * (len(WAIT_BUCKETS_MS) + 1)
+
+    def record(self, wait: float, timed_out: bool = False):
+        wait_ms = wait * 1000
+        index = next((i for i, bound in enumerate(WAIT_BUCKETS_MS) if wait_ms <= bound), len(WAIT_BUCKETS_MS))
+        with self._lock:
+            if timed_out:
+                self.timeouts += 1
+            else:
+                self.checkouts += 1
+            self.wait_total += wait
+            self.wait_max = max(self.wait_max, wait)
+            self.buckets[index] += 1
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            count = self.checkouts + self.timeouts
+            return {
+                "checkouts": self.checkouts,
+                "timeouts": self.timeouts,
+                "wait_avg_ms": round(self.wait_total * 1000 / count, 3) if count else 0.0,
+                "wait_max_ms": round(self.wait_max * 1000, 3),
+                "wait_histogram_ms": {
+                    **{f"le_{bound}": n for bound, n in zip(WAIT_BUCKETS_MS, self.buckets)},
+                    "le_inf": self.buckets[-1],
+                },
+            }
+
+
+class _InstrumentedMixin:
+    metrics: PoolMetrics
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.metrics = PoolMetrics()
+
+    def recreate(self):
+        # 连接池重建（如 dispose）时保留累计指标
+        pool = super().recreate()
+        pool.metrics = self.metrics
+        return pool
+
+    def _do_get(self):
+        start = time.perf_counter()
+        try:
+            conn = super()._do_get()
+        except exc.TimeoutError:
+            self.metrics.record(time.perf_counter() - start, timed_out=True)
+            raise
+        self.metrics.record(time.perf_counter() - start)
+        return conn
+
+
+class InstrumentedQueuePool(_InstrumentedMixin, QueuePool):
+    """带等待时间统计的 QueuePool（同步引擎）"""
+
+
+class InstrumentedAsyncQueuePool(_InstrumentedMixin, AsyncAdaptedQueuePool):
+    """带等待时间统计的 AsyncAdaptedQueuePool（异步引擎）"""
+
+
+def pool_stats(pool: Pool) -> dict:
+    """连接池当前状态与累计指标"""
+    stats = {"pool_class": type(pool).__name__}
+
+    if isinstance(pool, QueuePool):
+        capacity = pool.size() + max(pool._max_overflow, 0)
+        checked_out = pool.checkedout()
+        stats.update(
+            pool_size=pool.size(),
+            max_overflow=pool._max_overflow,
+            checked_in=pool.checkedin(),
+            checked_out=checked_out,
+            overflow=max(pool.overflow(), 0),
+            saturation=round(checked_out / capacity, 3) if capacity else None,
+        )
+
+    metrics: Optional[PoolMetrics] = getattr(pool, "metrics", None)
+    if metrics is not None:
+        stats.update(metrics.snapshot())
+
+    return stats
@@ -0,0 +1,47 @@
+"""
+任务状态事件
+
+worker 在任务状态变化时发布到 Redis 频道 task:<task_id>:events，
+/tasks/{task_id}/events 订阅该频道并以 SSE 推送给客户端。处理中的进度也通过同一频道发布。发布失败只记录日志，不影响任务本身。
+"""
+import json
+from typing import Optional
+
+import structlog
+from redis import RedisError
+
+from app.redis_client import get_redis
+
+logger = structlog.get_logger()
+
+# 终态：推送后关闭连接
+TERMINAL_STATUSES = {"completed", "failed", "expired"}
+
+
+def task_channel(task_id: str) -> str:
+    """任务事件频道名"""
+    return f"task:{task_id}:events"
+
+
+def publish_task_event(
+    task_id: str,
+    status: str,
+    error_msg: Optional[str] = None,
+    progress: Optional[dict] = None,
+):
+    """
+    发布任务状态变化
+
+    Args:
+        progress: 处理中的进度，{"progress", "eta_seconds", "stage"}，合并到事件中
+    """
+    event = {"task_id": task_id, "status": status}
+    if error_msg:
+        event["error_msg"] = error_msg
+    if progress:
+        event.update(progress)
+
+    try:
+        get_redis().publish(task_channel(task_id), json.dumps(event, ensure_ascii=False))
+    except RedisError as e:
+        logger.warning("Failed to publish task event", task_id=task_id, status=status, error=str(e))
@@ -2,6 +2,7 @@
 PDFShift FastAPI 主应用
 """
 from fastapi import FastAPI, Request
+from fastapi.concurrency import run_in_threadpool
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.middleware.trustedhost import TrustedHostMiddleware
 from fastapi.responses import JSONResponse, FileResponse
@@ -10,6 +11,7 @@ import structlog
 from contextlib import asynccontextmanager
 import os
 
+from app import runtime_config
 from app.config import settings
 from app.database import init_db
 from app.routes import tasks, upload, admin, system
@@ -25,6 +27,8 @@ async def lifespan(app: FastAPI):
     logger.info("Application starting", env=settings.APP_ENV)
     init_db()
     logger.info("Database initialized")
+    # 加载运行时配置并启动失效通知监听
+    await run_in_threadpool(runtime_config.current)
 
     yield
 
@@ -49,6 +53,7 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["GET", "POST", "PUT", "DELETE"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor"],
 )
 
 # 受信任主机中间件
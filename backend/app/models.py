@@ -1,7 +1,8 @@
 """
 数据库模型
 """
-from sqlalchemy import Column, String, Integer, Float, DateTime, Boolean, Text
+from sqlalchemy import Column, String, Integer, BigInteger, Float, DateTime, Boolean, Text, Index
+from sqlalchemy.orm import column_property
 from sqlalchemy.sql import func
 from app.database import Base
 
@@ -15,8 +16,10 @@ class Task(Base):
     client_id = Column(String(64), nullable=False, index=True)
     file_name = Column(String(255))
     file_size = Column(Integer)
-    file_key_source = Column(String(255))  # 源文件相对路径
+    file_key_source = Column(String(255), index=True)  # 源文件相对路径
     file_key_result = Column(String(255))  # 结果文件相对路径
+    file_hash = Column(String(64))  # 源文件 SHA-256
+    merge_file_keys = Column(Text)  # merge 按顺序合并的全部源文件相对路径（JSON 列表）
     task_type = Column(String(50))  # pdf2word, pdf2excel, pdf2ppt, merge, split
     status = Column(String(50), default="pending", index=True)  # pending, processing, completed, failed, expired
     is_paid = Column(Boolean, default=False)
@@ -25,6 +28,53 @@ class Task(Base):
     completed_at = Column(DateTime)
     expire_at = Column(DateTime, index=True)
 
+    __table_args__ = (
+        # 过期清理按状态分批扫描
+        Index("idx_tasks_status_expire", "status", "expire_at"),
+        # 管理后台任务列表按 (created_at, task_id) 键集分页：按客户端、任务类型、状态、is_paid 筛选时
+        # 使用以分页键结尾的复合索引（is_paid 选择性低，但索引保证按分页键有序，无需额外排序）；不筛选时倒序扫描 created_at 索引
+        Index("idx_tasks_client_created_id", "client_id", "created_at", "task_id"),
+        Index("idx_tasks_type_created_id", "task_type", "created_at", "task_id"),
+        Index("idx_tasks_status_created_id", "status", "created_at", "task_id"),
+        Index("idx_tasks_paid_created_id", "is_paid", "created_at", "task_id"),
+        # /history 按客户端查询付费任务并分页
+        Index("idx_tasks_client_paid_created_id", "client_id", "is_paid", "created_at", "task_id"),
+    )
+
+
+class ConversionCache(Base):
+    """转换结果缓存表"""
+
+    __tablename__ = "conversion_cache"
+
+    cache_key = Column(String(64), primary_key=True)  # sha256(源文件哈希:任务类型:选项)
+    file_hash = Column(String(64), nullable=False, index=True)  # 源文件 SHA-256
+    task_type = Column(String(50))
+    file_key = Column(String(255))  # 缓存文件相对路径
+    source_size = Column(Integer)  # 源文件大小（字节）
+    result_size = Column(Integer)  # 缓存文件大小（字节）
+    hit_count = Column(Integer, default=0)
+    created_at = Column(DateTime, server_default=func.now())
+    last_hit_at = Column(DateTime, index=True)
+
+
+class TaskStatsHourly(Base):
+    """任务小时统计表（由 stats_rollup 从 tasks 表汇总）"""
+
+    __tablename__ = "task_stats_hourly"
+
+    hour = Column(DateTime, primary_key=True)  # 任务创建时间所在的整点
+    task_type = Column(String(50), primary_key=True)
+    total_tasks = Column(Integer, default=0)
+    completed_tasks = Column(Integer, default=0)
+    failed_tasks = Column(Integer, default=0)
+    paid_tasks = Column(Integer, default=0)
+    bytes_processed = Column(BigInteger, default=0)  # 完成任务的源文件大小之和
+    duration_p50 = Column(Float)  # 完成任务从创建到完成的耗时分位数（秒）
+    duration_p90 = Column(Float)
+    duration_p99 = Column(Float)
+    updated_at = Column(DateTime, server_default=func.now(), onupdate=func.now())
+
 
 class Order(Base):
     """订单表"""
@@ -34,12 +84,26 @@ class Order(Base):
     order_id = Column(String(64), primary_key=True)
     client_id = Column(String(64), index=True)
     task_id = Column(String(64))
-    amount = Column(Float)
-    status = Column(String(50), default="unpaid", index=True)  # unpaid, paid, refunded
+    # active_history：修改前加载旧值，收入台账据此计算增量
+    amount = column_property(Column(Float), active_history=True)
+    status = column_property(
+        Column(String(50), default="unpaid", index=True), active_history=True
+    )  # unpaid, paid, refunded
     payment_time = Column(DateTime)
     created_at = Column(DateTime, server_default=func.now())
 
 
+class RevenueLedger(Base):
+    """收入台账（随订单变更在同一事务中增量更新，见 revenue_ledger）"""
+
+    __tablename__ = "revenue_ledger"
+
+    period = Column(String(10), primary_key=True)  # 订单创建日期 YYYY-MM-DD，或 all 表示累计
+    total_orders = Column(Integer, default=0)
+    paid_amount = Column(Float, default=0)  # 状态为 paid 的订单金额
+    refunded_amount = Column(Float, default=0)  # 状态为 refunded 的订单金额
+
+
 class SystemConfig(Base):
     """系统配置表"""
 
@@ -0,0 +1,58 @@
+"""
+键集（游标）分页
+
+按 (created_at, 主键) 倒序分页：下一页条件为 (created_at, 主键) < 上一页最后一行，
+配合以这两列结尾的复合索引，任意一页都是一次索引范围扫描，不随页码增大而变慢（OFFSET 需要跳过前面所有行）。
+
+游标是上一页最后一行的 created_at 和主键，经 base64 编码后对调用方不透明，
+通过响应头 X-Next-Cursor 返回，没有下一页时不返回该响应头。
+"""
+import base64
+import json
+from datetime import datetime
+from typing import List, Optional, Sequence, Tuple
+
+from sqlalchemy import Select, tuple_
+
+NEXT_CURSOR_HEADER = "X-Next-Cursor"
+
+
+def encode_cursor(created_at: datetime, key: str) -> str:
+    raw = json.dumps([created_at.isoformat(), key], separators=(",", ":")).encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii").rstrip("=")
+
+
+def decode_cursor(cursor: str) -> Tuple[datetime, str]:
+    """
+    解析游标
+
+    Raises:
+        ValueError: 游标格式错误
+    """
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        created_at, key = json.loads(raw)
+        return datetime.fromisoformat(created_at), str(key)
+    except (TypeError, ValueError) as e:
+        raise ValueError(f"Invalid cursor: {cursor}") from e
+
+
+def keyset_page(query: Select, created_col, key_col, cursor: Optional[str], limit: int) -> Select:
+    """
+    为查询加上游标条件、倒序排序和 limit + 1（多取一行用于判断是否有下一页）
+
+    Raises:
+        ValueError: 游标格式错误
+    """
+    if cursor:
+        query = query.where(tuple_(created_col, key_col) < decode_cursor(cursor))
+    return query.order_by(created_col.desc(), key_col.desc()).limit(limit + 1)
+
+
+def split_page(rows: Sequence, limit: int, created_attr: str, key_attr: str) -> Tuple[List, Optional[str]]:
+    """拆出本页数据和下一页游标（没有下一页时为 None）"""
+    rows = list(rows)
+    if len(rows) <= limit:
+        return rows, None
+    last = rows[limit - 1]
+    return rows[:limit], encode_cursor(getattr(last, created_attr), getattr(last, key_attr))
@@ -0,0 +1,123 @@
+"""
+转换进度
+
+转换函数通过回调 progress(done, total, stage) 上报进度（done/total 为当前阶段已完成的页数/总页数），
+ProgressReporter 节流后写入 Redis 哈希 task:<task_id>:progress 并发布任务事件，不写 tasks 表。
+"""
+import time
+from typing import Callable, Optional
+
+import structlog
+from redis import RedisError
+
+from app.config import settings
+from app.events import publish_task_event
+from app.redis_client import get_redis
+
+logger = structlog.get_logger()
+
+# progress(done, total, stage)
+ProgressCallback = Callable[[int, int, str], None]
+
+
+def progress_key(task_id: str) -> str:
+    """任务进度的 Redis 键"""
+    return f"task:{task_id}:progress"
+
+
+def estimate(done: int, total: int, stage_started_at: float, now: Optional[float] = None) -> dict:
+    """
+    计算进度百分比与剩余时间
+
+    剩余时间按当前阶段的平均速度估算，尚未完成任何页面时为 None。
+    """
+    now = time.time() if now is None else now
+    percent = round(done * 100 / total, 1) if total > 0 else 0.0
+    eta_seconds = None
+    if 0 < done <= total:
+        eta_seconds = int((now - stage_started_at) / done * (total - done))
+    return {"progress": percent, "eta_seconds": eta_seconds}
+
+
+class ProgressReporter:
+    """
+    节流的进度上报器
+
+    同一阶段内两次写入至少间隔 TASK_PROGRESS_INTERVAL_SECONDS；阶段切换和阶段完成总是写入。
+    Redis 不可用时只记录一次警告，之后静默丢弃，不影响转换。
+    """
+
+    def __init__(self, task_id: str, min_interval: Optional[float] = None):
+        self.task_id = task_id
+        self.min_interval = settings.TASK_PROGRESS_INTERVAL_SECONDS if min_interval is None else min_interval
+        self._stage = None
+        self._stage_started_at = 0.0
+        self._last_report = 0.0
+        self._disabled = False
+
+    def __call__(self, done: int, total: int, stage: str):
+        now = time.time()
+        if stage != self._stage:
+            self._stage = stage
+            self._stage_started_at = now
+        elif done < total and now - self._last_report < self.min_interval:
+            return
+
+        self._last_report = now
+        if self._disabled:
+            return
+
+        try:
+            pipe = get_redis().pipeline()
+            pipe.hset(
+                progress_key(self.task_id),
+                mapping={
+                    "done": done,
+                    "total": total,
+                    "stage": stage,
+                    "stage_started_at": self._stage_started_at,
+                    "updated_at": now,
+                },
+            )
+            pipe.expire(progress_key(self.task_id), settings.TASK_PROGRESS_TTL_SECONDS)
+            pipe.execute()
+        except RedisError as e:
+            logger.warning("Failed to report task progress", task_id=self.task_id, error=str(e))
+            self._disabled = True
+            return
+
+        publish_task_event(
+            self.task_id,
+            "processing",
+            progress={"stage": stage, **estimate(done, total, self._stage_started_at, now)},
+        )
+
+    def clear(self):
+        """任务结束后删除进度记录"""
+        if self._disabled:
+            return
+        try:
+            get_redis().delete(progress_key(self.task_id))
+        except RedisError:
+            pass
+
+
+def read_progress(task_id: str) -> Optional[dict]:
+    """
+    读取任务进度
+
+    Returns:
+        {"progress", "eta_seconds", "stage"}；无记录或 Redis 不可用时返回 None
+    """
+    try:
+        data = get_redis().hgetall(progress_key(task_id))
+    except RedisError:
+        return None
+
+    if not data:
+        return None
+
+    return {
+        "stage": data["stage"],
+        **estimate(int(data["done"]), int(data["total"]), float(data["stage_started_at"])),
+    }
@@ -0,0 +1,140 @@
+"""
+限流与准入控制
+
+- 令牌桶：每个 client_id 和每个 IP 各一个桶（上传、创建任务分别计数），
+  Lua 脚本在 Redis 中原子地补充并检查所有桶，全部有令牌时才同时扣减。
+  限额来自 system_configs（runtime_config），可在管理后台实时调整。
+- 准入控制：任务要进入的 Celery 队列积压超过 queue_max_depth 时拒绝创建，
+  避免接收在 expire_at 之前无法完成的任务。
+
+Redis 不可用时放行（fail open），限流不能成为新的单点故障。
+"""
+import math
+import time
+from typing import List, Optional, Tuple
+
+import structlog
+from fastapi import HTTPException, Request
+from fastapi.concurrency import run_in_threadpool
+from redis import RedisError
+
+from app import runtime_config
+from app.celery_app import celery_app
+from app.config import settings
+from app.redis_client import get_broker_redis, get_redis
+
+logger = structlog.get_logger()
+
+# 补充令牌并检查所有桶；KEYS 为桶，ARGV 为 now 和每个桶的 (每秒令牌数, 容量)
+# 返回需要等待的秒数（字符串，避免小数被 Redis 截断），"0" 表示已扣减
+_TOKEN_BUCKET_SCRIPT = """
+local now = tonumber(ARGV[1])
+local tokens = {}
+local wait = 0
+for i, key in ipairs(KEYS) do
+    local rate = tonumber(ARGV[i * 2])
+    local burst = tonumber(ARGV[i * 2 + 1])
+    local state = redis.call('HMGET', key, 'tokens', 'ts')
+    local current = tonumber(state[1]) or burst
+    local elapsed = math.max(0, now - (tonumber(state[2]) or now))
+    current = math.min(burst, current + elapsed * rate)
+    tokens[i] = current
+    if current < 1 then
+        wait = math.max(wait, (1 - current) / rate)
+    end
+end
+if wait > 0 then
+    return tostring(wait)
+end
+for i, key in ipairs(KEYS) do
+    local rate = tonumber(ARGV[i * 2])
+    local burst = tonumber(ARGV[i * 2 + 1])
+    redis.call('HSET', key, 'tokens', tokens[i] - 1, 'ts', now)
+    redis.call('EXPIRE', key, math.ceil(burst / rate) + 1)
+end
+return '0'
+"""
+
+# kombu Redis 传输中带优先级的队列键：<队列名><分隔符><优先级>，优先级 0 使用队列名本身
+PRIORITY_SEP = "\x06\x16"
+
+
+def _buckets(scope: str, client_id: Optional[str], ip: Optional[str]) -> List[Tuple[str, float, int]]:
+    """(键, 每秒令牌数, 容量) 列表，未配置限额的维度不计数"""
+    config = runtime_config.current()
+    buckets = []
+    if client_id and config.rate_limit_client_per_minute > 0:
+        buckets.append(
+            (f"ratelimit:{scope}:client:{client_id}", config.rate_limit_client_per_minute / 60, config.rate_limit_client_burst)
+        )
+    if ip and config.rate_limit_ip_per_minute > 0:
+        buckets.append((f"ratelimit:{scope}:ip:{ip}", config.rate_limit_ip_per_minute / 60, config.rate_limit_ip_burst))
+    return buckets
+
+
+def acquire(scope: str, client_id: Optional[str], ip: Optional[str]) -> float:
+    """
+    从客户端和 IP 的桶中各取一个令牌
+
+    Returns:
+        0 表示放行，否则为需要等待的秒数
+    """
+    buckets = _buckets(scope, client_id, ip)
+    if not settings.RATE_LIMIT_ENABLED or not buckets:
+        return 0
+
+    args = [time.time()]
+    for _, rate, burst in buckets:
+        args.extend([rate, max(burst, 1)])
+    try:
+        wait = get_redis().eval(_TOKEN_BUCKET_SCRIPT, len(buckets), *(key for key, _, _ in buckets), *args)
+    except RedisError as e:
+        logger.warning("Rate limiter unavailable, allow request", error=str(e))
+        return 0
+    return float(wait)
+
+
+def queue_depth(queue: str) -> Optional[int]:
+    """Celery 队列中等待的任务数（所有优先级之和），broker 不可用时返回 None"""
+    steps = celery_app.conf.broker_transport_options.get("priority_steps", [0])
+    keys = [queue if step == 0 else f"{queue}{PRIORITY_SEP}{step}" for step in steps]
+    try:
+        pipe = get_broker_redis().pipeline(transaction=False)
+        for key in keys:
+            pipe.llen(key)
+        return sum(pipe.execute())
+    except RedisError as e:
+        logger.warning("Failed to read queue depth", queue=queue, error=str(e))
+        return None
+
+
+def client_ip(request: Request) -> Optional[str]:
+    """客户端 IP（uvicorn 已根据受信任代理的 X-Forwarded-For 还原）"""
+    return request.client.host if request.client else None
+
+
+async def enforce_rate_limit(scope: str, request: Request, client_id: Optional[str] = None):
+    """超过限额时返回 429，Retry-After 为令牌补充所需的秒数"""
+    wait = await run_in_threadpool(acquire, scope, client_id, client_ip(request))
+    if wait > 0:
+        raise HTTPException(
+            status_code=429,
+            detail="请求过于频繁，请稍后再试",
+            headers={"Retry-After": str(math.ceil(wait))},
+        )
+
+
+async def enforce_admission(queue: str):
+    """目标队列积压超过上限时返回 503，请客户端稍后重试"""
+    max_depth = runtime_config.current().queue_max_depth
+    if max_depth <= 0:
+        return
+
+    depth = await run_in_threadpool(queue_depth, queue)
+    if depth is not None and depth >= max_depth:
+        logger.warning("Queue saturated, reject new task", queue=queue, depth=depth, max_depth=max_depth)
+        raise HTTPException(
+            status_code=503,
+            detail="当前转换任务较多，请稍后再试",
+            headers={"Retry-After": str(settings.ADMISSION_RETRY_AFTER_SECONDS)},
+        )
@@ -0,0 +1,171 @@
+"""
+孤儿文件清理
+
+cleanup_expired_files 只处理数据库中的任务，以下文件不会被删除：
+- uploads/ 下上传后从未创建任务的文件
+- results/ 下任务记录已不存在的结果文件
+- 任务被用户删除（status=expired，但没有经过过期清理）后留下的文件
+
+这里用 os.scandir 按目录顺序扫描存储树，每批文件名一次 IN 查询比对 tasks 表，
+删除超过宽限期且没有未过期任务引用的文件，并删除空目录。
+单次运行有时间上限，扫描位置记录在 Redis 中，下次从中断的目录继续。
+"""
+import os
+import time
+from datetime import datetime, timedelta
+from typing import Iterator, List, Optional, Tuple
+
+import structlog
+from redis import RedisError
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+
+from app.config import settings
+from app.models import Task
+from app.redis_client import get_redis
+
+logger = structlog.get_logger()
+
+# 扫描的顶层目录（按字典序，与断点比较一致）；partial/（分片上传）和 cache/（结果缓存）有各自的清理逻辑
+SCAN_CATEGORIES = ("results", "uploads")
+
+CURSOR_KEY = "storage:reconcile:cursor"
+
+
+def _load_cursor() -> Optional[Tuple[str, ...]]:
+    try:
+        cursor = get_redis().get(CURSOR_KEY)
+    except RedisError:
+        return None
+    return tuple(cursor.split("/")) if cursor else None
+
+
+def _save_cursor(parts: Optional[Tuple[str, ...]]):
+    try:
+        if parts:
+            get_redis().set(CURSOR_KEY, "/".join(parts))
+        else:
+            get_redis().delete(CURSOR_KEY)
+    except RedisError:
+        pass
+
+
+def iter_dirs(
+    path: str, parts: Tuple[str, ...], cursor: Optional[Tuple[str, ...]]
+) -> Iterator[Tuple[str, Tuple[str, ...], List[os.DirEntry], float]]:
+    """
+    按路径字典序深度优先遍历目录，产出 (目录路径, 相对路径分量, 目录下的文件, 目录修改时间)
+
+    子目录在产出当前目录之前遍历，调用方处理完文件后可以直接删除空目录。
+    目录修改时间在遍历前读取，不受本次删除文件、子目录的影响。
+    位于 cursor 之前（已处理过）的目录整棵跳过；cursor 的上级目录在其子目录之后产出，尚未处理，不跳过。
+    """
+    try:
+        mtime = os.stat(path).st_mtime
+        with os.scandir(path) as it:
+            entries = sorted(it, key=lambda entry: entry.name)
+    except FileNotFoundError:
+        return
+
+    for entry in entries:
+        if entry.is_dir(follow_symlinks=False):
+            child = parts + (entry.name,)
+            if cursor and child < cursor[: len(child)]:
+                continue
+            yield from iter_dirs(entry.path, child, cursor)
+
+    if cursor is None or parts > cursor or (len(parts) < len(cursor) and cursor[: len(parts)] == parts):
+        yield path, parts, [entry for entry in entries if entry.is_file(follow_symlinks=False)], mtime
+
+
+def _changed_at(entry: os.DirEntry) -> float:
+    """文件最后一次修改内容或元数据（包括新建硬链接）的时间"""
+    st = entry.stat(follow_symlinks=False)
+    return max(st.st_mtime, st.st_ctime)
+
+
+def _referenced(db: Session, category: str, names: List[str], file_keys: List[str]) -> set:
+    """返回仍被未过期任务引用的文件名"""
+    if category == "results":
+        # 结果文件名为 <task_id>.<ext>
+        task_ids = {name.split(".", 1)[0]: name for name in names}
+        rows = db.execute(
+            select(Task.task_id).where(Task.task_id.in_(list(task_ids)), Task.status != "expired")
+        ).scalars()
+        return {task_ids[task_id] for task_id in rows}
+
+    rows = db.execute(
+        select(Task.file_key_source).where(Task.file_key_source.in_(file_keys), Task.status != "expired")
+    ).scalars()
+    return {file_key.rsplit("/", 1)[-1] for file_key in rows}
+
+
+def reconcile(db: Session) -> dict:
+    """
+    执行一次孤儿文件清理
+
+    Returns:
+        统计信息：扫描文件数、删除文件数、释放字节数、删除目录数、是否扫描完整棵树
+    """
+    started = time.monotonic()
+    deadline = started + settings.ORPHAN_SCAN_TIME_BUDGET_SECONDS
+    grace_cutoff = (datetime.now() - timedelta(hours=settings.ORPHAN_GRACE_HOURS)).timestamp()
+    stats = {"scanned": 0, "deleted": 0, "freed_bytes": 0, "removed_dirs": 0, "finished": False}
+
+    cursor = _load_cursor()
+    last_parts = None
+
+    for category in SCAN_CATEGORIES:
+        if cursor and (category,) < cursor[:1]:
+            continue
+
+        root = os.path.join(settings.STORAGE_BASE_PATH, category)
+        for path, parts, files, dir_mtime in iter_dirs(root, (category,), cursor):
+            stats["scanned"] += len(files)
+
+            # 宽限期内的文件可能属于正在创建的任务。结果缓存硬链接出的文件保留缓存文件的旧 mtime，
+            # 但建立链接会更新 ctime，因此按两者中较晚的时间判断
+            candidates = [entry for entry in files if _changed_at(entry) < grace_cutoff]
+
+            for start in range(0, len(candidates), settings.ORPHAN_SCAN_BATCH_SIZE):
+                batch = candidates[start : start + settings.ORPHAN_SCAN_BATCH_SIZE]
+                names = [entry.name for entry in batch]
+                file_keys = ["/".join(parts + (name,)) for name in names]
+                referenced = _referenced(db, category, names, file_keys)
+
+                for entry in batch:
+                    if entry.name in referenced:
+                        continue
+                    try:
+                        size = entry.stat(follow_symlinks=False).st_size
+                        os.remove(entry.path)
+                    except FileNotFoundError:
+                        continue
+                    except OSError as e:
+                        logger.error("Failed to delete orphan file", path=entry.path, error=str(e))
+                        continue
+                    stats["deleted"] += 1
+                    stats["freed_bytes"] += size
+
+            # 删除空目录：不删除顶层目录，也不删除宽限期内修改过的目录（可能正要写入新文件）
+            if len(parts) > 1:
+                if dir_mtime < grace_cutoff:
+                    try:
+                        os.rmdir(path)
+                        stats["removed_dirs"] += 1
+                    except OSError:
+                        pass
+
+            last_parts = parts
+            if time.monotonic() > deadline:
+                _save_cursor(last_parts)
+                logger.info("Orphan reconcile paused", cursor="/".join(last_parts), **stats)
+                return stats
+
+        cursor = None
+
+    # 完整扫描一遍，下次从头开始
+    _save_cursor(None)
+    stats["finished"] = True
+    logger.info("Orphan reconcile completed", elapsed=round(time.monotonic() - started, 1), **stats)
+    return stats
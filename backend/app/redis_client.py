@@ -0,0 +1,48 @@
+"""
+Redis 连接
+"""
+import redis
+import redis.asyncio as aioredis
+
+from app.config import settings
+
+_redis = None
+_broker_redis = None
+
+
+def get_redis() -> redis.Redis:
+    """进程内共享的同步客户端（Celery worker 与同步代码使用）"""
+    global _redis
+    if _redis is None:
+        _redis = redis.Redis.from_url(
+            settings.REDIS_URL,
+            decode_responses=True,
+            socket_timeout=settings.REDIS_SOCKET_TIMEOUT,
+            socket_connect_timeout=settings.REDIS_SOCKET_TIMEOUT,
+        )
+    return _redis
+
+
+def get_broker_redis() -> redis.Redis:
+    """Celery broker 的同步客户端（读取队列长度），broker 与 REDIS_URL 可以是不同实例"""
+    global _broker_redis
+    if _broker_redis is None:
+        _broker_redis = redis.Redis.from_url(
+            settings.CELERY_BROKER_URL,
+            socket_timeout=settings.REDIS_SOCKET_TIMEOUT,
+            socket_connect_timeout=settings.REDIS_SOCKET_TIMEOUT,
+        )
+    return _broker_redis
+
+
+def new_async_redis() -> aioredis.Redis:
+    """
+    创建异步客户端，调用方用完后 aclose()
+
+    异步连接绑定创建时的事件循环，不做进程级共享。
+    """
+    return aioredis.Redis.from_url(
+        settings.REDIS_URL,
+        decode_responses=True,
+        socket_connect_timeout=settings.REDIS_SOCKET_TIMEOUT,
+    )
@@ -0,0 +1,261 @@
+"""
+文件下载响应
+
+支持强 ETag、If-None-Match / If-Modified-Since（304）、If-Range、单段与多段 Range。
+服务器提供 ASGI zerocopysend 扩展时用 sendfile 零拷贝发送，否则按块读取。
+"""
+import os
+import re
+import secrets
+import stat
+from email.utils import formatdate, parsedate_to_datetime
+from typing import List, Optional, Tuple
+from urllib.parse import quote
+
+import anyio
+from starlette.requests import Request
+from starlette.responses import Response
+from starlette.types import Receive, Scope, Send
+
+# 多段 Range 的最大段数，超过时按整文件返回，防止构造大量小分段消耗资源
+MAX_RANGES = 16
+
+_RANGE_SPEC = re.compile(r"^\s*(\d*)\s*-\s*(\d*)\s*$")
+
+
+def make_etag(stat_result: os.stat_result) -> str:
+    """由文件身份（inode、大小、修改时间）生成强 ETag"""
+    return f'"{stat_result.st_ino:x}-{stat_result.st_size:x}-{stat_result.st_mtime_ns:x}"'
+
+
+def content_disposition(filename: str) -> str:
+    """生成 attachment 类型的 Content-Disposition，非 ASCII 文件名使用 RFC 5987 编码"""
+    quoted = quote(filename)
+    if quoted != filename:
+        return f"attachment; filename*=utf-8''{quoted}"
+    return f'attachment; filename="{filename}"'
+
+
+def _etag_matches(header: str, etag: str, weak: bool) -> bool:
+    if header.strip() == "*":
+        return True
+    for candidate in header.split(","):
+        candidate = candidate.strip()
+        if weak:
+            candidate = candidate[2:] if candidate.startswith("W/") else candidate
+        if candidate == etag:
+            return True
+    return False
+
+
+def _not_modified_since(header: str, stat_result: os.stat_result) -> bool:
+    try:
+        since = parsedate_to_datetime(header).timestamp()
+    except (TypeError, ValueError):
+        return False
+    return int(stat_result.st_mtime) <= since
+
+
+def parse_range(header: str, size: int) -> Optional[List[Tuple[int, int]]]:
+    """
+    解析 Range 头
+
+    Returns:
+        合并后的闭区间列表；语法错误或段数过多返回 None（按整文件处理）；
+        所有区间都无法满足时返回空列表（416）
+    """
+    unit, _, specs = header.partition("=")
+    if unit.strip().lower() != "bytes" or not specs:
+        return None
+
+    parts = specs.split(",")
+    if len(parts) > MAX_RANGES:
+        return None
+
+    ranges = []
+    for part in parts:
+        match = _RANGE_SPEC.match(part)
+        if not match or match.group(1) == match.group(2) == "":
+            return None
+
+        first, last = match.group(1), match.group(2)
+        if first == "":
+            # 后缀区间：最后 N 个字节
+            length = int(last)
+            if length == 0:
+                continue
+            start, end = max(size - length, 0), size - 1
+        else:
+            start = int(first)
+            end = min(int(last), size - 1) if last else size - 1
+            if last and int(last) < start:
+                return None
+
+        if start < size:
+            ranges.append((start, end))
+
+    # 合并重叠或相邻的区间
+    ranges.sort()
+    merged: List[Tuple[int, int]] = []
+    for start, end in ranges:
+        if merged and start <= merged[-1][1] + 1:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], end))
+        else:
+            merged.append((start, end))
+    return merged
+
+
+class RangeFileResponse(Response):
+    """按给定区间发送文件内容的响应"""
+
+    chunk_size = 64 * 1024
+
+    def __init__(
+        self,
+        path: str,
+        stat_result: os.stat_result,
+        headers: dict,
+        media_type: str,
+        ranges: Optional[List[Tuple[int, int]]] = None,
+    ):
+        self.path = path
+        self.size = stat_result.st_size
+        self.ranges = ranges
+        self.background = None
+        self._parts: List[Tuple[bytes, int, int]] = []
+        self._trailer = b""
+
+        if ranges is None:
+            self.status_code = 200
+            self._parts.append((b"", 0, self.size))
+            content_length = self.size
+            content_type = media_type
+        elif len(ranges) == 1:
+            start, end = ranges[0]
+            self.status_code = 206
+            self._parts.append((b"", start, end - start + 1))
+            headers["content-range"] = f"bytes {start}-{end}/{self.size}"
+            content_length = end - start + 1
+            content_type = media_type
+        else:
+            # multipart/byteranges：每段前写分隔头，最后写结束分隔符
+            self.status_code = 206
+            boundary = secrets.token_hex(16)
+            content_length = 0
+            for start, end in ranges:
+                part_header = (
+                    f"\r\n--{boundary}\r\n"
+                    f"Content-Type: {media_type}\r\n"
+                    f"Content-Range: bytes {start}-{end}/{self.size}\r\n\r\n"
+                ).encode("latin-1")
+                self._parts.append((part_header, start, end - start + 1))
+                content_length += len(part_header) + end - start + 1
+            self._trailer = f"\r\n--{boundary}--\r\n".encode("latin-1")
+            content_length += len(self._trailer)
+            content_type = f"multipart/byteranges; boundary={boundary}"
+
+        headers["content-length"] = str(content_length)
+        self.media_type = content_type
+        self.init_headers(headers)
+
+    async def _send_file_part(self, send: Send, file, offset: int, count: int, zerocopy: bool):
+        if zerocopy:
+            await send(
+                {
+                    "type": "http.response.zerocopysend",
+                    "file": file.wrapped,
+                    "offset": offset,
+                    "count": count,
+                    "more_body": True,
+                }
+            )
+            return
+
+        await file.seek(offset)
+        remaining = count
+        while remaining > 0:
+            chunk = await file.read(min(self.chunk_size, remaining))
+            if not chunk:
+                break
+            remaining -= len(chunk)
+            await send({"type": "http.response.body", "body": chunk, "more_body": True})
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        await send({"type": "http.response.start", "status": self.status_code, "headers": self.raw_headers})
+
+        if scope["method"].upper() == "HEAD":
+            await send({"type": "http.response.body", "body": b"", "more_body": False})
+            return
+
+        zerocopy = "http.response.zerocopysend" in scope.get("extensions", {})
+        async with await anyio.open_file(self.path, mode="rb") as file:
+            for part_header, offset, count in self._parts:
+                if part_header:
+                    await send({"type": "http.response.body", "body": part_header, "more_body": True})
+                await self._send_file_part(send, file, offset, count, zerocopy)
+
+        await send({"type": "http.response.body", "body": self._trailer, "more_body": False})
+
+
+async def file_response(
+    request: Request,
+    path: str,
+    filename: Optional[str] = None,
+    media_type: str = "application/octet-stream",
+    max_age: Optional[int] = None,
+) -> Response:
+    """
+    生成支持条件请求和 Range 的文件响应
+
+    Args:
+        request: 当前请求，用于读取条件头和 Range 头
+        path: 文件绝对路径
+        filename: 下载文件名（Content-Disposition）
+        media_type: 文件 MIME 类型
+        max_age: 缓存有效期（秒），提供时输出 Cache-Control
+
+    Raises:
+        FileNotFoundError: 文件不存在或不是普通文件
+    """
+    stat_result = await anyio.to_thread.run_sync(os.stat, path)
+    if not stat.S_ISREG(stat_result.st_mode):
+        raise FileNotFoundError(path)
+
+    etag = make_etag(stat_result)
+    headers = {
+        "etag": etag,
+        "last-modified": formatdate(stat_result.st_mtime, usegmt=True),
+        "accept-ranges": "bytes",
+    }
+    if max_age is not None:
+        headers["cache-control"] = f"public, max-age={max(int(max_age), 0)}"
+
+    # 条件请求：If-None-Match 优先于 If-Modified-Since
+    if_none_match = request.headers.get("if-none-match")
+    if_modified_since = request.headers.get("if-modified-since")
+    if if_none_match is not None:
+        if _etag_matches(if_none_match, etag, weak=True):
+            return Response(status_code=304, headers=headers)
+    elif if_modified_since and _not_modified_since(if_modified_since, stat_result):
+        return Response(status_code=304, headers=headers)
+
+    if filename is not None:
+        headers["content-disposition"] = content_disposition(filename)
+
+    ranges = None
+    range_header = request.headers.get("range")
+    if range_header:
+        # If-Range 不匹配（文件已变化）时忽略 Range，返回完整文件
+        if_range = request.headers.get("if-range")
+        if if_range is None or (
+            _etag_matches(if_range, etag, weak=False)
+            if if_range.strip().startswith(('"', "W/"))
+            else _not_modified_since(if_range, stat_result)
+        ):
+            ranges = parse_range(range_header, stat_result.st_size)
+
+        if ranges == []:
+            headers["content-range"] = f"bytes */{stat_result.st_size}"
+            return Response(status_code=416, headers=headers)
+
+    return RangeFileResponse(path, stat_result, headers, media_type, ranges)
@@ -0,0 +1,165 @@
+"""
+转换结果缓存
+
+按 (源文件 SHA-256, 任务类型, 规范化后的选项) 寻址。缓存文件保存在 STORAGE_BASE_PATH/cache 下，
+命中时以硬链接的方式放到任务自己的结果路径，任务过期删除结果文件不会影响缓存，反之亦然。
+"""
+import hashlib
+import json
+import os
+import shutil
+from datetime import datetime, timedelta
+from typing import Optional
+
+import structlog
+from sqlalchemy import func
+from sqlalchemy.orm import Session
+
+from app.config import settings
+from app.models import ConversionCache
+from app.storage import resolve_file_key, to_file_key
+
+logger = structlog.get_logger()
+
+CACHE_DIR = "cache"
+
+
+def normalize_options(options: Optional[dict]) -> str:
+    """选项规范化为稳定的 JSON 字符串（键排序，去掉 None 值）"""
+    options = {k: v for k, v in (options or {}).items() if v is not None}
+    return json.dumps(options, sort_keys=True, separators=(",", ":"), ensure_ascii=False)
+
+
+def make_cache_key(file_hash: str, task_type: str, options: Optional[dict]) -> str:
+    """计算缓存键"""
+    raw = f"{file_hash.lower()}:{task_type}:{normalize_options(options)}"
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+def link_or_copy(src: str, dst: str):
+    """硬链接文件，跨文件系统时退化为复制"""
+    os.makedirs(os.path.dirname(dst), exist_ok=True)
+    try:
+        os.link(src, dst)
+    except FileExistsError:
+        # 目标已存在不是跨设备问题，交给调用方处理
+        raise
+    except OSError:
+        shutil.copyfile(src, dst)
+
+
+def lookup(db: Session, file_hash: str, task_type: str, options: Optional[dict]) -> Optional[ConversionCache]:
+    """查询缓存，缓存文件已丢失时顺便删除记录"""
+    if not settings.RESULT_CACHE_ENABLED or not file_hash:
+        return None
+
+    entry = db.get(ConversionCache, make_cache_key(file_hash, task_type, options))
+    if entry is None:
+        return None
+
+    if not os.path.exists(resolve_file_key(entry.file_key)):
+        db.delete(entry)
+        db.commit()
+        return None
+
+    return entry
+
+
+def materialize(entry: ConversionCache, output_path: str):
+    """把缓存结果放到任务结果路径（阻塞调用）"""
+    link_or_copy(resolve_file_key(entry.file_key), output_path)
+
+
+def record_hit(entry: ConversionCache):
+    """记录一次命中，由调用方提交事务"""
+    entry.hit_count = (entry.hit_count or 0) + 1
+    entry.last_hit_at = datetime.now()
+
+
+def store_file(
+    file_hash: str,
+    source_size: int,
+    task_type: str,
+    options: Optional[dict],
+    result_path: str,
+) -> ConversionCache:
+    """把结果文件放入缓存目录，返回尚未写入数据库的缓存记录"""
+    cache_key = make_cache_key(file_hash, task_type, options)
+    ext = os.path.splitext(result_path)[1]
+    cache_path = os.path.join(settings.STORAGE_BASE_PATH, CACHE_DIR, cache_key[:2], f"{cache_key}{ext}")
+
+    try:
+        link_or_copy(result_path, cache_path)
+    except FileExistsError:
+        # 并发转换的同一文件已经写入过缓存
+        pass
+
+    now = datetime.now()
+    return ConversionCache(
+        cache_key=cache_key,
+        file_hash=file_hash.lower(),
+        task_type=task_type,
+        file_key=to_file_key(cache_path),
+        source_size=source_size,
+        result_size=os.path.getsize(cache_path),
+        hit_count=0,
+        created_at=now,
+        last_hit_at=now,
+    )
+
+
+def store(
+    db: Session,
+    file_hash: str,
+    source_size: int,
+    task_type: str,
+    options: Optional[dict],
+    result_path: str,
+):
+    """把转换结果写入缓存"""
+    if not settings.RESULT_CACHE_ENABLED:
+        return
+
+    db.merge(store_file(file_hash, source_size, task_type, options, result_path))
+    db.commit()
+
+
+def _delete_entry(db: Session, entry: ConversionCache):
+    path = resolve_file_key(entry.file_key)
+    if os.path.exists(path):
+        os.remove(path)
+    db.delete(entry)
+
+
+def evict(db: Session) -> int:
+    """
+    淘汰缓存
+
+    先删除超过 RESULT_CACHE_MAX_AGE_HOURS 未命中的条目，
+    再按最近命中时间从旧到新删除，直到总大小不超过 RESULT_CACHE_MAX_SIZE_MB。
+
+    Returns:
+        删除的条目数
+    """
+    evicted = 0
+    deadline = datetime.now() - timedelta(hours=settings.RESULT_CACHE_MAX_AGE_HOURS)
+
+    for entry in db.query(ConversionCache).filter(ConversionCache.last_hit_at < deadline).yield_per(500):
+        _delete_entry(db, entry)
+        evicted += 1
+    db.commit()
+
+    total_size = db.query(func.coalesce(func.sum(ConversionCache.result_size), 0)).scalar()
+    max_size = settings.RESULT_CACHE_MAX_SIZE_MB * 1024 * 1024
+
+    if total_size > max_size:
+        for entry in db.query(ConversionCache).order_by(ConversionCache.last_hit_at).yield_per(500):
+            if total_size <= max_size:
+                break
+            total_size -= entry.result_size or 0
+            _delete_entry(db, entry)
+            evicted += 1
+        db.commit()
+
+    logger.info("Result cache eviction completed", evicted=evicted, total_size=total_size)
+    return evicted
@@ -0,0 +1,167 @@
+"""
+收入台账
+
+订单数、paid 金额、refunded 金额按订单创建日期和累计（period=all）两个粒度保存在 revenue_ledger 中。
+Session 的 before_flush 监听器根据订单的新增、删除、状态和金额变化计算增量，
+在同一事务中以 UPDATE ... SET x = x + delta 的方式累加，并发写入不会互相覆盖。
+收入统计接口只读台账，查询代价与订单数量无关。
+
+监听器由 register 注册（API 启动时的 init_db 和 Celery worker 进程启动时调用）；
+台账为空（首次部署、已有历史订单）时 init_db 调用 ensure_built 从 orders 表重建。
+绕过 ORM 的批量 UPDATE / DELETE 不会触发监听器，之后需要执行 rebuild 重新计算：
+    python -m app.revenue_ledger
+"""
+from collections import defaultdict
+from datetime import datetime
+from typing import Dict, Optional, Tuple
+
+import structlog
+from sqlalchemy import case, delete, event, func, inspect, select, update
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+
+from app.models import Order, RevenueLedger
+
+logger = structlog.get_logger()
+
+ALL_TIME = "all"
+
+COUNTERS = ("total_orders", "paid_amount", "refunded_amount")
+
+_UPSERT_DIALECTS = {"sqlite": sqlite.insert, "postgresql": postgresql.insert}
+
+
+def period_of(created_at: datetime) -> str:
+    return created_at.strftime("%Y-%m-%d")
+
+
+def contribution(status: Optional[str], amount: Optional[float]) -> Tuple[int, float, float]:
+    """一个订单对 (订单数, paid 金额, refunded 金额) 的贡献"""
+    amount = amount or 0
+    return 1, amount if status == "paid" else 0, amount if status == "refunded" else 0
+
+
+def _previous(order: Order, name: str):
+    """flush 前数据库中的值"""
+    history = inspect(order).attrs[name].history
+    if history.deleted:
+        return history.deleted[0]
+    return history.unchanged[0] if history.unchanged else None
+
+
+def _add(deltas: Dict[str, list], created_at: datetime, values: Tuple[int, float, float], sign: int):
+    for period in (period_of(created_at), ALL_TIME):
+        for i, value in enumerate(values):
+            deltas[period][i] += sign * value
+
+
+def apply(session: Session, deltas: Dict[str, list]):
+    """把增量累加到台账，不存在的行先插入（SQLite / PostgreSQL 使用 ON CONFLICT）"""
+    dialect = session.get_bind().dialect.name
+    conn = session.connection()
+
+    for period, values in deltas.items():
+        if not any(values):
+            continue
+        increments = {name: getattr(RevenueLedger, name) + value for name, value in zip(COUNTERS, values)}
+
+        insert = _UPSERT_DIALECTS.get(dialect)
+        if insert is not None:
+            conn.execute(
+                insert(RevenueLedger.__table__)
+                .values(period=period, **dict(zip(COUNTERS, values)))
+                .on_conflict_do_update(index_elements=["period"], set_=increments)
+            )
+            continue
+
+        result = conn.execute(
+            update(RevenueLedger.__table__).where(RevenueLedger.period == period).values(**increments)
+        )
+        if result.rowcount == 0:
+            conn.execute(RevenueLedger.__table__.insert().values(period=period, **dict(zip(COUNTERS, values))))
+
+
+def _track_order_changes(session: Session, flush_context, instances):
+    deltas = defaultdict(lambda: [0, 0.0, 0.0])
+
+    for obj in session.new:
+        if isinstance(obj, Order):
+            # 创建时间由数据库默认值填充时拿不到，这里先赋值，保证台账日期与订单一致
+            if obj.created_at is None:
+                obj.created_at = datetime.now()
+            _add(deltas, obj.created_at, contribution(obj.status or "unpaid", obj.amount), 1)
+
+    for obj in session.dirty:
+        if isinstance(obj, Order):
+            state = inspect(obj)
+            if not (state.attrs.status.history.has_changes() or state.attrs.amount.history.has_changes()):
+                continue
+            _add(deltas, obj.created_at, contribution(_previous(obj, "status"), _previous(obj, "amount")), -1)
+            _add(deltas, obj.created_at, contribution(obj.status, obj.amount), 1)
+
+    for obj in session.deleted:
+        if isinstance(obj, Order):
+            _add(deltas, obj.created_at, contribution(_previous(obj, "status"), _previous(obj, "amount")), -1)
+
+    if deltas:
+        apply(session, deltas)
+
+
+def rebuild(db: Session) -> int:
+    """从 orders 表重新计算整个台账（不提交），返回写入的行数"""
+    day = func.date(Order.created_at)
+    rows = db.execute(
+        select(
+            day.label("period"),
+            func.count(Order.order_id).label("total_orders"),
+            func.sum(case((Order.status == "paid", Order.amount), else_=0)).label("paid_amount"),
+            func.sum(case((Order.status == "refunded", Order.amount), else_=0)).label("refunded_amount"),
+        ).group_by(day)
+    ).all()
+
+    db.execute(delete(RevenueLedger))
+    totals = [0, 0.0, 0.0]
+    for row in rows:
+        values = (row.total_orders, row.paid_amount or 0, row.refunded_amount or 0)
+        db.add(RevenueLedger(period=str(row.period), **dict(zip(COUNTERS, values))))
+        totals = [a + b for a, b in zip(totals, values)]
+    db.add(RevenueLedger(period=ALL_TIME, **dict(zip(COUNTERS, totals))))
+    return len(rows) + 1
+
+
+def register():
+    """注册订单变更时更新台账的监听器（对所有 Session 生效），重复调用只注册一次"""
+    if not event.contains(Session, "before_flush", _track_order_changes):
+        event.listen(Session, "before_flush", _track_order_changes)
+
+
+def ensure_built(db: Session) -> bool:
+    """台账为空时从 orders 表重建并提交，返回是否重建"""
+    if db.get(RevenueLedger, ALL_TIME) is not None:
+        return False
+    try:
+        count = rebuild(db)
+        db.commit()
+    except IntegrityError:
+        # 多个进程同时启动时由先提交的一个完成重建
+        db.rollback()
+        return False
+    logger.info("Revenue ledger built", rows=count)
+    return True
+
+
+def main():
+    from app.database import SessionLocal
+
+    db = SessionLocal()
+    try:
+        count = rebuild(db)
+        db.commit()
+        logger.info("Revenue ledger rebuilt", rows=count)
+    finally:
+        db.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,17 +1,23 @@
 """
 管理后台 API
 """
-from fastapi import APIRouter, Depends, HTTPException, Request
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, Response
+from fastapi.concurrency import run_in_threadpool
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
-from sqlalchemy.orm import Session
-from sqlalchemy import func, case
+from sqlalchemy import func, select
+from sqlalchemy.ext.asyncio import AsyncSession
 from pydantic import BaseModel
-from datetime import datetime, timedelta
+from datetime import date, datetime, timedelta
+from typing import Optional
 from passlib.context import CryptContext
 from jose import jwt, JWTError
 
-from app.database import get_db
-from app.models import Task, Order, SystemConfig, AdminLog
+from app import runtime_config
+from app.database import async_engine, engine, get_async_db
+from app.db_pool import pool_stats
+from app.pagination import NEXT_CURSOR_HEADER, keyset_page, split_page
+from app.models import Task, TaskStatsHourly, RevenueLedger, SystemConfig, AdminLog
+from app.revenue_ledger import ALL_TIME
 from app.config import settings
 
 router = APIRouter()
@@ -98,62 +104,123 @@ async def admin_login(login_data: AdminLogin):
 
 @router.get("/stats/daily")
 async def get_daily_stats(
-    days: int = 7, admin: str = Depends(get_current_admin), db: Session = Depends(get_db)
+    days: int = 7, admin: str = Depends(get_current_admin), db: AsyncSession = Depends(get_async_db)
 ):
-    """获取每日统计"""
+    """
+    获取每日统计（按日期倒序）
 
-    start_date = datetime.now() - timedelta(days=days)
+    读取 task_stats_hourly 汇总表，由 generate_hourly_stats 定时刷新，最多滞后一个调度周期。
+    """
 
-    # 查询任务统计
-    results = (
-        db.query(
-            func.date(Task.created_at).label("date"),
-            func.count(Task.task_id).label("total_tasks"),
-            func.sum(case((Task.status == "completed", 1), else_=0)).label("completed_tasks"),
-            func.sum(case((Task.status == "failed", 1), else_=0)).label("failed_tasks"),
-            func.sum(case((Task.is_paid == True, 1), else_=0)).label("paid_tasks"),
+    start_date = datetime.now() - timedelta(days=days)
+    day = func.date(TaskStatsHourly.hour)
+
+    results = await db.execute(
+        select(
+            day.label("date"),
+            func.sum(TaskStatsHourly.total_tasks).label("total_tasks"),
+            func.sum(TaskStatsHourly.completed_tasks).label("completed_tasks"),
+            func.sum(TaskStatsHourly.failed_tasks).label("failed_tasks"),
+            func.sum(TaskStatsHourly.paid_tasks).label("paid_tasks"),
+            func.sum(TaskStatsHourly.bytes_processed).label("bytes_processed"),
         )
-        .filter(Task.created_at >= start_date)
-        .group_by(func.date(Task.created_at))
-        .all()
+        .where(TaskStatsHourly.hour >= start_date)
+        .group_by(day)
+        .order_by(day.desc())
     )
 
     return [
         {
             "date": str(r.date),
-            "total_tasks": r.total_tasks,
+            "total_tasks": r.total_tasks or 0,
             "completed_tasks": r.completed_tasks or 0,
             "failed_tasks": r.failed_tasks or 0,
             "paid_tasks": r.paid_tasks or 0,
+            "bytes_processed": r.bytes_processed or 0,
         }
         for r in results
     ]
 
 
-@router.get("/stats/revenue")
-async def get_revenue_stats(admin: str = Depends(get_current_admin), db: Session = Depends(get_db)):
-    """获取收入统计"""
+@router.get("/stats/hourly")
+async def get_hourly_stats(
+    hours: int = 24, admin: str = Depends(get_current_admin), db: AsyncSession = Depends(get_async_db)
+):
+    """获取每小时、每种任务类型的统计（含转换耗时分位数），按时间倒序"""
 
-    # 查询订单统计
-    result = db.query(
-        func.count(Order.order_id).label("total_orders"),
-        func.sum(func.case((Order.status == "paid", Order.amount), else_=0)).label("total_revenue"),
-        func.sum(func.case((Order.status == "refunded", Order.amount), else_=0)).label("refunded_amount"),
-    ).first()
+    start_hour = datetime.now() - timedelta(hours=hours)
+    rows = await db.scalars(
+        select(TaskStatsHourly)
+        .where(TaskStatsHourly.hour >= start_hour)
+        .order_by(TaskStatsHourly.hour.desc(), TaskStatsHourly.task_type)
+    )
+
+    return [
+        {
+            "hour": r.hour.isoformat(),
+            "task_type": r.task_type,
+            "total_tasks": r.total_tasks,
+            "completed_tasks": r.completed_tasks,
+            "failed_tasks": r.failed_tasks,
+            "paid_tasks": r.paid_tasks,
+            "bytes_processed": r.bytes_processed,
+            "duration_p50": r.duration_p50,
+            "duration_p90": r.duration_p90,
+            "duration_p99": r.duration_p99,
+        }
+        for r in rows
+    ]
+
+
+@router.get("/stats/revenue")
+async def get_revenue_stats(
+    start_date: Optional[date] = None,
+    end_date: Optional[date] = None,
+    admin: str = Depends(get_current_admin),
+    db: AsyncSession = Depends(get_async_db),
+):
+    """
+    获取收入统计
+
+    读取 revenue_ledger 台账：不指定日期时返回累计值；指定时按订单创建日期汇总 [start_date, end_date]。
+    """
+
+    if start_date is None and end_date is None:
+        query = select(
+            RevenueLedger.total_orders, RevenueLedger.paid_amount, RevenueLedger.refunded_amount
+        ).where(RevenueLedger.period == ALL_TIME)
+    else:
+        if start_date and end_date and start_date > end_date:
+            raise HTTPException(status_code=400, detail="开始日期不能晚于结束日期")
+        query = select(
+            func.sum(RevenueLedger.total_orders).label("total_orders"),
+            func.sum(RevenueLedger.paid_amount).label("paid_amount"),
+            func.sum(RevenueLedger.refunded_amount).label("refunded_amount"),
+        ).where(RevenueLedger.period != ALL_TIME)
+        # 日期为 YYYY-MM-DD 字符串，字典序即时间顺序
+        if start_date:
+            query = query.where(RevenueLedger.period >= start_date.isoformat())
+        if end_date:
+            query = query.where(RevenueLedger.period <= end_date.isoformat())
+
+    result = (await db.execute(query)).first()
+    total_orders = (result.total_orders if result else 0) or 0
+    total_revenue = (result.paid_amount if result else 0) or 0
+    refunded_amount = (result.refunded_amount if result else 0) or 0
 
     return {
-        "total_orders": result.total_orders or 0,
-        "total_revenue": float(result.total_revenue or 0),
-        "refunded_amount": float(result.refunded_amount or 0),
-        "net_revenue": float((result.total_revenue or 0) - (result.refunded_amount or 0)),
+        "total_orders": total_orders,
+        "total_revenue": float(total_revenue),
+        "refunded_amount": float(refunded_amount),
+        "net_revenue": float(total_revenue - refunded_amount),
     }
 
 
 @router.get("/configs")
-async def get_configs(admin: str = Depends(get_current_admin), db: Session = Depends(get_db)):
+async def get_configs(admin: str = Depends(get_current_admin), db: AsyncSession = Depends(get_async_db)):
     """获取系统配置"""
 
-    configs = db.query(SystemConfig).all()
+    configs = await db.scalars(select(SystemConfig))
 
     return [
         {
@@ -170,15 +237,20 @@ async def update_config(
     config: ConfigUpdate,
     request: Request,
     admin: str = Depends(get_current_admin),
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
 ):
     """更新系统配置"""
 
-    existing = db.query(SystemConfig).filter(SystemConfig.config_key == config.config_key).first()
+    existing = await db.get(SystemConfig, config.config_key)
 
     if not existing:
         raise HTTPException(status_code=404, detail="配置项不存在")
 
+    try:
+        runtime_config.validate(config.config_key, config.config_value)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="配置值格式错误")
+
     old_value = existing.config_value
     existing.config_value = config.config_value
     existing.updated_at = datetime.now()
@@ -195,46 +267,78 @@ async def update_config(
     )
 
     db.add(log)
-    db.commit()
+    await db.commit()
+
+    # 本进程立即生效，其它 API / worker 进程收到通知后重新加载
+    await run_in_threadpool(runtime_config.reload)
+    await run_in_threadpool(runtime_config.publish_invalidation, config.config_key)
 
     return {"message": "配置已更新"}
 
 
 @router.get("/tasks")
 async def get_all_tasks(
-    status: str = None,
-    limit: int = 50,
+    response: Response,
+    status: Optional[str] = None,
+    client_id: Optional[str] = None,
+    task_type: Optional[str] = None,
+    is_paid: Optional[bool] = None,
+    start_date: Optional[date] = None,
+    end_date: Optional[date] = None,
+    cursor: Optional[str] = None,
+    limit: int = Query(50, ge=1, le=200),
     admin: str = Depends(get_current_admin),
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
 ):
-    """查询所有任务"""
-
-    query = db.query(Task)
+    """
+    查询所有任务（按创建时间倒序，键集分页）
+
+    - **status / client_id / task_type / is_paid**: 筛选条件
+    - **start_date / end_date**: 创建日期范围（含两端）
+    - **cursor**: 上一页响应头 X-Next-Cursor 的值，不传时返回第一页
+    """
+
+    query = select(
+        Task.task_id,
+        Task.client_id,
+        Task.file_name,
+        Task.status,
+        Task.task_type,
+        Task.is_paid,
+        Task.created_at,
+        Task.completed_at,
+    )
 
     if status:
-        query = query.filter(Task.status == status)
+        query = query.where(Task.status == status)
+    if client_id:
+        query = query.where(Task.client_id == client_id)
+    if task_type:
+        query = query.where(Task.task_type == task_type)
+    if is_paid is not None:
+        query = query.where(Task.is_paid == is_paid)
+    if start_date:
+        query = query.where(Task.created_at >= datetime.combine(start_date, datetime.min.time()))
+    if end_date:
+        query = query.where(Task.created_at < datetime.combine(end_date + timedelta(days=1), datetime.min.time()))
 
-    tasks = query.order_by(Task.created_at.desc()).limit(limit).all()
+    try:
+        query = keyset_page(query, Task.created_at, Task.task_id, cursor, limit)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="分页游标无效")
 
-    return [
-        {
-            "task_id": t.task_id,
-            "client_id": t.client_id,
-            "file_name": t.file_name,
-            "status": t.status,
-            "task_type": t.task_type,
-            "created_at": t.created_at,
-            "completed_at": t.completed_at,
-        }
-        for t in tasks
-    ]
+    rows, next_cursor = split_page((await db.execute(query)).all(), limit, "created_at", "task_id")
+    if next_cursor:
+        response.headers[NEXT_CURSOR_HEADER] = next_cursor
+
+    return [row._asdict() for row in rows]
 
 
 @router.get("/logs")
-async def get_logs(limit: int = 100, admin: str = Depends(get_current_admin), db: Session = Depends(get_db)):
+async def get_logs(limit: int = 100, admin: str = Depends(get_current_admin), db: AsyncSession = Depends(get_async_db)):
     """查询操作日志"""
 
-    logs = db.query(AdminLog).order_by(AdminLog.created_at.desc()).limit(limit).all()
+    logs = await db.scalars(select(AdminLog).order_by(AdminLog.created_at.desc()).limit(limit))
 
     return [
         {
@@ -248,3 +352,18 @@ async def get_logs(limit: int = 100, admin: str = Depends(get_current_admin), db
         }
         for log in logs
     ]
+
+
+@router.get("/metrics/db")
+async def get_db_metrics(admin: str = Depends(get_current_admin)):
+    """
+    数据库连接池指标（当前 API 进程）
+
+    saturation 为已借出连接占 pool_size + max_overflow 的比例；
+    取连接等待时间与超时次数只在 PostgreSQL 等使用 QueuePool 的部署中统计。
+    """
+    return {
+        "dialect": engine.dialect.name,
+        "sync": pool_stats(engine.pool),
+        "async": pool_stats(async_engine.pool),
+    }
@@ -1,33 +1,76 @@
 """
 任务相关 API 路由
 """
-from fastapi import APIRouter, Depends, HTTPException, Query
-from sqlalchemy.orm import Session
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, Response
+from fastapi.concurrency import run_in_threadpool
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse, StreamingResponse
+from redis import RedisError
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
 from typing import List, Optional
 from datetime import datetime, timedelta
+import asyncio
+import json
+import os
+import time
 import uuid
 
-from app.database import get_db
+import structlog
+
+from app.celery_app import convert_route
+from app.database import AsyncSessionLocal, get_async_db
 from app.models import Task
+from app.pagination import NEXT_CURSOR_HEADER, keyset_page, split_page
 from app.config import settings
-from app.tasks import convert_pdf_task
+from app.converters import parse_page_ranges
+from app.events import TERMINAL_STATUSES, task_channel
+from app.progress import read_progress
+from app.redis_client import new_async_redis
+from app.signing import signed_download_url
+from app.storage import file_sha256, resolve_file_key, retention_hours, storage_dir, to_file_key
+from app.tasks import convert_pdf_task, get_output_extension
+from app import rate_limit, result_cache, runtime_config, status_pipeline, task_cache
 from pydantic import BaseModel
 
 router = APIRouter()
+logger = structlog.get_logger()
 
 
 # Pydantic 模型
 class TaskCreate(BaseModel):
     """创建任务请求"""
 
-    file_key: str  # 文件相对路径
+    file_key: Optional[str] = None  # 文件相对路径（merge 时取 file_keys 的第一个）
     task_type: str  # pdf2word, pdf2excel, pdf2ppt, merge, split
     file_name: str
     file_size: int
     client_id: str
+    file_hash: Optional[str] = None  # 源文件 SHA-256，仅用于预查结果缓存，命中前由服务端对已上传文件重新计算
+    options: Optional[dict] = None  # split 使用 ranges，如 "1-3,5,8-"
+    file_keys: Optional[List[str]] = None  # merge 按顺序合并的文件列表
+
+
+class CacheCheckRequest(BaseModel):
+    """结果缓存查询请求"""
+
+    file_hash: str
+    file_size: int
+    task_type: str
     options: Optional[dict] = None
 
 
+class CacheCheckResponse(BaseModel):
+    """结果缓存查询响应"""
+
+    hit: bool
+
+
+# /history 可选返回的字段；task_id 和 created_at 是分页键，始终返回
+HISTORY_FIELDS = ("task_id", "status", "file_name", "created_at", "completed_at", "error_msg")
+HISTORY_DEFAULT_FIELDS = ("task_id", "status", "file_name", "created_at", "completed_at")
+
+
 class TaskResponse(BaseModel):
     """任务响应"""
 
@@ -38,13 +81,16 @@ class TaskResponse(BaseModel):
     completed_at: Optional[datetime] = None
     download_url: Optional[str] = None
     error_msg: Optional[str] = None
+    progress: Optional[float] = None  # 当前阶段完成百分比（0-100）
+    eta_seconds: Optional[int] = None  # 当前阶段预计剩余秒数
+    stage: Optional[str] = None  # 当前阶段，如 parsing、writing、rendering
 
     class Config:
         from_attributes = True
 
 
 @router.post("/tasks", response_model=TaskResponse)
-async def create_task(task_data: TaskCreate, db: Session = Depends(get_db)):
+async def create_task(task_data: TaskCreate, request: Request, db: AsyncSession = Depends(get_async_db)):
     """
     创建转换任务
 
@@ -53,28 +99,73 @@ async def create_task(task_data: TaskCreate, db: Session = Depends(get_db)):
     - **file_name**: 文件名
     - **file_size**: 文件大小（字节）
     - **client_id**: 客户端 ID
+    - **file_hash**: 源文件 SHA-256（可选），服务端对已上传文件计算的哈希与之相同且命中结果缓存时任务直接完成
+    - **file_keys**: merge 任务按顺序合并的文件列表（至少 2 个），大小限制按这些文件的总大小检查
     """
 
-    # 检查文件大小限制
+    # 按客户端和 IP 限流
+    await rate_limit.enforce_rate_limit("task", request, task_data.client_id)
+
+    if task_data.task_type == "merge":
+        if not task_data.file_keys or len(task_data.file_keys) < 2:
+            raise HTTPException(status_code=400, detail="合并至少需要 2 个文件")
+        task_data.file_key = task_data.file_keys[0]
+        # 大小限制按全部待合并文件的总大小计算
+        try:
+            task_data.file_size = await run_in_threadpool(
+                lambda: sum(os.path.getsize(resolve_file_key(key)) for key in task_data.file_keys)
+            )
+        except OSError:
+            raise HTTPException(status_code=400, detail="待合并的文件不存在")
+
+    # 检查文件大小限制（限额可在管理后台修改，读取进程内缓存）
+    config = runtime_config.current()
     file_size_mb = task_data.file_size / (1024 * 1024)
 
-    if file_size_mb > settings.MAX_FILE_SIZE_MB:
+    if file_size_mb > config.max_file_size_mb:
         raise HTTPException(
             status_code=400,
-            detail=f"文件过大，最大支持 {settings.MAX_FILE_SIZE_MB}MB",
+            detail=f"文件过大，最大支持 {config.max_file_size_mb}MB",
         )
 
     # 检查是否需要付费
     is_paid = False
-    if file_size_mb > settings.FREE_FILE_SIZE_MB:
+    if file_size_mb > config.free_file_size_mb:
         # 这里应该检查 orders 表，查看是否已付费
         # 简化处理：需要前端先调用支付接口
         raise HTTPException(
             status_code=402,
-            detail=f"文件大小超过免费限制 ({settings.FREE_FILE_SIZE_MB}MB)，请先完成支付",
+            detail=f"文件大小超过免费限制 ({config.free_file_size_mb}MB)，请先完成支付",
         )
 
-    # 创建任务
+    if task_data.task_type == "split":
+        try:
+            parse_page_ranges((task_data.options or {}).get("ranges"))
+        except ValueError:
+            raise HTTPException(status_code=400, detail="页码范围格式错误")
+
+    if not task_data.file_key:
+        raise HTTPException(status_code=400, detail="缺少 file_key")
+
+    # 查询结果缓存（merge 的结果取决于多个文件，不使用缓存）。客户端提供的哈希只用于预查，
+    # 命中的条目还要与已上传文件的实际大小和服务端计算的 SHA-256 一致，防止凭哈希取走他人的结果
+    file_hash = None
+    cache_entry = None
+    if task_data.file_hash and task_data.task_type != "merge":
+        cache_entry = await db.run_sync(
+            result_cache.lookup, task_data.file_hash, task_data.task_type, task_data.options
+        )
+        if cache_entry:
+            source_path = resolve_file_key(task_data.file_key)
+            try:
+                if await run_in_threadpool(os.path.getsize, source_path) == cache_entry.source_size:
+                    file_hash = await run_in_threadpool(file_sha256, source_path)
+            except OSError:
+                pass
+            if file_hash != cache_entry.file_hash:
+                cache_entry = None
+
+    # 创建任务（只保存服务端计算的哈希）
     task_id = str(uuid.uuid4())
     task = Task(
         task_id=task_id,
@@ -82,105 +173,302 @@ async def create_task(task_data: TaskCreate, db: Session = Depends(get_db)):
         file_name=task_data.file_name,
         file_size=task_data.file_size,
         file_key_source=task_data.file_key,
+        file_hash=file_hash,
+        merge_file_keys=json.dumps(task_data.file_keys) if task_data.task_type == "merge" else None,
         task_type=task_data.task_type,
         status="pending",
         is_paid=is_paid,
         created_at=datetime.now(),
-        expire_at=datetime.now()
-        + timedelta(hours=settings.RETENTION_PAID_HOURS if is_paid else settings.RETENTION_FREE_HOURS),
+        expire_at=datetime.now() + timedelta(hours=retention_hours(is_paid)),
     )
 
+    if cache_entry:
+        # 命中缓存：直接完成，不进入 Celery 队列；缓存文件在查询后被淘汰时按普通任务转换
+        output_filename = f"{task_id}.{get_output_extension(task_data.task_type, task_data.options)}"
+        output_path = os.path.join(storage_dir("results", output_filename, is_paid, task.expire_at), output_filename)
+        try:
+            await run_in_threadpool(result_cache.materialize, cache_entry, output_path)
+        except OSError as e:
+            logger.warning("Result cache entry unavailable", task_id=task_id, error=str(e))
+            cache_entry = None
+        else:
+            result_cache.record_hit(cache_entry)
+            task.status = "completed"
+            task.file_key_result = to_file_key(output_path)
+            task.completed_at = datetime.now()
+
+    # 需要排队的任务：目标队列积压过多时拒绝（命中缓存的任务不进入队列）
+    route = convert_route(task_data.task_type, is_paid, task_data.file_size)
+    if not cache_entry:
+        await rate_limit.enforce_admission(route["queue"])
+
     db.add(task)
-    db.commit()
-    db.refresh(task)
+    await db.commit()
+    await run_in_threadpool(task_cache.store_view, task)
 
-    # 提交到 Celery 队列
-    convert_pdf_task.delay(task_id, task_data.file_key, task_data.task_type)
+    if not cache_entry:
+        # 按付费状态和任务类型提交到对应的 Celery 队列
+        convert_pdf_task.apply_async(
+            (task_id, task_data.file_key, task_data.task_type, task_data.options, task_data.file_keys), **route
+        )
 
     return task
 
 
-@router.get("/tasks/{task_id}", response_model=TaskResponse)
-async def get_task(task_id: str, db: Session = Depends(get_db)):
+@router.post("/tasks/cache-check", response_model=CacheCheckResponse)
+async def check_result_cache(check_data: CacheCheckRequest, db: AsyncSession = Depends(get_async_db)):
     """
-    查询任务状态
+    查询结果缓存
 
-    返回任务详情，包括处理状态和下载链接
+    客户端上传前先计算文件 SHA-256 并调用此接口，命中时创建任务会直接完成；
+    文件仍需上传，创建任务时服务端会对上传的文件重新计算哈希，一致才使用缓存结果。
     """
-    task = db.query(Task).filter(Task.task_id == task_id).first()
+    entry = await db.run_sync(result_cache.lookup, check_data.file_hash, check_data.task_type, check_data.options)
+    return CacheCheckResponse(hit=entry is not None and entry.source_size == check_data.file_size)
+
+
+async def _task_event_snapshot(task_id: str) -> Optional[dict]:
+    """读取任务当前状态，格式与 worker 发布的事件一致；任务不存在时返回 None"""
+    async with AsyncSessionLocal() as db:
+        result = await db.execute(
+            select(Task.status, Task.error_msg, Task.expire_at).where(Task.task_id == task_id)
+        )
+        task = result.first()
 
     if not task:
-        raise HTTPException(status_code=404, detail="任务不存在")
+        return None
+
+    status, error_msg = task.status, task.error_msg
+    if status_pipeline.enabled():
+        overlay = await run_in_threadpool(status_pipeline.read_overlay, task_id)
+        status, error_msg = overlay.get("status", status), overlay.get("error_msg", error_msg)
 
-    # 检查是否过期
     if task.expire_at and task.expire_at < datetime.now():
-        if task.status != "expired":
+        status = "expired"
+
+    event = {"task_id": task_id, "status": status}
+    if error_msg:
+        event["error_msg"] = error_msg
+    if status == "processing":
+        event.update(await run_in_threadpool(read_progress, task_id) or {})
+    return event
+
+
+def _sse(event: dict) -> str:
+    return f"data: {json.dumps(event, ensure_ascii=False)}\n\n"
+
+
+@router.get("/tasks/{task_id}/events")
+async def task_events(task_id: str):
+    """
+    订阅任务状态（Server-Sent Events）
+
+    先推送当前状态，之后每次状态变化推送一条 `data: {"task_id", "status", "error_msg"}`，
+    处理中的进度事件额外带有 progress、eta_seconds、stage，
+    到达终态（completed、failed、expired）后关闭连接。空闲时定期发送心跳注释。
+    Redis 不可用时退化为服务端定时查库，客户端无需区分。
+    """
+    # 先订阅再读取快照，避免两步之间发生的状态变化丢失
+    redis_client = new_async_redis()
+    pubsub = redis_client.pubsub()
+    try:
+        await pubsub.subscribe(task_channel(task_id))
+    except (RedisError, OSError) as e:
+        logger.warning("Task events fallback to polling", task_id=task_id, error=str(e))
+        await pubsub.aclose()
+        await redis_client.aclose()
+        pubsub = redis_client = None
+
+    snapshot = await _task_event_snapshot(task_id)
+    if snapshot is None:
+        if pubsub is not None:
+            await pubsub.aclose()
+            await redis_client.aclose()
+        raise HTTPException(status_code=404, detail="任务不存在")
+
+    async def stream():
+        nonlocal pubsub, redis_client
+        try:
+            yield _sse(snapshot)
+            if snapshot["status"] in TERMINAL_STATUSES:
+                return
+
+            last_status = snapshot["status"]
+            started = last_sent = time.monotonic()
+
+            while time.monotonic() - started < settings.TASK_EVENTS_MAX_SECONDS:
+                event = None
+                if pubsub is not None:
+                    try:
+                        message = await pubsub.get_message(ignore_subscribe_messages=True, timeout=1.0)
+                    except (RedisError, OSError) as e:
+                        logger.warning("Task events fallback to polling", task_id=task_id, error=str(e))
+                        await pubsub.aclose()
+                        await redis_client.aclose()
+                        pubsub = redis_client = None
+                        message = None
+                    if message:
+                        event = json.loads(message["data"])
+                else:
+                    await asyncio.sleep(settings.TASK_EVENTS_POLL_SECONDS)
+                    event = await _task_event_snapshot(task_id)
+                    if event is None:
+                        # 任务已被删除
+                        return
+
+                if (
+                    pubsub is not None
+                    and not event
+                    and time.monotonic() - last_sent >= settings.TASK_EVENTS_HEARTBEAT_SECONDS
+                ):
+                    # 发布的事件可能丢失（worker 发布失败、订阅连接闪断）：心跳时重新读取一次状态，有变化则直接推送
+                    event = await _task_event_snapshot(task_id)
+                    if event is None:
+                        return
+
+                # 状态变化和进度事件都推送
+                if event and (event["status"] != last_status or "progress" in event):
+                    yield _sse(event)
+                    last_status = event["status"]
+                    last_sent = time.monotonic()
+                    if last_status in TERMINAL_STATUSES:
+                        return
+                elif time.monotonic() - last_sent >= settings.TASK_EVENTS_HEARTBEAT_SECONDS:
+                    yield ": ping\n\n"
+                    last_sent = time.monotonic()
+        finally:
+            if pubsub is not None:
+                await pubsub.aclose()
+                await redis_client.aclose()
+
+    return StreamingResponse(
+        stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+@router.get("/tasks/{task_id}", response_model=TaskResponse)
+async def get_task(task_id: str, db: AsyncSession = Depends(get_async_db)):
+    """
+    查询任务状态
+
+    返回任务详情，包括处理状态和下载链接。优先读取 Redis 中的任务缓存，未命中时查库并回填。
+    """
+    view = await run_in_threadpool(task_cache.get_view, task_id)
+
+    if view is None:
+        task = await db.get(Task, task_id)
+        view = task_cache.to_view(task) if task else None
+
+        if view and status_pipeline.enabled():
+            # 合并尚未落库的状态
+            overlay = await run_in_threadpool(status_pipeline.read_overlay, task_id)
+            view.update((name, value) for name, value in overlay.items() if name in view)
+
+        await run_in_threadpool(task_cache.fill_view, task_id, view)
+
+        if task and task.expire_at and task.expire_at < datetime.now() and task.status != "expired":
             task.status = "expired"
-            db.commit()
+            await db.commit()
+
+        view = view or task_cache.MISSING
 
+    if view == task_cache.MISSING:
+        raise HTTPException(status_code=404, detail="任务不存在")
+
+    # 检查是否过期
+    if view["expire_at"] and view["expire_at"] < datetime.now():
         raise HTTPException(status_code=410, detail="文件已过期")
 
     response = TaskResponse(
-        task_id=task.task_id,
-        status=task.status,
-        file_name=task.file_name,
-        created_at=task.created_at,
-        completed_at=task.completed_at,
-        error_msg=task.error_msg,
+        task_id=view["task_id"],
+        status=view["status"],
+        file_name=view["file_name"],
+        created_at=view["created_at"],
+        completed_at=view["completed_at"],
+        error_msg=view["error_msg"],
     )
 
+    if view["status"] == "processing":
+        # 进度只在 Redis 中，不读写 tasks 表
+        progress = await run_in_threadpool(read_progress, task_id)
+        if progress:
+            response.progress = progress["progress"]
+            response.eta_seconds = progress["eta_seconds"]
+            response.stage = progress["stage"]
+    elif view["status"] == "completed":
+        response.progress = 100
+        response.eta_seconds = 0
+
     # 如果任务完成，生成下载链接
-    if task.status == "completed" and task.file_key_result:
-        response.download_url = f"/api/v1/download/{task.task_id}"
+    if view["status"] == "completed" and view["file_key_result"]:
+        if settings.DOWNLOAD_URL_MODE == "signed" and view["expire_at"]:
+            # 签名直链：由 nginx 或 /files 路由校验，下载时不再查询数据库
+            response.download_url = signed_download_url(
+                view["file_key_result"], view["completed_at"] or view["created_at"], view["expire_at"]
+            )
+        else:
+            response.download_url = f"/api/v1/download/{task_id}"
 
     return response
 
 
 @router.get("/history", response_model=List[TaskResponse])
 async def get_history(
+    response: Response,
     client_id: str = Query(..., description="客户端 ID"),
     limit: int = Query(10, ge=1, le=50),
-    db: Session = Depends(get_db),
+    cursor: Optional[str] = Query(None, description="上一页响应头 X-Next-Cursor 的值"),
+    fields: Optional[str] = Query(None, description="逗号分隔的返回字段，如 task_id,status"),
+    db: AsyncSession = Depends(get_async_db),
 ):
     """
     查询历史记录
 
-    仅返回付费用户的历史记录
+    仅返回付费用户的历史记录，按创建时间倒序；还有下一页时响应头 X-Next-Cursor 为下一页游标。
+    经 (client_id, is_paid, created_at, task_id) 索引按游标读取，每页耗时与历史记录总数无关。
+    指定 fields 时只查询并返回这些字段（task_id 和 created_at 始终返回）。
     """
-    tasks = (
-        db.query(Task)
-        .filter(Task.client_id == client_id, Task.is_paid == True)
-        .order_by(Task.created_at.desc())
-        .limit(limit)
-        .all()
-    )
+    names = HISTORY_DEFAULT_FIELDS
+    if fields:
+        requested = {name.strip() for name in fields.split(",") if name.strip()}
+        if not requested <= set(HISTORY_FIELDS):
+            raise HTTPException(status_code=400, detail=f"不支持的字段，可选: {', '.join(HISTORY_FIELDS)}")
+        names = tuple(name for name in HISTORY_FIELDS if name in requested | {"task_id", "created_at"})
 
-    return [
-        TaskResponse(
-            task_id=t.task_id,
-            status=t.status,
-            file_name=t.file_name,
-            created_at=t.created_at,
-            completed_at=t.completed_at,
-        )
-        for t in tasks
-    ]
+    query = select(*(getattr(Task, name) for name in names)).where(Task.client_id == client_id, Task.is_paid == True)
+    try:
+        query = keyset_page(query, Task.created_at, Task.task_id, cursor, limit)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="分页游标无效")
+
+    rows, next_cursor = split_page((await db.execute(query)).all(), limit, "created_at", "task_id")
+    headers = {NEXT_CURSOR_HEADER: next_cursor} if next_cursor else {}
+
+    if fields:
+        # 投影结果不套用 TaskResponse，未请求的字段不出现在响应中
+        return JSONResponse(jsonable_encoder([row._asdict() for row in rows]), headers=headers)
+
+    response.headers.update(headers)
+    return [TaskResponse(**row._asdict()) for row in rows]
 
 
 @router.delete("/tasks/{task_id}")
-async def delete_task(task_id: str, client_id: str = Query(...), db: Session = Depends(get_db)):
+async def delete_task(task_id: str, client_id: str = Query(...), db: AsyncSession = Depends(get_async_db)):
     """
     删除任务
 
     用户可以主动删除自己的任务
     """
-    task = db.query(Task).filter(Task.task_id == task_id, Task.client_id == client_id).first()
+    task = await db.scalar(select(Task).where(Task.task_id == task_id, Task.client_id == client_id))
 
     if not task:
         raise HTTPException(status_code=404, detail="任务不存在")
 
     # 更新状态为 expired
     task.status = "expired"
-    db.commit()
+    await db.commit()
+    await run_in_threadpool(task_cache.store_view, task)
 
     return {"message": "任务已删除"}
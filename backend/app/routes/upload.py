@@ -1,18 +1,44 @@
 """
 文件上传相关 API
 """
-from fastapi import APIRouter, HTTPException, UploadFile, File
-from fastapi.responses import FileResponse
+from fastapi import APIRouter, HTTPException, Query, Request
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import Response
 from pydantic import BaseModel
-from datetime import datetime
+from datetime import datetime, timedelta
+from typing import AsyncIterator, List, Optional, Tuple
+from multipart import multipart
+from multipart.multipart import parse_options_header
+from urllib.parse import quote
 import os
-import uuid
 import shutil
+import time
+import uuid
 
+from app import rate_limit, runtime_config, status_pipeline
 from app.config import settings
+from app.responses import content_disposition, file_response
+from app.signing import SIGNED_DOWNLOAD_PREFIX, is_expired, verify_signature
+from app.storage import (
+    UPLOAD_SESSION_DATA,
+    FileTooLargeError,
+    StreamingFileWriter,
+    file_sha256,
+    load_upload_session,
+    save_upload_session,
+    storage_dir,
+    to_file_key,
+    upload_session_dir,
+)
 
 router = APIRouter()
 
+# multipart 边界和字段头部的预留字节数，用于按 Content-Length 提前拒绝
+MULTIPART_OVERHEAD_BYTES = 64 * 1024
+
+# 正在完成的分片上传会话目录后缀
+COMPLETING_SUFFIX = ".completing"
+
 
 class UploadResponse(BaseModel):
     """上传响应"""
@@ -20,114 +46,453 @@ class UploadResponse(BaseModel):
     file_key: str
     filename: str
     size: int
+    sha256: str
     upload_time: str
 
 
+class _MultipartFileReceiver:
+    """
+    流式解析 multipart 请求体
+
+    只处理第一个文件字段，数据直接写入最终存储路径，不经过 Starlette 的临时文件。
+    解析器回调是同步的，这里先收集事件，再在 receive() 中异步消费。
+    """
+
+    def __init__(self, boundary: bytes, max_bytes: int):
+        self.max_bytes = max_bytes
+        self.filename: Optional[str] = None
+        self.writer: Optional[StreamingFileWriter] = None
+        self._header_field = b""
+        self._header_value = b""
+        self._content_disposition = b""
+        self._in_file_part = False
+        self._file_done = False
+        self._complete = False
+        self._events: List[Tuple[str, bytes]] = []
+        self._parser = multipart.MultipartParser(
+            boundary,
+            {
+                "on_part_begin": self._on_part_begin,
+                "on_part_data": self._on_part_data,
+                "on_part_end": self._on_part_end,
+                "on_header_field": self._on_header_field,
+                "on_header_value": self._on_header_value,
+                "on_header_end": self._on_header_end,
+                "on_headers_finished": self._on_headers_finished,
+                "on_end": self._on_end,
+            },
+        )
+
+    def _on_part_begin(self):
+        self._content_disposition = b""
+
+    def _on_header_field(self, data: bytes, start: int, end: int):
+        self._header_field += data[start:end]
+
+    def _on_header_value(self, data: bytes, start: int, end: int):
+        self._header_value += data[start:end]
+
+    def _on_header_end(self):
+        if self._header_field.lower() == b"content-disposition":
+            self._content_disposition = self._header_value
+        self._header_field = b""
+        self._header_value = b""
+
+    def _on_headers_finished(self):
+        _, options = parse_options_header(self._content_disposition)
+        self._in_file_part = (
+            not self._file_done and options.get(b"name") == b"file" and b"filename" in options
+        )
+        if self._in_file_part:
+            self._events.append(("begin", options[b"filename"]))
+
+    def _on_part_data(self, data: bytes, start: int, end: int):
+        if self._in_file_part:
+            self._events.append(("data", data[start:end]))
+
+    def _on_part_end(self):
+        if self._in_file_part:
+            self._events.append(("end", b""))
+            self._in_file_part = False
+            self._file_done = True
+
+    def _on_end(self):
+        self._complete = True
+
+    async def receive(self, stream: AsyncIterator[bytes], now: datetime, is_paid: bool):
+        """
+        消费请求体，文件写入 uploads 下的存储目录（见 storage_dir）
+
+        Raises:
+            ValueError: 请求体在结束边界之前中断（已写入的文件会被删除）
+        """
+        try:
+            async for chunk in stream:
+                self._parser.write(chunk)
+                for event, data in self._events:
+                    if event == "begin":
+                        self.filename = data.decode("utf-8", errors="replace")
+                        name = f"{uuid.uuid4().hex}{os.path.splitext(self.filename)[1]}"
+                        file_path = os.path.join(storage_dir("uploads", name, is_paid, now=now), name)
+                        self.writer = StreamingFileWriter(file_path, self.max_bytes)
+                        await self.writer.open()
+                    elif event == "data":
+                        await self.writer.write(data)
+                    else:
+                        await self.writer.close()
+                self._events.clear()
+            self._parser.finalize()
+            # 解析器不校验结束边界，连接中断时请求体会提前结束，不能当作完整文件返回
+            if not self._complete:
+                raise ValueError("Multipart body ended before the closing boundary")
+        except BaseException:
+            if self.writer is not None:
+                await self.writer.abort()
+            raise
+
+
 @router.post("/upload", response_model=UploadResponse)
-async def upload_file(file: UploadFile = File(...)):
+async def upload_file(request: Request, client_id: Optional[str] = Query(None, description="客户端 ID，用于限流")):
     """
     上传文件到本地存储
 
-    Args:
-        file: 上传的文件
+    请求体为 multipart/form-data，文件字段名为 file。
+    文件边接收边写入最终路径，超过大小限制立即中止，同时计算 SHA-256。
+    按 client_id 和 IP 限流，超过限额返回 429。
 
     Returns:
         文件信息
     """
+    await rate_limit.enforce_rate_limit("upload", request, client_id)
+
+    config = runtime_config.current()
+    max_bytes = config.max_file_size_mb * 1024 * 1024
+    too_large = HTTPException(
+        status_code=400,
+        detail=f"文件过大，最大支持 {config.max_file_size_mb}MB",
+    )
+
+    # 声明的请求体已超限（预留 multipart 头部开销）时直接拒绝，不读取数据
+    content_length = request.headers.get("content-length")
+    if content_length and content_length.isdigit() and int(content_length) > max_bytes + MULTIPART_OVERHEAD_BYTES:
+        raise too_large
+
+    _, params = parse_options_header(request.headers.get("content-type", ""))
+    boundary = params.get(b"boundary")
+    if not boundary:
+        raise HTTPException(status_code=400, detail="请求格式错误，需使用 multipart/form-data")
+
+    # 保留类别按声明的大小判断（超过免费额度的文件需付费），无法判断时按较长的付费保留时间存放
+    free_bytes = config.free_file_size_mb * 1024 * 1024
+    is_paid = not (content_length and content_length.isdigit() and int(content_length) <= free_bytes)
+
+    now = datetime.now()
+    receiver = _MultipartFileReceiver(boundary, max_bytes)
+
+    try:
+        await receiver.receive(request.stream(), now, is_paid)
+    except FileTooLargeError:
+        raise too_large
+    except OSError as e:
+        raise HTTPException(status_code=500, detail=f"文件保存失败: {str(e)}")
+    except ValueError:
+        raise HTTPException(status_code=400, detail="请求格式错误")
+
+    if receiver.writer is None:
+        raise HTTPException(status_code=400, detail="未找到上传文件")
+
+    return UploadResponse(
+        file_key=to_file_key(receiver.writer.path),
+        filename=receiver.filename,
+        size=receiver.writer.size,
+        sha256=receiver.writer.sha256,
+        upload_time=now.isoformat()
+    )
+
+
+class UploadSessionCreate(BaseModel):
+    """创建分片上传会话请求"""
+
+    filename: str
+    size: int
+
+
+class UploadSessionComplete(BaseModel):
+    """完成分片上传请求"""
+
+    sha256: Optional[str] = None  # 可选，提供时校验整个文件
+
+
+class UploadSessionResponse(BaseModel):
+    """分片上传会话状态"""
+
+    upload_id: str
+    filename: str
+    size: int
+    offset: int  # 已连续接收的字节数，客户端从这里续传
+    chunk_size: int
+    expire_at: str
+
+
+def _session_response(meta: dict) -> UploadSessionResponse:
+    return UploadSessionResponse(
+        upload_id=meta["upload_id"],
+        filename=meta["filename"],
+        size=meta["size"],
+        offset=meta["offset"],
+        chunk_size=settings.UPLOAD_CHUNK_SIZE_MB * 1024 * 1024,
+        expire_at=meta["expire_at"],
+    )
+
+
+async def _get_active_session(upload_id: str) -> dict:
+    meta = await run_in_threadpool(load_upload_session, upload_id)
+    if not meta or datetime.fromisoformat(meta["expire_at"]) < datetime.now():
+        raise HTTPException(status_code=404, detail="上传会话不存在或已过期")
+    return meta
+
+
+def _init_upload_session(meta: dict):
+    """创建会话目录、元数据和空的数据文件（阻塞调用）"""
+    session_dir = upload_session_dir(meta["upload_id"])
+    os.makedirs(session_dir)
+    save_upload_session(meta)
+    open(os.path.join(session_dir, UPLOAD_SESSION_DATA), "wb").close()
+
+
+@router.post("/upload/sessions", response_model=UploadSessionResponse)
+async def create_upload_session(
+    session_data: UploadSessionCreate,
+    request: Request,
+    client_id: Optional[str] = Query(None, description="客户端 ID，用于限流"),
+):
+    """
+    创建分片上传会话
 
-    # 检查文件大小
-    file.file.seek(0, 2)  # 移动到文件末尾
-    file_size = file.file.tell()
-    file.file.seek(0)  # 重置到开头
+    之后按 offset 依次 PUT 分片，全部上传后调用 complete 得到 file_key。
+    与普通上传共用限流额度（按会话计数，分片不计数）。
+    """
+    await rate_limit.enforce_rate_limit("upload", request, client_id)
 
-    file_size_mb = file_size / (1024 * 1024)
+    if session_data.size <= 0:
+        raise HTTPException(status_code=400, detail="文件大小无效")
 
-    if file_size_mb > settings.MAX_FILE_SIZE_MB:
+    max_file_size_mb = runtime_config.current().max_file_size_mb
+    if session_data.size > max_file_size_mb * 1024 * 1024:
         raise HTTPException(
             status_code=400,
-            detail=f"文件过大，最大支持 {settings.MAX_FILE_SIZE_MB}MB",
+            detail=f"文件过大，最大支持 {max_file_size_mb}MB",
         )
 
-    # 生成文件存储路径
     now = datetime.now()
-    upload_dir = os.path.join(
-        settings.STORAGE_BASE_PATH,
-        "uploads",
-        str(now.year),
-        f"{now.month:02d}",
-        f"{now.day:02d}"
-    )
+    meta = {
+        "upload_id": uuid.uuid4().hex,
+        "filename": session_data.filename,
+        "size": session_data.size,
+        "offset": 0,
+        "created_at": now.isoformat(),
+        "expire_at": (now + timedelta(hours=settings.UPLOAD_SESSION_EXPIRE_HOURS)).isoformat(),
+    }
+
+    await run_in_threadpool(_init_upload_session, meta)
+
+    return _session_response(meta)
+
 
-    # 确保目录存在
-    os.makedirs(upload_dir, exist_ok=True)
+@router.get("/upload/sessions/{upload_id}", response_model=UploadSessionResponse)
+async def get_upload_session(upload_id: str):
+    """查询分片上传进度，断线后据此续传"""
+    return _session_response(await _get_active_session(upload_id))
 
-    # 生成唯一文件名
-    file_ext = os.path.splitext(file.filename)[1]
-    file_key = f"{uuid.uuid4().hex}{file_ext}"
-    file_path = os.path.join(upload_dir, file_key)
 
-    # 保存文件
+@router.put("/upload/sessions/{upload_id}", response_model=UploadSessionResponse)
+async def append_upload_chunk(upload_id: str, request: Request, offset: int = Query(..., ge=0)):
+    """
+    上传一个分片
+
+    请求体为分片原始字节，写入文件的 offset 位置。
+    offset 不能超过已接收字节数；重复发送已接收过的分片是安全的（原位覆盖相同内容）。
+    """
+    meta = await _get_active_session(upload_id)
+
+    if offset > meta["offset"]:
+        raise HTTPException(
+            status_code=409,
+            detail={"message": "分片不连续，请从 offset 处续传", "offset": meta["offset"]},
+        )
+
+    max_bytes = min(meta["size"] - offset, settings.UPLOAD_CHUNK_SIZE_MB * 1024 * 1024)
+    data_path = os.path.join(upload_session_dir(upload_id), UPLOAD_SESSION_DATA)
+    writer = StreamingFileWriter(data_path, max_bytes, offset=offset)
+
     try:
-        with open(file_path, "wb") as buffer:
-            shutil.copyfileobj(file.file, buffer)
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"文件保存失败: {str(e)}")
+        await writer.open()
+        async for chunk in request.stream():
+            await writer.write(chunk)
+        await writer.close()
+    except FileTooLargeError:
+        await writer.abort()
+        raise HTTPException(status_code=400, detail="分片超出文件大小或单片大小限制")
+    except FileNotFoundError:
+        # 会话在此期间被完成或清理
+        await writer.abort()
+        raise HTTPException(status_code=404, detail="上传会话不存在或已过期")
+    except BaseException:
+        await writer.abort()
+        raise
+
+    # 重新读取，避免覆盖并发请求已推进的 offset
+    meta = await run_in_threadpool(load_upload_session, upload_id) or meta
+    meta["offset"] = max(meta["offset"], offset + writer.size)
+    meta["expire_at"] = (datetime.now() + timedelta(hours=settings.UPLOAD_SESSION_EXPIRE_HOURS)).isoformat()
+    try:
+        await run_in_threadpool(save_upload_session, meta)
+    except FileNotFoundError:
+        raise HTTPException(status_code=404, detail="上传会话不存在或已过期")
+
+    return _session_response(meta)
 
-    # 返回相对路径作为 file_key
-    relative_path = os.path.relpath(file_path, settings.STORAGE_BASE_PATH)
+
+@router.post("/upload/sessions/{upload_id}/complete", response_model=UploadResponse)
+async def complete_upload_session(upload_id: str, complete_data: Optional[UploadSessionComplete] = None):
+    """
+    完成分片上传
+
+    文件移动到 uploads 下的存储目录，返回的 file_key 可直接用于创建任务。
+    并发的 complete 请求中只有一个能取得会话，其余返回 409。
+    """
+    meta = await _get_active_session(upload_id)
+
+    if meta["offset"] != meta["size"]:
+        raise HTTPException(
+            status_code=409,
+            detail={"message": "文件尚未上传完整", "offset": meta["offset"]},
+        )
+
+    # 先把会话目录原子重命名为 <upload_id>.completing 取得会话，之后的查询、续传和 complete 都找不到该会话；
+    # 校验失败时改回原名，客户端可以重新上传分片后再次完成。残留的目录由 cleanup_stale_uploads 按修改时间清理
+    session_dir = upload_session_dir(upload_id)
+    claimed_dir = f"{session_dir}{COMPLETING_SUFFIX}"
+    try:
+        await run_in_threadpool(os.rename, session_dir, claimed_dir)
+    except FileNotFoundError:
+        raise HTTPException(status_code=409, detail="上传会话已完成或正在完成")
+
+    data_path = os.path.join(claimed_dir, UPLOAD_SESSION_DATA)
+    try:
+        sha256 = await run_in_threadpool(file_sha256, data_path)
+        if complete_data and complete_data.sha256 and complete_data.sha256.lower() != sha256:
+            raise HTTPException(status_code=400, detail="文件校验失败，SHA-256 不匹配")
+
+        now = datetime.now()
+        name = f"{uuid.uuid4().hex}{os.path.splitext(meta['filename'])[1]}"
+        is_paid = meta["size"] > runtime_config.current().free_file_size_mb * 1024 * 1024
+        file_path = os.path.join(storage_dir("uploads", name, is_paid, now=now), name)
+
+        # 同一文件系统内重命名，不复制数据
+        await run_in_threadpool(os.replace, data_path, file_path)
+    except BaseException:
+        await run_in_threadpool(os.rename, claimed_dir, session_dir)
+        raise
+
+    await run_in_threadpool(shutil.rmtree, claimed_dir, True)
 
     return UploadResponse(
-        file_key=relative_path.replace("\\", "/"),  # 统一使用斜杠
-        filename=file.filename,
-        size=file_size,
+        file_key=to_file_key(file_path),
+        filename=meta["filename"],
+        size=meta["size"],
+        sha256=sha256,
         upload_time=now.isoformat()
     )
 
 
-@router.get("/download/{task_id}")
-async def download_file(task_id: str):
+@router.api_route("/download/{task_id}", methods=["GET", "HEAD"])
+async def download_file(task_id: str, request: Request):
     """
     下载转换后的文件
 
+    支持 ETag / Last-Modified 条件请求（304）和单段、多段 Range 断点续传。
+
     Args:
         task_id: 任务 ID
 
     Returns:
         文件下载响应
     """
-    from app.database import SessionLocal
+    from app.database import AsyncSessionLocal
     from app.models import Task
 
-    db = SessionLocal()
-
-    try:
+    async with AsyncSessionLocal() as db:
         # 查询任务
-        task = db.query(Task).filter(Task.task_id == task_id).first()
+        task = await db.get(Task, task_id)
 
         if not task:
             raise HTTPException(status_code=404, detail="任务不存在")
 
-        if task.status != "completed":
+        status, file_key_result = task.status, task.file_key_result
+        if status_pipeline.enabled():
+            # 合并尚未落库的状态
+            overlay = await run_in_threadpool(status_pipeline.read_overlay, task_id)
+            status = overlay.get("status", status)
+            file_key_result = overlay.get("file_key_result", file_key_result)
+
+        if status != "completed":
             raise HTTPException(status_code=400, detail="任务未完成")
 
         # 检查文件是否过期
-        if task.expire_at and task.expire_at < datetime.now():
+        now = datetime.now()
+        if task.expire_at and task.expire_at < now:
             raise HTTPException(status_code=410, detail="文件已过期")
 
-        # 构建文件路径
-        file_path = os.path.join(settings.STORAGE_BASE_PATH, task.file_key_result)
+        max_age = (task.expire_at - now).total_seconds() if task.expire_at else None
 
-        if not os.path.exists(file_path):
-            raise HTTPException(status_code=404, detail="文件不存在")
+    # 构建文件路径
+    file_path = os.path.join(settings.STORAGE_BASE_PATH, file_key_result)
 
-        # 获取文件名
-        filename = f"{task_id}.{task.file_key_result.split('.')[-1]}"
+    # 获取文件名
+    filename = f"{task_id}.{file_key_result.split('.')[-1]}"
 
-        return FileResponse(
-            path=file_path,
-            filename=filename,
-            media_type="application/octet-stream"
+    try:
+        return await file_response(request, file_path, filename=filename, max_age=max_age)
+    except FileNotFoundError:
+        raise HTTPException(status_code=404, detail="文件不存在")
+
+
+@router.api_route("/files/{file_key:path}", methods=["GET", "HEAD"])
+async def download_signed_file(
+    file_key: str,
+    request: Request,
+    st: str = Query(..., description="签名"),
+    ts: int = Query(..., description="签发时间（Unix 秒）"),
+    e: int = Query(..., description="有效期（秒）"),
+):
+    """
+    通过签名链接下载文件
+
+    只校验签名和有效期，不访问数据库。nginx 装有 secure_link_hmac 模块时这个路径由 nginx 直接处理，
+    否则由这里校验；配置了 DOWNLOAD_ACCEL_REDIRECT_PREFIX 时通过 X-Accel-Redirect 交给 nginx 发送文件。
+    """
+    if not verify_signature(SIGNED_DOWNLOAD_PREFIX + file_key, st, ts, e) or ".." in file_key.split("/"):
+        raise HTTPException(status_code=403, detail="下载链接无效")
+
+    if is_expired(ts, e):
+        raise HTTPException(status_code=410, detail="文件已过期")
+
+    filename = os.path.basename(file_key)
+    max_age = ts + e - int(time.time())
+
+    if settings.DOWNLOAD_ACCEL_REDIRECT_PREFIX:
+        return Response(
+            headers={
+                "X-Accel-Redirect": settings.DOWNLOAD_ACCEL_REDIRECT_PREFIX.rstrip("/") + "/" + quote(file_key),
+                "Content-Disposition": content_disposition(filename),
+                "Cache-Control": f"public, max-age={max_age}",
+            }
         )
 
-    finally:
-        db.close()
+    try:
+        return await file_response(
+            request, os.path.join(settings.STORAGE_BASE_PATH, file_key), filename=filename, max_age=max_age
+        )
+    except FileNotFoundError:
+        raise HTTPException(status_code=404, detail="文件不存在")
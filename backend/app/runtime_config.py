@@ -0,0 +1,151 @@
+"""
+运行时配置
+
+system_configs 表中可由管理后台修改的限额（文件大小、保留时间等）缓存在进程内，
+热路径通过 current() 读取，不访问数据库。表中没有的项使用 Settings 中的默认值。
+
+每个进程（API、Celery worker）首次读取时启动一个后台线程：
+- 订阅 Redis 频道 RUNTIME_CONFIG_CHANNEL，update_config 修改配置后发布消息，收到即重新加载；
+- 超过 RUNTIME_CONFIG_TTL_SECONDS 没有收到消息也重新加载一次，Redis 不可用时仍能在 TTL 内生效。
+"""
+import os
+import threading
+import time
+from typing import Optional
+
+import redis
+import structlog
+from pydantic import BaseModel, ValidationError
+from redis import RedisError
+from sqlalchemy import select
+
+from app.config import settings
+from app.redis_client import get_redis
+
+logger = structlog.get_logger()
+
+
+class RuntimeConfig(BaseModel):
+    """可热更新的配置项，字段名与 system_configs.config_key 一致"""
+
+    max_file_size_mb: int = settings.MAX_FILE_SIZE_MB
+    free_file_size_mb: int = settings.FREE_FILE_SIZE_MB
+    retention_free_hours: int = settings.RETENTION_FREE_HOURS
+    retention_paid_hours: int = settings.RETENTION_PAID_HOURS
+    price_large_file: float = 5.0
+    daily_free_quota_gb: float = 100
+    # 令牌桶限流（上传、创建任务分别计数），每分钟补充的令牌数为 0 时不限制
+    rate_limit_client_per_minute: float = 30
+    rate_limit_client_burst: int = 10
+    rate_limit_ip_per_minute: float = 60
+    rate_limit_ip_burst: int = 20
+    # 转换队列积压超过该长度时拒绝新任务，0 表示不限制
+    queue_max_depth: int = 200
+
+    class Config:
+        frozen = True
+
+
+_config: Optional[RuntimeConfig] = None
+_loaded_at = 0.0
+_watcher_pid: Optional[int] = None
+_lock = threading.Lock()
+
+
+def validate(key: str, value: str):
+    """
+    校验单个配置值
+
+    Raises:
+        ValueError: key 是运行时配置项但 value 无法转换为对应类型
+    """
+    if key in RuntimeConfig.model_fields:
+        try:
+            RuntimeConfig(**{key: value})
+        except ValidationError as e:
+            raise ValueError(f"Invalid value for {key}: {value}") from e
+
+
+def load() -> RuntimeConfig:
+    """从数据库读取配置，格式错误的项保留默认值"""
+    from app.database import SessionLocal
+    from app.models import SystemConfig
+
+    db = SessionLocal()
+    try:
+        rows = db.execute(
+            select(SystemConfig.config_key, SystemConfig.config_value).where(
+                SystemConfig.config_key.in_(list(RuntimeConfig.model_fields))
+            )
+        ).all()
+    finally:
+        db.close()
+
+    values = {}
+    for key, value in rows:
+        try:
+            validate(key, value)
+        except ValueError:
+            logger.warning("Invalid runtime config ignored", key=key, value=value)
+            continue
+        values[key] = value
+    return RuntimeConfig(**values)
+
+
+def reload() -> RuntimeConfig:
+    """重新加载配置；数据库不可用时保留当前配置"""
+    global _config, _loaded_at
+    try:
+        _config = load()
+        _loaded_at = time.monotonic()
+    except Exception as e:
+        logger.error("Failed to load runtime config", error=str(e))
+        if _config is None:
+            _config = RuntimeConfig()
+    return _config
+
+
+def _watch():
+    """后台线程：收到失效消息或 TTL 到期时重新加载"""
+    ttl = settings.RUNTIME_CONFIG_TTL_SECONDS
+    while True:
+        try:
+            client = redis.Redis.from_url(
+                settings.REDIS_URL,
+                decode_responses=True,
+                socket_connect_timeout=settings.REDIS_SOCKET_TIMEOUT,
+                health_check_interval=ttl,
+            )
+            pubsub = client.pubsub(ignore_subscribe_messages=True)
+            pubsub.subscribe(settings.RUNTIME_CONFIG_CHANNEL)
+            # 订阅建立前可能错过了失效消息
+            reload()
+            while True:
+                message = pubsub.get_message(timeout=max(ttl - (time.monotonic() - _loaded_at), 0.1))
+                if message or time.monotonic() - _loaded_at >= ttl:
+                    reload()
+        except RedisError as e:
+            logger.warning("Runtime config watcher disconnected, fallback to TTL reload", error=str(e))
+            time.sleep(ttl)
+            reload()
+
+
+def current() -> RuntimeConfig:
+    """当前配置（进程内缓存，不访问数据库；首次调用时同步加载并启动后台监听）"""
+    global _watcher_pid
+    if _watcher_pid != os.getpid():
+        with _lock:
+            # fork 出的子进程不会继承父进程的线程，按进程启动
+            if _watcher_pid != os.getpid():
+                reload()
+                threading.Thread(target=_watch, name="runtime-config-watcher", daemon=True).start()
+                _watcher_pid = os.getpid()
+    return _config
+
+
+def publish_invalidation(key: str):
+    """通知所有进程重新加载配置（Redis 不可用时由各进程的 TTL 兜底）"""
+    try:
+        get_redis().publish(settings.RUNTIME_CONFIG_CHANNEL, key)
+    except RedisError as e:
+        logger.warning("Failed to publish runtime config invalidation", key=key, error=str(e))
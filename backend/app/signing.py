@@ -0,0 +1,54 @@
+"""
+下载链接签名
+
+签名格式与 nginx 的 secure_link_hmac 模块一致，反向代理可以直接校验并返回文件，不经过应用：
+
+    st = base64url(HMAC-SHA256(secret, "<uri>|<ts>|<e>"))，去掉末尾的 =
+    ts = 签发时间（Unix 秒），e = 有效期（秒）
+"""
+import base64
+import hashlib
+import hmac
+import time
+from datetime import datetime
+from typing import Optional
+from urllib.parse import quote
+
+from app.config import settings
+
+# 签名下载链接的路径前缀，后接 file_key
+SIGNED_DOWNLOAD_PREFIX = "/api/v1/files/"
+
+
+def _secret() -> bytes:
+    return (settings.DOWNLOAD_URL_SECRET or settings.JWT_SECRET).encode("utf-8")
+
+
+def make_signature(uri: str, ts: int, e: int) -> str:
+    """计算签名"""
+    message = f"{uri}|{ts}|{e}".encode("utf-8")
+    digest = hmac.new(_secret(), message, hashlib.sha256).digest()
+    return base64.urlsafe_b64encode(digest).decode("ascii").rstrip("=")
+
+
+def signed_download_url(file_key: str, issued_at: datetime, expire_at: datetime) -> str:
+    """
+    生成签名下载链接
+
+    签发时间取任务完成时间而不是当前时间，同一任务每次查询得到相同的 URL，便于 CDN 缓存。
+    签名使用解码后的路径（与 nginx 的 $uri 一致），链接中使用编码后的路径。
+    """
+    uri = SIGNED_DOWNLOAD_PREFIX + file_key
+    ts = int(issued_at.timestamp())
+    e = max(int(expire_at.timestamp()) - ts, 0)
+    return f"{SIGNED_DOWNLOAD_PREFIX}{quote(file_key)}?st={make_signature(uri, ts, e)}&ts={ts}&e={e}"
+
+
+def verify_signature(uri: str, st: str, ts: int, e: int) -> bool:
+    """校验签名（不含有效期检查）"""
+    return hmac.compare_digest(make_signature(uri, ts, e), st)
+
+
+def is_expired(ts: int, e: int, now: Optional[float] = None) -> bool:
+    """签名链接是否已过期"""
+    return ts + e < (time.time() if now is None else now)
@@ -0,0 +1,135 @@
+"""
+任务小时统计汇总
+
+按任务创建时间所在的整点和任务类型，把 tasks 表汇总到 task_stats_hourly，
+管理后台的统计接口只读汇总表，查询代价与 tasks 表大小无关。
+
+任务创建后状态还会变化（排队、转换、过期），所以每次重新汇总最近 STATS_ROLLUP_LOOKBACK_HOURS 个小时；
+更早创建、在这段时间内才结束的任务，所在的小时也一并重新汇总。
+完成和失败按 completed_at / error_msg 判断，任务过期后统计结果保持不变。
+"""
+import math
+from datetime import datetime, timedelta
+from typing import List, Optional
+
+import structlog
+from sqlalchemy import and_, case, delete, func, select
+from sqlalchemy.orm import Session
+
+from app.config import settings
+from app.models import Task, TaskStatsHourly
+from app.storage import retention_hours
+
+logger = structlog.get_logger()
+
+UNKNOWN_TASK_TYPE = "unknown"
+
+
+def floor_hour(value: datetime) -> datetime:
+    return value.replace(minute=0, second=0, microsecond=0)
+
+
+def percentile(values: List[float], q: float) -> Optional[float]:
+    """最近秩法分位数，values 需已排序"""
+    if not values:
+        return None
+    rank = max(math.ceil(q / 100 * len(values)), 1)
+    return values[rank - 1]
+
+
+def rollup_hour(db: Session, hour: datetime) -> int:
+    """重新汇总一个小时的任务（不提交），返回写入的行数"""
+    in_hour = and_(Task.created_at >= hour, Task.created_at < hour + timedelta(hours=1))
+    task_type = func.coalesce(Task.task_type, UNKNOWN_TASK_TYPE)
+    completed = and_(Task.completed_at.isnot(None), Task.error_msg.is_(None))
+
+    counts = db.execute(
+        select(
+            task_type.label("task_type"),
+            func.count(Task.task_id).label("total_tasks"),
+            func.sum(case((completed, 1), else_=0)).label("completed_tasks"),
+            func.sum(case((Task.error_msg.isnot(None), 1), else_=0)).label("failed_tasks"),
+            func.sum(case((Task.is_paid == True, 1), else_=0)).label("paid_tasks"),
+            func.sum(case((completed, func.coalesce(Task.file_size, 0)), else_=0)).label("bytes_processed"),
+        )
+        .where(in_hour)
+        .group_by(task_type)
+    ).all()
+
+    # 分位数无法在 SQLite 中聚合，只取完成任务的两个时间列在内存中计算
+    durations = {}
+    for row in db.execute(
+        select(task_type.label("task_type"), Task.created_at, Task.completed_at).where(in_hour, completed)
+    ):
+        durations.setdefault(row.task_type, []).append((row.completed_at - row.created_at).total_seconds())
+
+    db.execute(delete(TaskStatsHourly).where(TaskStatsHourly.hour == hour))
+    for row in counts:
+        values = sorted(durations.get(row.task_type, []))
+        db.add(
+            TaskStatsHourly(
+                hour=hour,
+                task_type=row.task_type,
+                total_tasks=row.total_tasks,
+                completed_tasks=row.completed_tasks or 0,
+                failed_tasks=row.failed_tasks or 0,
+                paid_tasks=row.paid_tasks or 0,
+                bytes_processed=row.bytes_processed or 0,
+                duration_p50=percentile(values, 50),
+                duration_p90=percentile(values, 90),
+                duration_p99=percentile(values, 99),
+            )
+        )
+    return len(counts)
+
+
+def late_finished_hours(db: Session, start: datetime, now: datetime) -> List[datetime]:
+    """
+    start 之前创建、start 之后才结束的任务所在的小时
+
+    任务最迟在付费保留时间加 CLEANUP_STUCK_GRACE_HOURS 后被当作卡住的任务清理，更早创建的任务不会再结束，
+    只需按 created_at 索引扫描这段范围。
+    """
+    oldest = now - timedelta(hours=retention_hours(True) + settings.CLEANUP_STUCK_GRACE_HOURS)
+    created = db.scalars(
+        select(Task.created_at).where(
+            Task.created_at >= oldest, Task.created_at < start, Task.completed_at >= start
+        )
+    )
+    return sorted({floor_hour(value) for value in created})
+
+
+def rollup(db: Session, now: Optional[datetime] = None) -> dict:
+    """
+    汇总最近几个小时（含当前未结束的小时），每个小时一个事务
+
+    统计表为空（首次部署）时从 STATS_ROLLUP_BACKFILL_DAYS 天内最早的任务开始回填。
+    """
+    now = now or datetime.now()
+    current = floor_hour(now)
+    start = current - timedelta(hours=settings.STATS_ROLLUP_LOOKBACK_HOURS)
+
+    if db.scalar(select(TaskStatsHourly.hour).limit(1)) is None:
+        first = db.scalar(
+            select(func.min(Task.created_at)).where(
+                Task.created_at >= now - timedelta(days=settings.STATS_ROLLUP_BACKFILL_DAYS)
+            )
+        )
+        if first is not None:
+            start = min(start, floor_hour(first))
+
+    hour_list = late_finished_hours(db, start, now)
+    late_hours = len(hour_list)
+    hour = start
+    while hour <= current:
+        hour_list.append(hour)
+        hour += timedelta(hours=1)
+
+    rows = 0
+    for hour in hour_list:
+        rows += rollup_hour(db, hour)
+        db.commit()
+
+    hours = len(hour_list)
+    logger.info("Hourly stats rolled up", start=start.isoformat(), hours=hours, late_hours=late_hours, rows=rows)
+    return {"hours": hours, "rows": rows}
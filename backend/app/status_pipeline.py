@@ -0,0 +1,118 @@
+"""
+任务状态流水线
+
+STATUS_PIPELINE=redis_stream 时，Celery worker 不直接写数据库，而是把状态变化追加到 Redis 流
+STATUS_STREAM_KEY，由单独的 status_writer 进程按批次在一个事务里落库，SQLite 只剩一个写入方。
+
+每次追加任务状态的同时更新覆盖层 task:<task_id>:overlay（最新字段和对应的流 ID），
+读取方把覆盖层合并到数据库结果上，批次落库之前读到的状态也是最新的。
+批次提交后 status_writer 删除流 ID 未再前进的覆盖层。
+"""
+import json
+from datetime import datetime
+from typing import Optional, Type
+
+import structlog
+from redis import RedisError
+from sqlalchemy import DateTime
+
+from app.config import settings
+from app.models import Task
+from app.redis_client import get_redis
+
+logger = structlog.get_logger()
+
+# 流中的操作类型
+OP_TASK = "task"  # 更新任务字段
+OP_CACHE_STORE = "cache_store"  # 写入结果缓存记录
+OP_CACHE_HIT = "cache_hit"  # 结果缓存命中计数
+
+# 追加流记录并更新覆盖层（原子执行）
+_APPEND_SCRIPT = """
+local id = redis.call('XADD', KEYS[1], '*', 'op', ARGV[1], 'data', ARGV[2])
+if #KEYS > 1 then
+    redis.call('HSET', KEYS[2], '_id', id, unpack(ARGV, 4))
+    redis.call('EXPIRE', KEYS[2], ARGV[3])
+end
+return id
+"""
+
+# 覆盖层的流 ID 没有变化（即没有更新的状态）时删除
+_CLEAR_OVERLAY_SCRIPT = """
+if redis.call('HGET', KEYS[1], '_id') == ARGV[1] then
+    return redis.call('DEL', KEYS[1])
+end
+return 0
+"""
+
+
+def enabled() -> bool:
+    """是否通过 Redis 流写入任务状态"""
+    return settings.STATUS_PIPELINE == "redis_stream"
+
+
+def overlay_key(task_id: str) -> str:
+    """任务状态覆盖层的 Redis 键"""
+    return f"task:{task_id}:overlay"
+
+
+def encode(value) -> str:
+    return json.dumps(value, ensure_ascii=False, default=datetime.isoformat)
+
+
+def decode_fields(model: Type, fields: dict) -> dict:
+    """按模型列类型还原时间字段"""
+    columns = model.__table__.columns
+    decoded = {}
+    for name, value in fields.items():
+        if value is not None and name in columns and isinstance(columns[name].type, DateTime):
+            value = datetime.fromisoformat(value)
+        decoded[name] = value
+    return decoded
+
+
+def append(op: str, data: dict, task_id: Optional[str] = None, overlay: Optional[dict] = None) -> str:
+    """
+    追加一条流记录
+
+    Args:
+        op: 操作类型
+        data: 操作数据
+        task_id: 提供时同时更新该任务的覆盖层
+        overlay: 覆盖层字段
+
+    Raises:
+        RedisError: Redis 不可用，调用方应改为直接写库
+    """
+    redis = get_redis()
+    keys = [settings.STATUS_STREAM_KEY]
+    args = [op, encode(data), settings.STATUS_OVERLAY_TTL_SECONDS]
+    if task_id is not None:
+        keys.append(overlay_key(task_id))
+        for name, value in (overlay or {}).items():
+            args.extend([name, encode(value)])
+    return redis.eval(_APPEND_SCRIPT, len(keys), *keys, *args)
+
+
+def append_task_update(task_id: str, fields: dict) -> str:
+    """追加任务字段更新"""
+    return append(OP_TASK, {"task_id": task_id, "fields": fields}, task_id=task_id, overlay=fields)
+
+
+def read_overlay(task_id: str) -> dict:
+    """读取尚未落库的任务字段，未启用、无记录或 Redis 不可用时返回空字典"""
+    if not enabled():
+        return {}
+    try:
+        raw = get_redis().hgetall(overlay_key(task_id))
+    except RedisError as e:
+        logger.warning("Failed to read task status overlay", task_id=task_id, error=str(e))
+        return {}
+
+    raw.pop("_id", None)
+    return decode_fields(Task, {name: json.loads(value) for name, value in raw.items()})
+
+
+def clear_overlay(task_id: str, stream_id: str):
+    """该任务的状态已落库且没有更新的记录时删除覆盖层"""
+    get_redis().eval(_CLEAR_OVERLAY_SCRIPT, 1, overlay_key(task_id), stream_id)
@@ -0,0 +1,189 @@
+"""
+任务状态批量写入进程（STATUS_PIPELINE=redis_stream 时运行一个实例）
+
+    python -m app.status_writer
+
+以消费组读取状态流，每批记录在一个事务里写入数据库，提交后 XACK 并删除已应用的记录，
+再清理已经落库的覆盖层。提交失败时不确认，下一轮从待确认列表重试；进程重启后同样先处理待确认记录。
+"""
+import json
+import signal
+import socket
+import time
+from collections import defaultdict
+from datetime import datetime
+from typing import Dict, List, Tuple
+
+import structlog
+from redis import RedisError, ResponseError
+from sqlalchemy import and_, bindparam, update
+from sqlalchemy.orm import Session
+
+from app import status_pipeline
+from app.config import settings
+from app.database import SessionLocal
+from app.models import ConversionCache, Task
+from app.redis_client import get_redis
+
+logger = structlog.get_logger()
+
+# 终态任务不会被较早的非终态更新覆盖（例如流写入失败时直接落库的终态）
+TERMINAL_STATUSES = ("completed", "failed", "expired")
+
+
+def ensure_group(redis):
+    """创建消费组（已存在时忽略）"""
+    try:
+        redis.xgroup_create(settings.STATUS_STREAM_KEY, settings.STATUS_STREAM_GROUP, id="0", mkstream=True)
+    except ResponseError as e:
+        if "BUSYGROUP" not in str(e):
+            raise
+
+
+def _apply_task_updates(db: Session, updates: Dict[str, dict]):
+    """按字段集合分组，每组一条 executemany 的 UPDATE"""
+    groups: Dict[Tuple[Tuple[str, ...], bool], List[dict]] = defaultdict(list)
+    for task_id, fields in updates.items():
+        guarded = fields.get("status") not in TERMINAL_STATUSES
+        row = {f"v_{name}": value for name, value in fields.items()}
+        groups[(tuple(sorted(fields)), guarded)].append({"k_task_id": task_id, **row})
+
+    for (names, guarded), rows in groups.items():
+        condition = Task.task_id == bindparam("k_task_id")
+        if guarded:
+            condition = and_(condition, Task.status.notin_(TERMINAL_STATUSES))
+        stmt = update(Task).where(condition).values({name: bindparam(f"v_{name}") for name in names})
+        db.connection().execute(stmt, rows)
+
+
+def apply_batch(db: Session, entries: List[Tuple[str, dict]]) -> Dict[str, str]:
+    """
+    在一个事务中应用一批流记录
+
+    同一任务的多次更新先合并，只写最终字段。
+
+    Returns:
+        每个任务最后一条记录的流 ID，用于清理覆盖层
+    """
+    task_updates: Dict[str, dict] = {}
+    last_ids: Dict[str, str] = {}
+    cache_entries: Dict[str, dict] = {}
+    cache_hits: Dict[str, List] = {}
+
+    for stream_id, record in entries:
+        # 无法解析的记录记录日志后丢弃，避免整批反复重试
+        try:
+            op = record["op"]
+            data = json.loads(record["data"])
+
+            if op == status_pipeline.OP_TASK:
+                task_id = data["task_id"]
+                fields = status_pipeline.decode_fields(Task, data["fields"])
+                task_updates.setdefault(task_id, {}).update(fields)
+                last_ids[task_id] = stream_id
+            elif op == status_pipeline.OP_CACHE_STORE:
+                cache_entries[data["cache_key"]] = status_pipeline.decode_fields(ConversionCache, data)
+            elif op == status_pipeline.OP_CACHE_HIT:
+                hit = cache_hits.setdefault(data["cache_key"], [0, None])
+                hit[0] += 1
+                hit[1] = datetime.fromisoformat(data["at"])
+            else:
+                logger.error("Unknown status stream op", stream_id=stream_id, op=op)
+        except (KeyError, TypeError, ValueError):
+            logger.error("Malformed status stream entry", stream_id=stream_id)
+
+    if task_updates:
+        _apply_task_updates(db, task_updates)
+
+    for values in cache_entries.values():
+        db.merge(ConversionCache(**values))
+
+    for cache_key, (count, last_hit_at) in cache_hits.items():
+        db.execute(
+            update(ConversionCache)
+            .where(ConversionCache.cache_key == cache_key)
+            .values(hit_count=ConversionCache.hit_count + count, last_hit_at=last_hit_at)
+        )
+
+    db.commit()
+    return last_ids
+
+
+class StatusWriter:
+    """状态流消费者"""
+
+    def __init__(self, consumer: str = None):
+        self.consumer = consumer or f"{socket.gethostname()}-writer"
+        self.redis = get_redis()
+        self.running = True
+        # 从待确认列表（"0"）开始，处理上次未确认的记录后切换到新记录（">"）
+        self._read_id = "0"
+
+    def stop(self, *args):
+        self.running = False
+
+    def run_once(self) -> int:
+        """读取并应用一批记录，返回应用的记录数"""
+        response = self.redis.xreadgroup(
+            settings.STATUS_STREAM_GROUP,
+            self.consumer,
+            {settings.STATUS_STREAM_KEY: self._read_id},
+            count=settings.STATUS_WRITER_BATCH_SIZE,
+            block=None if self._read_id == "0" else settings.STATUS_WRITER_BLOCK_MS,
+        )
+        entries = response[0][1] if response else []
+
+        if not entries:
+            self._read_id = ">"
+            return 0
+
+        db = SessionLocal()
+        try:
+            last_ids = apply_batch(db, entries)
+        except Exception:
+            db.rollback()
+            # 下一轮重新读取待确认记录
+            self._read_id = "0"
+            raise
+        finally:
+            db.close()
+
+        ids = [stream_id for stream_id, _ in entries]
+        pipe = self.redis.pipeline(transaction=False)
+        pipe.xack(settings.STATUS_STREAM_KEY, settings.STATUS_STREAM_GROUP, *ids)
+        pipe.xdel(settings.STATUS_STREAM_KEY, *ids)
+        pipe.execute()
+
+        for task_id, stream_id in last_ids.items():
+            status_pipeline.clear_overlay(task_id, stream_id)
+
+        return len(entries)
+
+    def run(self):
+        ensure_group(self.redis)
+        logger.info("Status writer started", consumer=self.consumer, stream=settings.STATUS_STREAM_KEY)
+
+        while self.running:
+            try:
+                applied = self.run_once()
+                if applied:
+                    logger.debug("Status batch applied", count=applied)
+            except (RedisError, OSError) as e:
+                logger.warning("Status stream unavailable", error=str(e))
+                time.sleep(1)
+            except Exception as e:
+                logger.error("Failed to apply status batch", error=str(e))
+                time.sleep(1)
+
+        logger.info("Status writer stopped")
+
+
+def main():
+    writer = StatusWriter()
+    signal.signal(signal.SIGTERM, writer.stop)
+    signal.signal(signal.SIGINT, writer.stop)
+    writer.run()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,253 @@
+"""
+本地文件存储工具
+"""
+import hashlib
+import json
+import os
+import re
+import shutil
+from datetime import datetime, timedelta
+from typing import Collection, Iterator, Optional
+
+import aiofiles
+
+from app import runtime_config
+from app.config import settings
+
+# 分片上传会话目录（STORAGE_BASE_PATH/partial/<upload_id>/）
+PARTIAL_DIR = "partial"
+UPLOAD_SESSION_META = "meta.json"
+UPLOAD_SESSION_DATA = "data.part"
+
+# 分桶布局（STORAGE_LAYOUT=bucketed）：<category>/<保留类别>/<过期小时>/<哈希前缀>/<文件名>
+RETENTION_CLASSES = ("free", "paid")
+BUCKET_HOUR_FORMAT = "%Y%m%d%H"
+
+# 落盘缓冲区大小：攒够后再切到线程池写一次，避免每个网络小包都触发一次线程切换
+WRITE_BUFFER_SIZE = 1024 * 1024
+
+
+class FileTooLargeError(Exception):
+    """写入字节数超过上限"""
+
+
+def dated_dir(category: str, now: Optional[datetime] = None) -> str:
+    """
+    获取按日期分目录的存储路径（STORAGE_BASE_PATH/<category>/YYYY/MM/DD），不存在则创建
+
+    Args:
+        category: 顶层目录，如 uploads、results
+        now: 参考时间，默认当前时间
+    """
+    now = now or datetime.now()
+    path = os.path.join(
+        settings.STORAGE_BASE_PATH,
+        category,
+        str(now.year),
+        f"{now.month:02d}",
+        f"{now.day:02d}",
+    )
+    os.makedirs(path, exist_ok=True)
+    return path
+
+
+def retention_hours(is_paid: bool) -> int:
+    """文件保留时间（小时）"""
+    config = runtime_config.current()
+    return config.retention_paid_hours if is_paid else config.retention_free_hours
+
+
+def bucket_hour(expire_at: datetime) -> datetime:
+    """过期时间向上取整到整点，桶内所有文件都不晚于该时刻过期"""
+    hour = expire_at.replace(minute=0, second=0, microsecond=0)
+    return hour if hour == expire_at else hour + timedelta(hours=1)
+
+
+def storage_dir(
+    category: str,
+    name: str,
+    is_paid: bool = False,
+    expire_at: Optional[datetime] = None,
+    now: Optional[datetime] = None,
+) -> str:
+    """
+    获取文件的存储目录，不存在则创建
+
+    daily 布局下同 dated_dir；bucketed 布局下按保留类别和过期小时分桶，
+    再按文件名哈希的前两位分子目录，过期后由 remove_expired_buckets 整桶删除。
+
+    Args:
+        category: 顶层目录，如 uploads、results
+        name: 文件名，用于计算哈希前缀
+        is_paid: 保留类别
+        expire_at: 过期时间，默认按保留类别从 now 起算
+        now: 参考时间，默认当前时间
+    """
+    now = now or datetime.now()
+    if settings.STORAGE_LAYOUT != "bucketed":
+        return dated_dir(category, now)
+
+    expire_at = expire_at or now + timedelta(hours=retention_hours(is_paid))
+    path = os.path.join(
+        settings.STORAGE_BASE_PATH,
+        category,
+        RETENTION_CLASSES[is_paid],
+        bucket_hour(expire_at).strftime(BUCKET_HOUR_FORMAT),
+        hashlib.md5(name.encode("utf-8")).hexdigest()[:2],
+    )
+    os.makedirs(path, exist_ok=True)
+    return path
+
+
+def is_bucketed_key(file_key: str) -> bool:
+    """file_key 是否位于分桶布局下（随桶整体删除，无需逐个文件删除）"""
+    parts = file_key.split("/")
+    return len(parts) == 5 and parts[1] in RETENTION_CLASSES
+
+
+def bucket_of(file_key: str) -> Optional[str]:
+    """分桶布局下 file_key 所在的桶（<category>/<保留类别>/<过期小时>），不在桶内时返回 None"""
+    return "/".join(file_key.split("/")[:3]) if is_bucketed_key(file_key) else None
+
+
+def remove_expired_buckets(
+    category: str, now: Optional[datetime] = None, keep: Collection[str] = ()
+) -> Iterator[str]:
+    """
+    删除已过期的桶目录，逐个产出被删除的目录
+
+    桶的过期小时再加 STORAGE_BUCKET_GRACE_HOURS 后才删除，给进行中的下载和刚上传即创建的任务留出余量。
+    上传文件按上传时间分桶，可能被之后创建的任务继续使用，仍被未完成任务引用的桶（keep，见 bucket_of）保留。
+    """
+    cutoff = ((now or datetime.now()) - timedelta(hours=settings.STORAGE_BUCKET_GRACE_HOURS)).strftime(
+        BUCKET_HOUR_FORMAT
+    )
+    for retention_class in RETENTION_CLASSES:
+        class_dir = os.path.join(settings.STORAGE_BASE_PATH, category, retention_class)
+        try:
+            with os.scandir(class_dir) as it:
+                expired = [
+                    entry.path
+                    for entry in it
+                    if entry.is_dir()
+                    and entry.name <= cutoff
+                    and f"{category}/{retention_class}/{entry.name}" not in keep
+                ]
+        except FileNotFoundError:
+            continue
+        for path in sorted(expired):
+            shutil.rmtree(path, ignore_errors=True)
+            yield path
+
+
+def to_file_key(path: str) -> str:
+    """绝对路径转换为 file_key（相对 STORAGE_BASE_PATH，统一使用斜杠）"""
+    return os.path.relpath(path, settings.STORAGE_BASE_PATH).replace("\\", "/")
+
+
+def resolve_file_key(file_key: str) -> str:
+    """file_key 转换为绝对路径"""
+    return os.path.join(settings.STORAGE_BASE_PATH, file_key)
+
+
+def file_sha256(path: str) -> str:
+    """计算文件 SHA-256（阻塞调用，异步代码中应放到线程池执行）"""
+    hasher = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(WRITE_BUFFER_SIZE), b""):
+            hasher.update(block)
+    return hasher.hexdigest()
+
+
+def upload_session_dir(upload_id: str) -> Optional[str]:
+    """分片上传会话目录，upload_id 非法时返回 None"""
+    if not re.fullmatch(r"[0-9a-f]{32}", upload_id):
+        return None
+    return os.path.join(settings.STORAGE_BASE_PATH, PARTIAL_DIR, upload_id)
+
+
+def load_upload_session(upload_id: str) -> Optional[dict]:
+    """读取分片上传会话元数据，不存在时返回 None"""
+    session_dir = upload_session_dir(upload_id)
+    if session_dir is None:
+        return None
+    try:
+        with open(os.path.join(session_dir, UPLOAD_SESSION_META), "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def save_upload_session(meta: dict):
+    """
+    写入分片上传会话元数据（先写临时文件再替换，保证不会读到半截内容）
+
+    会话目录须已存在；会话已被完成（目录被重命名）时抛出 FileNotFoundError，不会重新创建会话
+    """
+    session_dir = upload_session_dir(meta["upload_id"])
+    meta_path = os.path.join(session_dir, UPLOAD_SESSION_META)
+    tmp_path = f"{meta_path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(meta, f)
+    os.replace(tmp_path, meta_path)
+
+
+class StreamingFileWriter:
+    """
+    流式写文件
+
+    数据边到达边写入目标路径，同时计算 SHA-256 和字节数；
+    超过 max_bytes 立即抛出 FileTooLargeError。磁盘写入在线程池中执行，不阻塞事件循环。
+    指定 offset 时在已有文件的该位置覆盖写入（用于分片上传），此时 sha256 只覆盖本次写入的数据。
+    """
+
+    def __init__(self, path: str, max_bytes: int, offset: Optional[int] = None):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.offset = offset
+        self.size = 0
+        self._hasher = hashlib.sha256()
+        self._buffer = bytearray()
+        self._file = None
+
+    @property
+    def sha256(self) -> str:
+        return self._hasher.hexdigest()
+
+    async def open(self):
+        if self.offset is None:
+            self._file = await aiofiles.open(self.path, "wb")
+        else:
+            self._file = await aiofiles.open(self.path, "r+b")
+            await self._file.seek(self.offset)
+
+    async def write(self, chunk: bytes):
+        self.size += len(chunk)
+        if self.size > self.max_bytes:
+            raise FileTooLargeError(self.size)
+
+        self._hasher.update(chunk)
+        self._buffer += chunk
+        if len(self._buffer) >= WRITE_BUFFER_SIZE:
+            await self._flush()
+
+    async def _flush(self):
+        if self._buffer:
+            await self._file.write(bytes(self._buffer))
+            self._buffer.clear()
+
+    async def close(self):
+        """写入剩余缓冲并关闭文件"""
+        if self._file is not None:
+            await self._flush()
+            await self._file.close()
+            self._file = None
+
+    async def abort(self):
+        """关闭并删除未写完的文件（分片写入模式下保留已有文件）"""
+        if self._file is not None:
+            await self._file.close()
+            self._file = None
+        self._buffer.clear()
+        if self.offset is None and os.path.exists(self.path):
+            os.remove(self.path)
@@ -0,0 +1,123 @@
+"""
+任务查询缓存
+
+GET /tasks/{task_id} 读取的字段缓存在 Redis 键 task:<task_id>:view（JSON），
+TTL 为到 expire_at 的剩余时间加 TASK_VIEW_CACHE_GRACE_SECONDS，过期判断和 410 直接由缓存完成；
+状态还会变化的任务（排队中、处理中）TTL 不超过 TASK_VIEW_CACHE_ACTIVE_TTL_SECONDS。
+不存在的任务 ID 缓存一个短 TTL 的占位值。
+
+写入方（create_task、convert_pdf_task、delete_task、cleanup_expired_files）在提交事务后覆盖写入或删除，
+覆盖写入失败时尝试删除旧值；
+读取方未命中时从数据库加载并用 SET NX 回填，不会覆盖写入方刚写入的较新数据。
+Redis 不可用时所有操作静默降级为直接查库。
+"""
+import json
+from datetime import datetime
+from typing import Iterable, Optional, Union
+
+import structlog
+from redis import RedisError
+
+from app.config import settings
+from app.events import TERMINAL_STATUSES
+from app.models import Task
+from app.redis_client import get_redis
+
+logger = structlog.get_logger()
+
+# 任务不存在的占位值
+MISSING = "-"
+
+_VIEW_FIELDS = ("task_id", "status", "file_name", "error_msg", "file_key_result")
+_VIEW_TIME_FIELDS = ("created_at", "completed_at", "expire_at")
+
+
+def view_key(task_id: str) -> str:
+    """任务查询缓存的 Redis 键"""
+    return f"task:{task_id}:view"
+
+
+def to_view(task: Task) -> dict:
+    """任务转换为缓存的字段"""
+    return {field: getattr(task, field) for field in _VIEW_FIELDS + _VIEW_TIME_FIELDS}
+
+
+def _dump_view(view: dict) -> str:
+    return json.dumps(view, ensure_ascii=False, default=datetime.isoformat)
+
+
+def _parse_view(raw: str) -> dict:
+    view = json.loads(raw)
+    for field in _VIEW_TIME_FIELDS:
+        if view.get(field):
+            view[field] = datetime.fromisoformat(view[field])
+    return view
+
+
+def _ttl(view: dict) -> int:
+    if not view["expire_at"]:
+        return settings.TASK_VIEW_CACHE_GRACE_SECONDS
+    remaining = (view["expire_at"] - datetime.now()).total_seconds()
+    ttl = max(int(remaining) + settings.TASK_VIEW_CACHE_GRACE_SECONDS, 1)
+    if view["status"] not in TERMINAL_STATUSES:
+        ttl = min(ttl, settings.TASK_VIEW_CACHE_ACTIVE_TTL_SECONDS)
+    return ttl
+
+
+def get_view(task_id: str) -> Union[dict, str, None]:
+    """
+    读取缓存
+
+    Returns:
+        任务字段；任务不存在时返回 MISSING；未命中或 Redis 不可用时返回 None
+    """
+    if not settings.TASK_VIEW_CACHE_ENABLED:
+        return None
+    try:
+        raw = get_redis().get(view_key(task_id))
+    except RedisError as e:
+        logger.debug("Task view cache unavailable", error=str(e))
+        return None
+
+    if raw is None or raw == MISSING:
+        return raw
+    return _parse_view(raw)
+
+
+def fill_view(task_id: str, view: Optional[dict]):
+    """未命中时回填（SET NX），view 为 None 表示任务不存在"""
+    if not settings.TASK_VIEW_CACHE_ENABLED:
+        return
+    try:
+        if view is None:
+            get_redis().set(view_key(task_id), MISSING, ex=settings.TASK_VIEW_CACHE_NEGATIVE_TTL_SECONDS, nx=True)
+        else:
+            get_redis().set(view_key(task_id), _dump_view(view), ex=_ttl(view), nx=True)
+    except RedisError as e:
+        logger.debug("Task view cache unavailable", error=str(e))
+
+
+def store_view(task: Task):
+    """任务变化后覆盖写入"""
+    if not settings.TASK_VIEW_CACHE_ENABLED:
+        return
+    view = to_view(task)
+    try:
+        get_redis().set(view_key(task.task_id), _dump_view(view), ex=_ttl(view))
+    except RedisError as e:
+        logger.warning("Failed to update task view cache", task_id=task.task_id, error=str(e))
+        # 旧值不能继续返回：尽量删除，删除也失败时由 TTL 上限兜底
+        invalidate([task.task_id])
+
+
+def invalidate(task_ids: Iterable[str]):
+    """删除缓存，下次查询时从数据库重新加载"""
+    if not settings.TASK_VIEW_CACHE_ENABLED:
+        return
+    keys = [view_key(task_id) for task_id in task_ids]
+    if not keys:
+        return
+    try:
+        get_redis().delete(*keys)
+    except RedisError as e:
+        logger.warning("Failed to invalidate task view cache", count=len(keys), error=str(e))
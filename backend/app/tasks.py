@@ -2,20 +2,53 @@
 Celery 任务
 """
 from celery import Task
+from celery.signals import worker_process_init
+from redis import RedisError
+from sqlalchemy import select, tuple_, update
 from datetime import datetime, timedelta
+from typing import List, Optional
+import json
 import os
 import tempfile
 import structlog
 import shutil
+import time
+from concurrent.futures import ThreadPoolExecutor
 
 from app.celery_app import celery_app
 from app.database import SessionLocal
 from app.models import Task as TaskModel
 from app.config import settings
+from app.storage import (
+    PARTIAL_DIR,
+    bucket_of,
+    file_sha256,
+    is_bucketed_key,
+    load_upload_session,
+    remove_expired_buckets,
+    storage_dir,
+)
+from app import reconciler, result_cache, revenue_ledger, stats_rollup, status_pipeline, task_cache
+from app.events import publish_task_event
+from app.progress import ProgressCallback, ProgressReporter
+from app.converters import (
+    convert_pdf2excel,
+    convert_pdf2ppt,
+    convert_pdf2word,
+    merge_pdfs,
+    parse_page_ranges,
+    split_pdf,
+)
 
 logger = structlog.get_logger()
 
 
+@worker_process_init.connect
+def _register_listeners(**kwargs):
+    """worker 进程不调用 init_db，启动时注册订单变更的收入台账监听器"""
+    revenue_ledger.register()
+
+
 class DatabaseTask(Task):
     """带数据库会话的任务基类"""
 
@@ -33,14 +66,23 @@ class DatabaseTask(Task):
 
 
 @celery_app.task(bind=True, base=DatabaseTask, name="app.tasks.convert_pdf_task")
-def convert_pdf_task(self, task_id: str, file_key: str, task_type: str):
+def convert_pdf_task(
+    self,
+    task_id: str,
+    file_key: str,
+    task_type: str,
+    options: Optional[dict] = None,
+    file_keys: Optional[List[str]] = None,
+):
     """
     PDF 转换任务
 
     Args:
         task_id: 任务 ID
         file_key: 本地文件相对路径
-        task_type: 转换类型 (pdf2word, pdf2excel, pdf2ppt)
+        task_type: 转换类型 (pdf2word, pdf2excel, pdf2ppt, merge, split)
+        options: 转换选项，参与结果缓存键计算
+        file_keys: merge 任务按顺序合并的全部文件
     """
     logger.info("Starting PDF conversion", task_id=task_id, task_type=task_type)
 
@@ -50,71 +92,156 @@ def convert_pdf_task(self, task_id: str, file_key: str, task_type: str):
         logger.error("Task not found", task_id=task_id)
         return
 
-    task.status = "processing"
-    self.db.commit()
+    if status_pipeline.enabled():
+        # 状态经 Redis 流写入，任务对象不再随会话提交
+        self.db.expunge(task)
+
+    _update_task(self.db, task, status="processing")
+    task_cache.store_view(task)
+    publish_task_event(task_id, "processing")
 
     try:
         # 获取输入文件路径
         input_path = os.path.join(settings.STORAGE_BASE_PATH, file_key)
+        input_paths = [os.path.join(settings.STORAGE_BASE_PATH, key) for key in (file_keys or [file_key])]
 
-        if not os.path.exists(input_path):
-            raise FileNotFoundError(f"Source file not found: {input_path}")
-
-        # 创建结果文件目录
-        now = datetime.now()
-        result_dir = os.path.join(
-            settings.STORAGE_BASE_PATH,
-            "results",
-            str(now.year),
-            f"{now.month:02d}",
-            f"{now.day:02d}"
-        )
-        os.makedirs(result_dir, exist_ok=True)
+        for path in input_paths:
+            if not os.path.exists(path):
+                raise FileNotFoundError(f"Source file not found: {path}")
 
-        # 生成输出文件路径
-        output_filename = f"{task_id}.{get_output_extension(task_type)}"
+        # 生成输出文件路径（分桶布局下按任务的过期时间分桶）
+        output_filename = f"{task_id}.{get_output_extension(task_type, options)}"
+        result_dir = storage_dir("results", output_filename, task.is_paid, task.expire_at)
         output_path = os.path.join(result_dir, output_filename)
 
-        # 执行转换
-        logger.info("Converting PDF", task_type=task_type, input=input_path)
-        convert_pdf(input_path, output_path, task_type)
+        # merge 的结果取决于多个文件，不使用结果缓存；源文件哈希只在使用缓存时由 worker 计算，保证写入缓存的键可信
+        cacheable = settings.RESULT_CACHE_ENABLED and task_type != "merge"
+        file_hash = file_sha256(input_path) if cacheable else None
+        cache_entry = result_cache.lookup(self.db, file_hash, task_type, options) if cacheable else None
+        if cache_entry:
+            try:
+                result_cache.materialize(cache_entry, output_path)
+                logger.info("Result cache hit", task_id=task_id, cache_key=cache_entry.cache_key)
+                _record_cache_hit(cache_entry)
+            except OSError as e:
+                # 缓存文件在查询后被淘汰，改为正常转换
+                logger.warning("Result cache entry unavailable", task_id=task_id, error=str(e))
+                cache_entry = None
+        if not cache_entry:
+            # 执行转换
+            logger.info("Converting PDF", task_type=task_type, input=input_path)
+            reporter = ProgressReporter(task_id)
+            try:
+                convert_pdf(input_path, output_path, task_type, options, input_paths, reporter)
+            finally:
+                reporter.clear()
 
         # 计算相对路径
         result_key = os.path.relpath(output_path, settings.STORAGE_BASE_PATH)
 
         # 更新任务状态
-        task.status = "completed"
-        task.file_key_result = result_key.replace("\\", "/")  # 统一使用斜杠
-        task.completed_at = datetime.now()
-        self.db.commit()
+        _update_task(
+            self.db,
+            task,
+            status="completed",
+            file_key_result=result_key.replace("\\", "/"),  # 统一使用斜杠
+            file_hash=file_hash or task.file_hash,
+            completed_at=datetime.now(),
+        )
+        task_cache.store_view(task)
+        publish_task_event(task_id, "completed")
 
         logger.info("PDF conversion completed", task_id=task_id, output=output_path)
 
+        if cacheable and not cache_entry:
+            try:
+                entry = result_cache.store_file(
+                    file_hash, os.path.getsize(input_path), task_type, options, output_path
+                )
+                _save_cache_entry(self.db, entry)
+            except Exception as e:
+                logger.warning("Failed to store result cache", task_id=task_id, error=str(e))
+
     except Exception as e:
         logger.error("PDF conversion failed", task_id=task_id, error=str(e))
 
-        task.status = "failed"
-        task.error_msg = str(e)
-        task.completed_at = datetime.now()
-        self.db.commit()
+        _update_task(self.db, task, status="failed", error_msg=str(e), completed_at=datetime.now())
+        task_cache.store_view(task)
+        publish_task_event(task_id, "failed", task.error_msg)
 
         raise
 
 
-def convert_pdf(input_path: str, output_path: str, task_type: str):
+def _update_task(db, task: TaskModel, **fields):
+    """
+    更新任务字段
+
+    STATUS_PIPELINE=redis_stream 时追加到状态流，由 status_writer 批量落库；
+    Redis 不可用时退回直接写库。
+    """
+    for name, value in fields.items():
+        setattr(task, name, value)
+
+    if status_pipeline.enabled():
+        try:
+            status_pipeline.append_task_update(task.task_id, fields)
+            return
+        except RedisError as e:
+            logger.warning("Status pipeline unavailable, writing directly", task_id=task.task_id, error=str(e))
+        db.execute(update(TaskModel).where(TaskModel.task_id == task.task_id).values(**fields))
+
+    db.commit()
+
+
+def _record_cache_hit(entry):
+    """记录结果缓存命中，direct 模式随任务状态一起提交"""
+    if status_pipeline.enabled():
+        try:
+            status_pipeline.append(
+                status_pipeline.OP_CACHE_HIT, {"cache_key": entry.cache_key, "at": datetime.now()}
+            )
+            return
+        except RedisError as e:
+            logger.warning("Status pipeline unavailable, writing directly", error=str(e))
+    result_cache.record_hit(entry)
+
+
+def _save_cache_entry(db, entry):
+    """写入结果缓存记录"""
+    if status_pipeline.enabled():
+        try:
+            data = {column.name: getattr(entry, column.name) for column in entry.__table__.columns}
+            status_pipeline.append(status_pipeline.OP_CACHE_STORE, data)
+            return
+        except RedisError as e:
+            logger.warning("Status pipeline unavailable, writing directly", error=str(e))
+    db.merge(entry)
+    db.commit()
+
+
+def convert_pdf(
+    input_path: str,
+    output_path: str,
+    task_type: str,
+    options: Optional[dict] = None,
+    input_paths: Optional[List[str]] = None,
+    progress: Optional[ProgressCallback] = None,
+):
     """
     执行 PDF 转换
 
-    这是一个简化的实现，实际应该调用具体的转换库
+    Args:
+        input_path: 输入文件路径
+        output_path: 输出文件路径
+        task_type: 任务类型
+        options: 转换选项，split 使用 ranges（如 "1-3,5,8-"）
+        input_paths: merge 按顺序合并的全部输入文件
+        progress: 进度回调 progress(done, total, stage)
     """
     if task_type == "pdf2word":
-        # 使用 pdf2docx 转换
+        # 使用 pdf2docx 转换（大文件按页并行）
         try:
-            from pdf2docx import Converter
-
-            cv = Converter(input_path)
-            cv.convert(output_path)
-            cv.close()
+            convert_pdf2word(input_path, output_path, progress)
         except ImportError:
             # 降级方案：使用 PyPDF2 提取文本
             import PyPDF2
@@ -124,142 +251,234 @@ def convert_pdf(input_path: str, output_path: str, task_type: str):
                 pdf_reader = PyPDF2.PdfReader(pdf_file)
                 doc = Document()
 
-                for page in pdf_reader.pages:
+                page_count = len(pdf_reader.pages)
+                for i, page in enumerate(pdf_reader.pages, start=1):
                     text = page.extract_text()
                     doc.add_paragraph(text)
+                    if progress:
+                        progress(i, page_count, "parsing")
 
                 doc.save(output_path)
 
     elif task_type == "pdf2excel":
-        # 使用 pdfplumber 提取表格
-        import pdfplumber
-        import pandas as pd
-
-        with pdfplumber.open(input_path) as pdf:
-            tables = []
-            for page in pdf.pages:
-                page_tables = page.extract_tables()
-                tables.extend(page_tables)
-
-            # 将所有表格写入 Excel
-            if tables:
-                writer = pd.ExcelWriter(output_path, engine="openpyxl")
-                for i, table in enumerate(tables):
-                    df = pd.DataFrame(table[1:], columns=table[0])
-                    df.to_excel(writer, sheet_name=f"Sheet{i+1}", index=False)
-                writer.close()
+        # 使用 pdfplumber 逐页提取表格，流式写入 Excel
+        convert_pdf2excel(input_path, output_path, progress)
 
     elif task_type == "pdf2ppt":
-        # 简化实现：将 PDF 转为图片，然后插入 PPT
-        from pdf2image import convert_from_path
-        from pptx import Presentation
-        from pptx.util import Inches
-
-        images = convert_from_path(input_path)
-        prs = Presentation()
-
-        for img in images:
-            slide = prs.slides.add_slide(prs.slide_layouts[6])  # 空白布局
-            img_path = os.path.join(os.path.dirname(output_path), f"page_{len(prs.slides)}.png")
-            img.save(img_path, "PNG")
-
-            # 添加图片到幻灯片
-            left = top = Inches(0)
-            slide.shapes.add_picture(img_path, left, top, width=prs.slide_width)
+        # 逐窗口渲染页面为图片，插入 PPT
+        convert_pdf2ppt(input_path, output_path, progress)
 
-            os.remove(img_path)
+    elif task_type == "merge":
+        # 复制页面对象合并，不重新渲染
+        merge_pdfs(input_paths or [input_path], output_path, progress)
 
-        prs.save(output_path)
+    elif task_type == "split":
+        split_pdf(input_path, output_path, (options or {}).get("ranges"), progress)
 
     else:
         raise ValueError(f"Unsupported task type: {task_type}")
 
 
-def get_output_extension(task_type: str) -> str:
+def get_output_extension(task_type: str, options: Optional[dict] = None) -> str:
     """获取输出文件扩展名"""
+    if task_type == "split":
+        # 指定了单个范围时输出 PDF，否则（包括未指定范围）打包为 zip，与文档页数无关
+        ranges = parse_page_ranges((options or {}).get("ranges"))
+        return "pdf" if len(ranges) == 1 else "zip"
+
     extensions = {"pdf2word": "docx", "pdf2excel": "xlsx", "pdf2ppt": "pptx", "merge": "pdf", "split": "pdf"}
 
     return extensions.get(task_type, "bin")
 
 
+# 过期清理覆盖的状态：完成和失败的任务到期即清理
+CLEANUP_STATUSES = ("completed", "failed")
+# 排队中或处理中的任务可能仍在使用源文件，过期后再经过 CLEANUP_STUCK_GRACE_HOURS 才视为卡住并清理
+STUCK_STATUSES = ("pending", "processing")
+
+
+def _unlink(path: str) -> int:
+    """删除文件，返回释放的字节数；文件不存在时返回 0"""
+    try:
+        size = os.stat(path).st_size
+        os.remove(path)
+        return size
+    except FileNotFoundError:
+        return 0
+
+
+def _active_buckets(db) -> set:
+    """排队中或处理中的任务使用的源文件和结果文件所在的桶（包括复用的旧上传和 merge 的全部输入）"""
+    rows = db.execute(
+        select(TaskModel.file_key_source, TaskModel.file_key_result, TaskModel.merge_file_keys).where(
+            TaskModel.status.in_(STUCK_STATUSES)
+        )
+    )
+    buckets = set()
+    for row in rows:
+        keys = [row.file_key_source, row.file_key_result] + json.loads(row.merge_file_keys or "[]")
+        buckets.update(bucket_of(key) for key in keys if key)
+    buckets.discard(None)
+    return buckets
+
+
 @celery_app.task(name="app.tasks.cleanup_expired_files")
 def cleanup_expired_files():
-    """清理过期文件定时任务"""
+    """
+    清理过期文件定时任务
+
+    按 (status, expire_at) 索引键集分页，每批只读取需要的列，线程池并行删除文件，
+    再用一条 UPDATE 标记整批任务并提交，单个事务大小与积压量无关。
+    pending/processing 的任务过期后还要经过 CLEANUP_STUCK_GRACE_HOURS 宽限期才清理。
+    分桶布局（STORAGE_LAYOUT=bucketed）下的文件不逐个删除，由过期的桶目录整体删除。
+    超过 CLEANUP_TIME_BUDGET_SECONDS 后停止，剩余任务留给下一次调度。
+    """
     logger.info("Starting cleanup expired files")
 
+    started = time.monotonic()
+    now = datetime.now()
+    deleted_count = 0
+    freed_bytes = 0
+    out_of_time = False
+
     db = SessionLocal()
 
     try:
-        # 查询过期任务
-        expired_tasks = (
-            db.query(TaskModel)
-            .filter(TaskModel.status == "completed", TaskModel.expire_at < datetime.now())
-            .all()
-        )
+        with ThreadPoolExecutor(max_workers=settings.CLEANUP_UNLINK_WORKERS) as pool:
+            stuck_cutoff = now - timedelta(hours=settings.CLEANUP_STUCK_GRACE_HOURS)
+            cutoffs = [(status, now) for status in CLEANUP_STATUSES]
+            cutoffs += [(status, stuck_cutoff) for status in STUCK_STATUSES]
+            for status, cutoff in cutoffs:
+                last_key = None
+
+                while not out_of_time:
+                    query = (
+                        select(
+                            TaskModel.task_id,
+                            TaskModel.expire_at,
+                            TaskModel.file_key_source,
+                            TaskModel.file_key_result,
+                        )
+                        .where(TaskModel.status == status, TaskModel.expire_at < cutoff)
+                        .order_by(TaskModel.expire_at, TaskModel.task_id)
+                        .limit(settings.CLEANUP_BATCH_SIZE)
+                    )
+                    if last_key is not None:
+                        query = query.where(tuple_(TaskModel.expire_at, TaskModel.task_id) > last_key)
+
+                    rows = db.execute(query).all()
+                    if not rows:
+                        break
+                    last_key = (rows[-1].expire_at, rows[-1].task_id)
+
+                    futures = [
+                        (
+                            row.task_id,
+                            [
+                                pool.submit(_unlink, os.path.join(settings.STORAGE_BASE_PATH, key))
+                                for key in (row.file_key_source, row.file_key_result)
+                                if key and not is_bucketed_key(key)
+                            ],
+                        )
+                        for row in rows
+                    ]
+
+                    # 文件删除失败的任务保持原状态，下次重试
+                    task_ids = []
+                    for task_id, row_futures in futures:
+                        try:
+                            freed_bytes += sum(future.result() for future in row_futures)
+                            task_ids.append(task_id)
+                        except OSError as e:
+                            logger.error("Failed to delete file", task_id=task_id, error=str(e))
+
+                    if task_ids:
+                        db.execute(
+                            update(TaskModel)
+                            .where(TaskModel.task_id.in_(task_ids))
+                            .values(status="expired")
+                            .execution_options(synchronize_session=False)
+                        )
+                        db.commit()
+                        task_cache.invalidate(task_ids)
+                        deleted_count += len(task_ids)
+
+                    if len(rows) < settings.CLEANUP_BATCH_SIZE:
+                        break
+
+                    out_of_time = time.monotonic() - started > settings.CLEANUP_TIME_BUDGET_SECONDS
+
+        # 分桶布局的文件不逐个删除，过期的桶整体删除（仍被未完成任务使用的桶除外）
+        removed_buckets = 0
+        active_buckets = _active_buckets(db)
+        for category in ("uploads", "results"):
+            for path in remove_expired_buckets(category, now, active_buckets):
+                removed_buckets += 1
+                logger.info("Expired bucket removed", path=path)
 
-        logger.info("Found expired tasks", count=len(expired_tasks))
-
-        deleted_count = 0
+        logger.info(
+            "Cleanup completed",
+            deleted_count=deleted_count,
+            removed_buckets=removed_buckets,
+            freed_bytes=freed_bytes,
+            elapsed=round(time.monotonic() - started, 1),
+            out_of_time=out_of_time,
+        )
 
-        for task in expired_tasks:
-            try:
-                # 删除源文件
-                if task.file_key_source:
-                    source_path = os.path.join(settings.STORAGE_BASE_PATH, task.file_key_source)
-                    if os.path.exists(source_path):
-                        os.remove(source_path)
-                        logger.debug("Deleted source file", path=source_path)
-
-                # 删除结果文件
-                if task.file_key_result:
-                    result_path = os.path.join(settings.STORAGE_BASE_PATH, task.file_key_result)
-                    if os.path.exists(result_path):
-                        os.remove(result_path)
-                        logger.debug("Deleted result file", path=result_path)
-
-                # 更新任务状态
-                task.status = "expired"
-                deleted_count += 1
+        # 结果缓存按大小和时间淘汰
+        result_cache.evict(db)
 
-            except Exception as e:
-                logger.error("Failed to delete file", task_id=task.task_id, error=str(e))
+    finally:
+        db.close()
 
-        db.commit()
-        logger.info("Cleanup completed", deleted_count=deleted_count)
 
+@celery_app.task(name="app.tasks.reconcile_orphan_files")
+def reconcile_orphan_files():
+    """清理数据库中没有对应任务的上传文件和结果文件"""
+    db = SessionLocal()
+    try:
+        return reconciler.reconcile(db)
     finally:
         db.close()
 
 
-@celery_app.task(name="app.tasks.generate_hourly_stats")
-def generate_hourly_stats():
-    """生成每小时统计数据"""
-    logger.info("Generating hourly stats")
+@celery_app.task(name="app.tasks.cleanup_stale_uploads")
+def cleanup_stale_uploads():
+    """清理过期的分片上传会话"""
+    logger.info("Starting cleanup stale uploads")
 
-    db = SessionLocal()
+    partial_root = os.path.join(settings.STORAGE_BASE_PATH, PARTIAL_DIR)
+    if not os.path.isdir(partial_root):
+        return
 
-    try:
-        from sqlalchemy import func
+    now = datetime.now()
+    # 元数据缺失或损坏的会话按目录修改时间判断
+    fallback_deadline = (now - timedelta(hours=settings.UPLOAD_SESSION_EXPIRE_HOURS)).timestamp()
+    removed_count = 0
 
-        # 统计最近 1 小时的任务
-        one_hour_ago = datetime.now() - timedelta(hours=1)
+    with os.scandir(partial_root) as entries:
+        for entry in entries:
+            if not entry.is_dir(follow_symlinks=False):
+                continue
 
-        stats = (
-            db.query(
-                func.count(TaskModel.task_id).label("total"),
-                func.sum(func.case((TaskModel.status == "completed", 1), else_=0)).label("completed"),
-                func.sum(func.case((TaskModel.status == "failed", 1), else_=0)).label("failed"),
-            )
-            .filter(TaskModel.created_at >= one_hour_ago)
-            .first()
-        )
+            meta = load_upload_session(entry.name)
+            if meta:
+                expired = datetime.fromisoformat(meta["expire_at"]) < now
+            else:
+                expired = entry.stat(follow_symlinks=False).st_mtime < fallback_deadline
+
+            if expired:
+                shutil.rmtree(entry.path, ignore_errors=True)
+                removed_count += 1
+
+    logger.info("Stale uploads cleanup completed", removed_count=removed_count)
 
-        logger.info(
-            "Hourly stats generated",
-            total=stats.total,
-            completed=stats.completed,
-            failed=stats.failed,
-        )
 
+@celery_app.task(name="app.tasks.generate_hourly_stats")
+def generate_hourly_stats():
+    """汇总最近几个小时的任务统计到 task_stats_hourly"""
+    db = SessionLocal()
+    try:
+        return stats_rollup.rollup(db)
     finally:
         db.close()
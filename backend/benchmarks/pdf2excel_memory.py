@@ -0,0 +1,94 @@
+"""
+pdf2excel 内存基准
+
+生成带表格的多页 PDF，在独立子进程中执行 convert_pdf2excel，输出各页数下的峰值 RSS。
+峰值 RSS 应基本不随页数增长。
+
+用法（在 backend 目录下）:
+    python benchmarks/pdf2excel_memory.py --pages 100 300 1000
+"""
+import argparse
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+ROWS_PER_TABLE = 25
+COLUMNS = 6
+
+
+def make_pdf(path: str, pages: int):
+    """生成每页一个带边框表格的 PDF（模拟财务报表，每页一个文字流和一个图形流）"""
+    import fitz
+
+    doc = fitz.open()
+    font = fitz.Font("helv")
+    for page_no in range(pages):
+        page = doc.new_page()
+        x0, y0, cell_w, cell_h = 40, 60, 85, 24
+        x1 = x0 + cell_w * COLUMNS
+        y1 = y0 + cell_h * ROWS_PER_TABLE
+
+        shape = page.new_shape()
+        for r in range(ROWS_PER_TABLE + 1):
+            shape.draw_line((x0, y0 + r * cell_h), (x1, y0 + r * cell_h))
+        for c in range(COLUMNS + 1):
+            shape.draw_line((x0 + c * cell_w, y0), (x0 + c * cell_w, y1))
+        shape.finish(width=0.5)
+        shape.commit()
+
+        writer = fitz.TextWriter(page.rect)
+        for r in range(ROWS_PER_TABLE):
+            for c in range(COLUMNS):
+                text = f"H{c}" if r == 0 else f"{page_no}.{r}.{c * 1234.5:.1f}"
+                writer.append((x0 + c * cell_w + 4, y0 + r * cell_h + 16), text, font=font, fontsize=8)
+        writer.write_text(page)
+    doc.save(path, garbage=3, deflate=True)
+    doc.close()
+
+
+def run_child(pdf_path: str, output_path: str):
+    """子进程：执行转换，打印耗时和本进程峰值 RSS（MB）"""
+    sys.path.insert(0, BACKEND_DIR)
+    from app.converters import convert_pdf2excel
+
+    start = time.time()
+    convert_pdf2excel(pdf_path, output_path)
+    peak_mb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    print(f"{time.time() - start:.1f} {peak_mb:.1f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--pages", type=int, nargs="+", default=[100, 300, 1000])
+    parser.add_argument("--child", nargs=2, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        run_child(*args.child)
+        return
+
+    print(f"{'pages':>6} {'seconds':>8} {'peak_rss_mb':>12}")
+    with tempfile.TemporaryDirectory() as tmp:
+        for pages in args.pages:
+            pdf_path = os.path.join(tmp, f"report-{pages}.pdf")
+            make_pdf(pdf_path, pages)
+
+            # 每个页数单独起进程，ru_maxrss 才能反映单次转换的峰值
+            result = subprocess.run(
+                [sys.executable, __file__, "--child", pdf_path, os.path.join(tmp, f"report-{pages}.xlsx")],
+                capture_output=True,
+                text=True,
+                check=True,
+                cwd=BACKEND_DIR,
+            )
+            seconds, peak_mb = result.stdout.strip().splitlines()[-1].split()
+            print(f"{pages:>6} {seconds:>8} {peak_mb:>12}")
+
+
+if __name__ == "__main__":
+    main()
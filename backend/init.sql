@@ -10,6 +10,8 @@ CREATE TABLE IF NOT EXISTS tasks (
     file_size INTEGER,
     file_key_source TEXT,  -- 源文件相对路径
     file_key_result TEXT,  -- 结果文件相对路径
+    file_hash TEXT,  -- 源文件 SHA-256
+    merge_file_keys TEXT,  -- merge 按顺序合并的全部源文件相对路径（JSON 列表）
     task_type TEXT CHECK(task_type IN ('pdf2word', 'pdf2excel', 'pdf2ppt', 'merge', 'split')),
     status TEXT CHECK(status IN ('pending', 'processing', 'completed', 'failed', 'expired')) DEFAULT 'pending',
     is_paid INTEGER DEFAULT 0,
@@ -22,7 +24,48 @@ CREATE TABLE IF NOT EXISTS tasks (
 CREATE INDEX IF NOT EXISTS idx_client ON tasks(client_id);
 CREATE INDEX IF NOT EXISTS idx_expire ON tasks(expire_at);
 CREATE INDEX IF NOT EXISTS idx_status ON tasks(status, created_at);
+CREATE INDEX IF NOT EXISTS idx_tasks_status_expire ON tasks(status, expire_at);
+CREATE INDEX IF NOT EXISTS idx_file_key_source ON tasks(file_key_source);
 CREATE INDEX IF NOT EXISTS idx_task_created ON tasks(created_at DESC);
+-- 管理后台任务列表按 (created_at, task_id) 键集分页；不筛选时使用 idx_task_created，按条件筛选时使用以分页键结尾的复合索引
+CREATE INDEX IF NOT EXISTS idx_tasks_client_created_id ON tasks(client_id, created_at, task_id);
+CREATE INDEX IF NOT EXISTS idx_tasks_type_created_id ON tasks(task_type, created_at, task_id);
+CREATE INDEX IF NOT EXISTS idx_tasks_status_created_id ON tasks(status, created_at, task_id);
+CREATE INDEX IF NOT EXISTS idx_tasks_paid_created_id ON tasks(is_paid, created_at, task_id);
+-- /history 按客户端查询付费任务并分页
+CREATE INDEX IF NOT EXISTS idx_tasks_client_paid_created_id ON tasks(client_id, is_paid, created_at, task_id);
+
+-- 转换结果缓存表
+CREATE TABLE IF NOT EXISTS conversion_cache (
+    cache_key TEXT PRIMARY KEY,  -- sha256(源文件哈希:任务类型:选项)
+    file_hash TEXT NOT NULL,
+    task_type TEXT,
+    file_key TEXT,  -- 缓存文件相对路径
+    source_size INTEGER,
+    result_size INTEGER,
+    hit_count INTEGER DEFAULT 0,
+    created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+    last_hit_at DATETIME
+);
+
+CREATE INDEX IF NOT EXISTS idx_cache_file_hash ON conversion_cache(file_hash);
+CREATE INDEX IF NOT EXISTS idx_cache_last_hit ON conversion_cache(last_hit_at);
+
+-- 任务小时统计表（由定时任务从 tasks 表汇总，管理后台统计读取此表）
+CREATE TABLE IF NOT EXISTS task_stats_hourly (
+    hour DATETIME NOT NULL,  -- 任务创建时间所在的整点
+    task_type TEXT NOT NULL,
+    total_tasks INTEGER DEFAULT 0,
+    completed_tasks INTEGER DEFAULT 0,
+    failed_tasks INTEGER DEFAULT 0,
+    paid_tasks INTEGER DEFAULT 0,
+    bytes_processed INTEGER DEFAULT 0,  -- 完成任务的源文件大小之和
+    duration_p50 REAL,  -- 完成任务从创建到完成的耗时分位数（秒）
+    duration_p90 REAL,
+    duration_p99 REAL,
+    updated_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (hour, task_type)
+);
 
 -- 订单表
 CREATE TABLE IF NOT EXISTS orders (
@@ -40,6 +83,14 @@ CREATE INDEX IF NOT EXISTS idx_order_client ON orders(client_id);
 CREATE INDEX IF NOT EXISTS idx_order_status ON orders(status);
 CREATE INDEX IF NOT EXISTS idx_order_payment_time ON orders(payment_time);
 
+-- 收入台账（随订单变更增量更新，period 为订单创建日期 YYYY-MM-DD 或 all）
+CREATE TABLE IF NOT EXISTS revenue_ledger (
+    period TEXT PRIMARY KEY,
+    total_orders INTEGER DEFAULT 0,
+    paid_amount REAL DEFAULT 0,
+    refunded_amount REAL DEFAULT 0
+);
+
 -- 系统配置表
 CREATE TABLE IF NOT EXISTS system_configs (
     config_key TEXT PRIMARY KEY,
@@ -55,7 +106,12 @@ INSERT OR IGNORE INTO system_configs (config_key, config_value, description) VAL
     ('price_large_file', '5.00', '大文件解锁价格（元）'),
     ('daily_free_quota_gb', '100', '每日免费流量限额(GB)'),
     ('max_file_size_mb', '500', '单文件最大大小(MB)'),
-    ('free_file_size_mb', '50', '免费文件大小上限(MB)');
+    ('free_file_size_mb', '50', '免费文件大小上限(MB)'),
+    ('rate_limit_client_per_minute', '30', '每个客户端每分钟可上传/创建任务次数'),
+    ('rate_limit_client_burst', '10', '每个客户端允许的突发次数'),
+    ('rate_limit_ip_per_minute', '60', '每个 IP 每分钟可上传/创建任务次数'),
+    ('rate_limit_ip_burst', '20', '每个 IP 允许的突发次数'),
+    ('queue_max_depth', '200', '转换队列积压上限，超过时拒绝新任务');
 
 -- 管理员用户表
 CREATE TABLE IF NOT EXISTS admin_users (
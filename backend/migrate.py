@@ -0,0 +1,10 @@
+"""
+数据库迁移
+
+部署时执行（见 .github/workflows/deploy-*.yml）：创建缺失的表，并为已有的表补齐新增的列和索引，可重复执行。
+    python migrate.py
+"""
+from app.database import init_db
+
+if __name__ == "__main__":
+    init_db()
@@ -0,0 +1,67 @@
+"""
+测试公共夹具
+
+- 数据库：导入 app 之前把 DATABASE_URL 指向临时目录中的 SQLite 文件，每个测试结束后清空所有表
+- Redis：限流和队列准入使用 fakeredis，测试结果不依赖本机是否运行 Redis
+"""
+import os
+import tempfile
+import uuid
+from datetime import datetime, timedelta
+
+import pytest
+
+os.environ["DATABASE_URL"] = "sqlite:///" + os.path.join(tempfile.mkdtemp(prefix="pdfshift-test-"), "test.db")
+
+
+@pytest.fixture(autouse=True)
+def db():
+    """数据库会话；测试结束后删除所有表中的数据"""
+    from app.database import Base, SessionLocal, engine, init_db
+
+    init_db()
+    session = SessionLocal()
+    try:
+        yield session
+    finally:
+        session.close()
+        with engine.begin() as conn:
+            for table in reversed(Base.metadata.sorted_tables):
+                conn.execute(table.delete())
+
+
+@pytest.fixture(autouse=True)
+def fake_redis(monkeypatch):
+    """限流使用的 Redis（每个测试一个空实例），队列准入读取的 broker 队列为空"""
+    import fakeredis
+    from app import rate_limit
+
+    redis = fakeredis.FakeRedis(decode_responses=True)
+    broker = fakeredis.FakeRedis()
+    monkeypatch.setattr(rate_limit, "get_redis", lambda: redis)
+    monkeypatch.setattr(rate_limit, "get_broker_redis", lambda: broker)
+    return redis
+
+
+@pytest.fixture
+def make_task(db):
+    """创建并提交一个任务，未指定的字段使用默认值"""
+    from app.models import Task
+
+    def make(**fields) -> Task:
+        now = datetime.now()
+        values = {
+            "task_id": str(uuid.uuid4()),
+            "client_id": "c",
+            "task_type": "pdf2word",
+            "status": "pending",
+            "created_at": now,
+            "expire_at": now + timedelta(hours=1),
+        }
+        values.update(fields)
+        task = Task(**values)
+        db.add(task)
+        db.commit()
+        return task
+
+    return make
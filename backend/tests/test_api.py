@@ -53,3 +53,1142 @@ def test_admin_login():
     # })
     # assert response.status_code == 200
     # assert "access_token" in response.json()
+
+
+def test_upload_file_streaming(tmp_path, monkeypatch):
+    """测试流式上传：落盘并返回 SHA-256"""
+    import hashlib
+    from app.config import settings
+
+    monkeypatch.setattr(settings, "STORAGE_BASE_PATH", str(tmp_path))
+    content = b"%PDF-1.4\n" + b"x" * 300000
+
+    response = client.post("/api/v1/upload", files={"file": ("test.pdf", content, "application/pdf")})
+    assert response.status_code == 200
+    data = response.json()
+    assert data["size"] == len(content)
+    assert data["sha256"] == hashlib.sha256(content).hexdigest()
+    assert data["file_key"].startswith("uploads/")
+    assert (tmp_path / data["file_key"]).read_bytes() == content
+
+
+def test_upload_file_truncated(tmp_path, monkeypatch):
+    """测试请求体在结束边界前中断时返回 400 并删除已写入的文件"""
+    from app.config import settings
+
+    monkeypatch.setattr(settings, "STORAGE_BASE_PATH", str(tmp_path))
+    body = (
+        b"--b0undary\r\n"
+        b'Content-Disposition: form-data; name="file"; filename="test.pdf"\r\n'
+        b"Content-Type: application/pdf\r\n\r\n"
+        + b"%PDF-1.4\n" + b"x" * 300000
+    )
+
+    response = client.post(
+        "/api/v1/upload", content=body, headers={"Content-Type": "multipart/form-data; boundary=b0undary"}
+    )
+    assert response.status_code == 400
+    assert not any(p.is_file() for p in tmp_path.rglob("*"))
+
+    # 文件部分完整、只缺最后的结束边界时同样拒绝
+    response = client.post(
+        "/api/v1/upload",
+        content=body + b"\r\n--b0undary\r\n",
+        headers={"Content-Type": "multipart/form-data; boundary=b0undary"},
+    )
+    assert response.status_code == 400
+    assert not any(p.is_file() for p in tmp_path.rglob("*"))
+
+
+def test_upload_file_too_large(tmp_path, monkeypatch):
+    """测试上传超限时中止并清理文件"""
+    from app import runtime_config
+    from app.config import settings
+
+    monkeypatch.setattr(settings, "STORAGE_BASE_PATH", str(tmp_path))
+    monkeypatch.setattr(runtime_config, "current", lambda: runtime_config.RuntimeConfig(max_file_size_mb=0))
+
+    response = client.post("/api/v1/upload", files={"file": ("test.pdf", b"x" * 1024, "application/pdf")})
+    assert response.status_code == 400
+    assert not any(p.is_file() for p in tmp_path.rglob("*"))
+
+
+def test_chunked_upload_resume(tmp_path, monkeypatch):
+    """测试分片上传：重复分片幂等、不连续分片被拒绝、完成后生成 file_key"""
+    import hashlib
+    from app.config import settings
+
+    monkeypatch.setattr(settings, "STORAGE_BASE_PATH", str(tmp_path))
+    content = b"%PDF-1.4\n" + bytes(range(256)) * 100
+
+    response = client.post("/api/v1/upload/sessions", json={"filename": "big.pdf", "size": len(content)})
+    assert response.status_code == 200
+    upload_id = response.json()["upload_id"]
+    url = f"/api/v1/upload/sessions/{upload_id}"
+
+    assert client.put(f"{url}?offset=0", content=content[:10000]).json()["offset"] == 10000
+    # 重发同一分片
+    assert client.put(f"{url}?offset=0", content=content[:10000]).json()["offset"] == 10000
+    # 跳过中间数据
+    response = client.put(f"{url}?offset=20000", content=content[20000:])
+    assert response.status_code == 409
+    assert response.json()["detail"]["offset"] == 10000
+
+    assert client.post(f"{url}/complete").status_code == 409
+    assert client.put(f"{url}?offset=10000", content=content[10000:]).json()["offset"] == len(content)
+
+    # 校验失败时会话保留，可以再次完成
+    assert client.post(f"{url}/complete", json={"sha256": "0" * 64}).status_code == 400
+    assert client.get(url).json()["offset"] == len(content)
+
+    response = client.post(f"{url}/complete", json={"sha256": hashlib.sha256(content).hexdigest()})
+    assert response.status_code == 200
+    assert (tmp_path / response.json()["file_key"]).read_bytes() == content
+    assert client.get(url).status_code == 404
+    assert client.put(f"{url}?offset=0", content=content[:10]).status_code == 404
+
+
+def test_chunked_upload_concurrent_complete(tmp_path, monkeypatch):
+    """测试并发完成分片上传：会话已被另一个请求取得时返回 409，不影响其完成"""
+    import os
+    from app.config import settings
+    from app.routes import upload as upload_routes
+    from app.storage import load_upload_session, upload_session_dir
+
+    monkeypatch.setattr(settings, "STORAGE_BASE_PATH", str(tmp_path))
+    content = b"%PDF-1.4\n" + b"x" * 100
+
+    response = client.post("/api/v1/upload/sessions", json={"filename": "a.pdf", "size": len(content)})
+    upload_id = response.json()["upload_id"]
+    url = f"/api/v1/upload/sessions/{upload_id}"
+    client.put(f"{url}?offset=0", content=content)
+
+    # 两个请求都读到了完整的会话，另一个请求先取得了会话
+    meta = load_upload_session(upload_id)
+    monkeypatch.setattr(upload_routes, "load_upload_session", lambda _: meta)
+    session_dir = upload_session_dir(upload_id)
+    os.rename(session_dir, session_dir + upload_routes.COMPLETING_SUFFIX)
+    response = client.post(f"{url}/complete")
+    assert response.status_code == 409
+
+    os.rename(session_dir + upload_routes.COMPLETING_SUFFIX, session_dir)
+    response = client.post(f"{url}/complete")
+    assert response.status_code == 200
+    assert (tmp_path / response.json()["file_key"]).read_bytes() == content
+    assert os.listdir(tmp_path / "partial") == []
+
+
+def test_create_task_result_cache_hit(tmp_path, monkeypatch, db):
+    """测试结果缓存：服务端校验已上传文件的哈希后任务直接完成，伪造哈希或缓存文件被淘汰时正常排队转换"""
+    import hashlib
+    from app.config import settings
+    from app import result_cache
+    from app.models import Task
+    from app.routes import tasks as task_routes
+
+    monkeypatch.setattr(settings, "STORAGE_BASE_PATH", str(tmp_path))
+    sent = []
+    monkeypatch.setattr(task_routes.convert_pdf_task, "apply_async", lambda args, **kwargs: sent.append(args))
+
+    source = b"%PDF-1.4 cached" + b"x" * 1000
+    file_hash = hashlib.sha256(source).hexdigest()
+    (tmp_path / "uploads").mkdir()
+    (tmp_path / "uploads" / "a.pdf").write_bytes(source)
+    other = b"%PDF-1.4 other" + b"y" * 1001  # 与 a.pdf 大小相同
+    (tmp_path / "uploads" / "b.pdf").write_bytes(other)
+    result_path = tmp_path / "results" / "cached.docx"
+    result_path.parent.mkdir(parents=True)
+    result_path.write_bytes(b"docx")
+
+    result_cache.store(db, file_hash, len(source), "pdf2word", {"b": 1, "a": None}, str(result_path))
+
+    check = {"file_hash": file_hash, "file_size": len(source), "task_type": "pdf2word", "options": {"b": 1}}
+    assert client.post("/api/v1/tasks/cache-check", json=check).json()["hit"] is True
+    assert client.post("/api/v1/tasks/cache-check", json={**check, "file_size": 1}).json()["hit"] is False
+
+    payload = {**check, "file_name": "a.pdf", "client_id": "client-001"}
+    # 不上传文件不能仅凭哈希取得结果
+    assert client.post("/api/v1/tasks", json=payload).status_code == 400
+
+    response = client.post("/api/v1/tasks", json={**payload, "file_key": "uploads/a.pdf"})
+    assert response.status_code == 200
+    assert response.json()["status"] == "completed"
+    assert db.get(Task, response.json()["task_id"]).file_hash == file_hash
+    assert sent == []
+
+    # 上传的是另一个文件：声明的哈希不被采用，只保存服务端计算的哈希
+    response = client.post("/api/v1/tasks", json={**payload, "file_key": "uploads/b.pdf"})
+    assert response.json()["status"] == "pending"
+    assert db.get(Task, response.json()["task_id"]).file_hash == hashlib.sha256(other).hexdigest()
+    assert len(sent) == 1
+
+    # 查询命中后缓存文件被淘汰：按普通任务排队
+    def evicted(entry, output_path):
+        raise FileNotFoundError(output_path)
+
+    monkeypatch.setattr(result_cache, "materialize", evicted)
+    response = client.post("/api/v1/tasks", json={**payload, "file_key": "uploads/a.pdf"})
+    assert response.status_code == 200
+    assert response.json()["status"] == "pending"
+    assert len(sent) == 2
+
+
+def test_download_range_and_conditional(tmp_path, monkeypatch, make_task):
+    """测试下载的 Range、多段 Range 和 304"""
+    from app.config import settings
+
+    monkeypatch.setattr(settings, "STORAGE_BASE_PATH", str(tmp_path))
+
+    content = bytes(range(256)) * 40
+    (tmp_path / "results").mkdir()
+    (tmp_path / "results" / "r.docx").write_bytes(content)
+
+    task_id = make_task(client_id="client-001", file_key_result="results/r.docx", status="completed").task_id
+
+    url = f"/api/v1/download/{task_id}"
+    response = client.get(url)
+    assert response.status_code == 200
+    assert response.content == content
+    etag = response.headers["etag"]
+
+    assert client.get(url, headers={"If-None-Match": etag}).status_code == 304
+
+    response = client.get(url, headers={"Range": "bytes=100-199"})
+    assert response.status_code == 206
+    assert response.content == content[100:200]
+    assert response.headers["content-range"] == f"bytes 100-199/{len(content)}"
+
+    response = client.get(url, headers={"Range": "bytes=0-9,-10"})
+    assert response.status_code == 206
+    assert response.headers["content-type"].startswith("multipart/byteranges")
+    assert int(response.headers["content-length"]) == len(response.content)
+
+    assert client.get(url, headers={"Range": f"bytes={len(content)}-"}).status_code == 416
+    # If-Range 不匹配时返回完整文件
+    assert client.get(url, headers={"Range": "bytes=0-9", "If-Range": '"stale"'}).status_code == 200
+
+
+def test_signed_download_url(tmp_path, monkeypatch):
+    """测试签名下载链接：校验签名、篡改拒绝、X-Accel-Redirect"""
+    from datetime import datetime, timedelta
+    from app.config import settings
+    from app.signing import signed_download_url
+
+    monkeypatch.setattr(settings, "STORAGE_BASE_PATH", str(tmp_path))
+    monkeypatch.setattr(settings, "DOWNLOAD_ACCEL_REDIRECT_PREFIX", None)
+    (tmp_path / "results").mkdir()
+    (tmp_path / "results" / "t.docx").write_bytes(b"docx")
+
+    now = datetime.now()
+    url = signed_download_url("results/t.docx", now, now + timedelta(hours=1))
+    response = client.get(url)
+    assert response.status_code == 200
+    assert response.content == b"docx"
+
+    assert client.get(url.replace("t.docx", "x.docx")).status_code == 403
+
+    expired = signed_download_url("results/t.docx", now - timedelta(hours=2), now - timedelta(hours=1))
+    assert client.get(expired).status_code == 410
+
+    monkeypatch.setattr(settings, "DOWNLOAD_ACCEL_REDIRECT_PREFIX", "/_protected/")
+    response = client.get(url)
+    assert response.headers["x-accel-redirect"] == "/_protected/results/t.docx"
+
+
+def test_merge_and_split_pdf(tmp_path):
+    """测试合并与拆分：页数、页码范围解析、多段输出 zip"""
+    import zipfile
+    import pikepdf
+    from app.converters import merge_pdfs, parse_page_ranges, split_pdf
+
+    paths = []
+    for name, pages in (("a", 3), ("b", 2)):
+        pdf = pikepdf.new()
+        for _ in range(pages):
+            pdf.add_blank_page()
+        pdf.save(tmp_path / f"{name}.pdf")
+        paths.append(str(tmp_path / f"{name}.pdf"))
+
+    merged = str(tmp_path / "merged.pdf")
+    merge_pdfs(paths, merged)
+    with pikepdf.open(merged) as pdf:
+        assert len(pdf.pages) == 5
+
+    assert parse_page_ranges("1-2, 4-", 5) == [(1, 2), (4, 5)]
+    with pytest.raises(ValueError):
+        parse_page_ranges("3-1")
+    with pytest.raises(ValueError):
+        parse_page_ranges("6", 5)
+
+    single = str(tmp_path / "single.pdf")
+    split_pdf(merged, single, "2-4")
+    with pikepdf.open(single) as pdf:
+        assert len(pdf.pages) == 3
+
+    archive = str(tmp_path / "parts.zip")
+    split_pdf(merged, archive, "1,2-")
+    with zipfile.ZipFile(archive) as zf:
+        assert zf.namelist() == ["merged_p1.pdf", "merged_p2-5.pdf"]
+
+    # 未指定范围时即使只有一页也输出 zip，与 get_output_extension 一致
+    from app.tasks import get_output_extension
+
+    one_page = str(tmp_path / "one.pdf")
+    split_pdf(merged, one_page, "3")
+    assert get_output_extension("split", {}) == "zip"
+    archive = str(tmp_path / "one.zip")
+    split_pdf(one_page, archive)
+    with zipfile.ZipFile(archive) as zf:
+        assert zf.namelist() == ["one_p1.pdf"]
+
+
+def test_create_merge_task_checks_total_size(tmp_path, monkeypatch):
+    """测试 merge 任务按全部输入文件的总大小检查限额"""
+    from app import runtime_config
+    from app.config import settings
+
+    monkeypatch.setattr(settings, "STORAGE_BASE_PATH", str(tmp_path))
+    monkeypatch.setattr(runtime_config, "current", lambda: runtime_config.RuntimeConfig(free_file_size_mb=1))
+    for name in ("a.pdf", "b.pdf"):
+        (tmp_path / name).write_bytes(b"x" * 600 * 1024)
+
+    payload = {"task_type": "merge", "file_name": "a.pdf", "file_size": 1024, "client_id": "c"}
+    response = client.post("/api/v1/tasks", json={**payload, "file_keys": ["a.pdf", "b.pdf"]})
+    assert response.status_code == 402
+
+    response = client.post("/api/v1/tasks", json={**payload, "file_keys": ["a.pdf", "missing.pdf"]})
+    assert response.status_code == 400
+
+
+def test_task_events_stream(tmp_path, monkeypatch, make_task):
+    """测试任务状态 SSE：推送当前状态，终态后关闭连接；Redis 不可用时同样可用"""
+    import json
+    import uuid
+    from app.config import settings
+
+    monkeypatch.setattr(settings, "REDIS_URL", "redis://127.0.0.1:1/0")
+    task_id = make_task(file_name="a.pdf", file_size=1, status="failed", error_msg="boom").task_id
+
+    response = client.get(f"/api/v1/tasks/{task_id}/events")
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/event-stream")
+    events = [json.loads(line[5:]) for line in response.text.splitlines() if line.startswith("data:")]
+    assert events == [{"task_id": task_id, "status": "failed", "error_msg": "boom"}]
+
+    assert client.get(f"/api/v1/tasks/{uuid.uuid4()}/events").status_code == 404
+
+
+def test_task_events_lost_publish(monkeypatch):
+    """测试任务状态 SSE：终态事件的发布丢失时，心跳重新读取状态并推送终态"""
+    import json
+    import fakeredis
+    from app.config import settings
+    from app.routes import tasks as task_routes
+
+    monkeypatch.setattr(settings, "TASK_EVENTS_HEARTBEAT_SECONDS", 0)
+    monkeypatch.setattr(task_routes, "new_async_redis", lambda: fakeredis.FakeAsyncRedis())
+    snapshots = iter([{"task_id": "t", "status": "pending"}, {"task_id": "t", "status": "completed"}])
+
+    async def snapshot(task_id):
+        return next(snapshots)
+
+    monkeypatch.setattr(task_routes, "_task_event_snapshot", snapshot)
+
+    response = client.get("/api/v1/tasks/t/events")
+    events = [json.loads(line[5:]) for line in response.text.splitlines() if line.startswith("data:")]
+    assert [event["status"] for event in events] == ["pending", "completed"]
+
+
+def test_progress_estimate_and_callbacks(tmp_path):
+    """测试进度估算与转换回调"""
+    import pikepdf
+    from app.converters import split_pdf
+    from app.progress import estimate
+
+    assert estimate(0, 10, 100.0, now=110.0) == {"progress": 0.0, "eta_seconds": None}
+    assert estimate(4, 10, 100.0, now=108.0) == {"progress": 40.0, "eta_seconds": 12}
+
+    pdf = pikepdf.new()
+    for _ in range(3):
+        pdf.add_blank_page()
+    pdf.save(tmp_path / "a.pdf")
+
+    calls = []
+    split_pdf(str(tmp_path / "a.pdf"), str(tmp_path / "a.zip"), None, lambda *args: calls.append(args))
+    assert calls == [(1, 3, "splitting"), (2, 3, "splitting"), (3, 3, "splitting")]
+
+
+def test_pdf2ppt_render_windows(tmp_path, monkeypatch):
+    """测试 pdf2ppt 分批渲染：跨窗口边界时幻灯片数量和顺序与页面一致，默认使用无损 PNG"""
+    import io
+    import pdf2image
+    from PIL import Image
+    from pptx import Presentation
+    from app.config import settings
+    from app.converters import convert_pdf2ppt
+
+    monkeypatch.setattr(settings, "PDF2PPT_RENDER_WINDOW", 3)
+    calls = []
+
+    def render(path, dpi, first_page, last_page, thread_count):
+        calls.append((first_page, last_page))
+        # 用页码作为像素颜色，便于检查顺序
+        return [Image.new("RGB", (8, 6), (page, 0, 0)) for page in range(first_page, last_page + 1)]
+
+    monkeypatch.setattr(pdf2image, "pdfinfo_from_path", lambda path: {"Pages": 7})
+    monkeypatch.setattr(pdf2image, "convert_from_path", render)
+    progress = []
+
+    convert_pdf2ppt("in.pdf", str(tmp_path / "out.pptx"), lambda *args: progress.append(args))
+
+    assert calls == [(1, 3), (4, 6), (7, 7)]
+    assert progress == [(3, 7, "rendering"), (6, 7, "rendering"), (7, 7, "rendering")]
+    pictures = [slide.shapes[0].image for slide in Presentation(str(tmp_path / "out.pptx")).slides]
+    assert [picture.content_type for picture in pictures] == ["image/png"] * 7
+    assert [Image.open(io.BytesIO(picture.blob)).getpixel((0, 0))[0] for picture in pictures] == list(range(1, 8))
+
+
+def test_get_task_view_cache(monkeypatch, db, make_task):
+    """测试任务查询缓存：命中时不查库，过期 410 与不存在的任务由缓存返回，写入失败时删除旧值"""
+    import uuid
+    from datetime import datetime, timedelta
+    import fakeredis
+    from redis import RedisError
+    from app import task_cache
+    from app.config import settings
+
+    redis = fakeredis.FakeRedis(decode_responses=True)
+    monkeypatch.setattr(task_cache, "get_redis", lambda: redis)
+
+    task = make_task(file_name="a.pdf", file_size=1)
+    task_id = task.task_id
+
+    assert client.get(f"/api/v1/tasks/{task_id}").json()["status"] == "pending"
+    assert 0 < redis.ttl(task_cache.view_key(task_id)) <= settings.TASK_VIEW_CACHE_ACTIVE_TTL_SECONDS
+
+    # 直接改库不影响缓存，写入方负责更新
+    task.status = "processing"
+    db.commit()
+    assert client.get(f"/api/v1/tasks/{task_id}").json()["status"] == "pending"
+    task_cache.store_view(task)
+    assert client.get(f"/api/v1/tasks/{task_id}").json()["status"] == "processing"
+
+    # 终态的缓存保留到过期之后
+    task.status = "completed"
+    db.commit()
+    task_cache.store_view(task)
+    assert redis.ttl(task_cache.view_key(task_id)) > 3600
+
+    # 覆盖写入失败：删除旧值，下次查询回源
+    def fail_set(*args, **kwargs):
+        raise RedisError("write failed")
+
+    task.status = "failed"
+    db.commit()
+    with monkeypatch.context() as m:
+        m.setattr(redis, "set", fail_set)
+        task_cache.store_view(task)
+    assert redis.get(task_cache.view_key(task_id)) is None
+    assert client.get(f"/api/v1/tasks/{task_id}").json()["status"] == "failed"
+
+    task.expire_at = datetime.now() - timedelta(minutes=1)
+    db.commit()
+    task_cache.store_view(task)
+    db.delete(task)
+    db.commit()
+    assert client.get(f"/api/v1/tasks/{task_id}").status_code == 410
+
+    unknown = str(uuid.uuid4())
+    assert client.get(f"/api/v1/tasks/{unknown}").status_code == 404
+    assert redis.get(task_cache.view_key(unknown)) == task_cache.MISSING
+
+
+def test_pool_metrics():
+    """测试连接池等待时间与饱和度统计"""
+    import sqlite3
+    from sqlalchemy import exc
+    from app.db_pool import InstrumentedQueuePool, pool_stats
+
+    pool = InstrumentedQueuePool(lambda: sqlite3.connect(":memory:"), pool_size=2, max_overflow=0, timeout=0.05)
+    first, second = pool.connect(), pool.connect()
+    with pytest.raises(exc.TimeoutError):
+        pool.connect()
+
+    stats = pool_stats(pool)
+    assert stats["saturation"] == 1.0
+    assert stats["checkouts"] == 2
+    assert stats["timeouts"] == 1
+    assert stats["wait_max_ms"] >= 50
+
+    first.close()
+    assert pool_stats(pool)["saturation"] == 0.5
+    second.close()
+
+
+def test_status_pipeline_batch_writer(monkeypatch, db, make_task):
+    """测试状态流水线：覆盖层先于落库可见，批量写入后清理，终态不被旧状态覆盖"""
+    from datetime import datetime
+    import fakeredis
+    from app import status_pipeline, status_writer
+    from app.config import settings
+    from app.models import Task
+    from app.tasks import _update_task
+
+    redis = fakeredis.FakeRedis(decode_responses=True)
+    monkeypatch.setattr(settings, "STATUS_PIPELINE", "redis_stream")
+    monkeypatch.setattr(status_pipeline, "get_redis", lambda: redis)
+    monkeypatch.setattr(status_writer, "get_redis", lambda: redis)
+
+    task = make_task(file_name="a.pdf", file_size=1)
+    task_id = task.task_id
+    db.refresh(task)
+    db.expunge(task)
+
+    _update_task(db, task, status="processing")
+    _update_task(db, task, status="completed", file_key_result="results/a.docx", completed_at=datetime.now())
+    assert status_pipeline.read_overlay(task_id)["status"] == "completed"
+    assert db.get(Task, task_id).status == "pending"
+
+    writer = status_writer.StatusWriter("test")
+    status_writer.ensure_group(redis)
+    # 第一轮处理待确认列表（为空），第二轮读取新记录
+    writer.run_once()
+    assert writer.run_once() == 2
+
+    db.expire_all()
+    assert db.get(Task, task_id).status == "completed"
+    assert status_pipeline.read_overlay(task_id) == {}
+    assert redis.xlen(settings.STATUS_STREAM_KEY) == 0
+
+    # 较早的非终态更新不会覆盖终态
+    _update_task(db, task, status="processing")
+    writer.run_once()
+    db.expire_all()
+    assert db.get(Task, task_id).status == "completed"
+
+
+def test_cleanup_expired_files_batches(tmp_path, monkeypatch, db, make_task):
+    """测试过期清理：分批处理，删除源文件与结果文件，排队中的任务只在宽限期后清理"""
+    import uuid
+    from datetime import datetime, timedelta
+    from app.config import settings
+    from app.models import Task
+    from app.tasks import cleanup_expired_files
+
+    monkeypatch.setattr(settings, "STORAGE_BASE_PATH", str(tmp_path))
+    monkeypatch.setattr(settings, "CLEANUP_BATCH_SIZE", 2)
+    monkeypatch.setattr(settings, "TASK_VIEW_CACHE_ENABLED", False)
+
+    expired_ids = []
+    alive_ids = []
+    tasks = [
+        ("completed", timedelta(minutes=1)),
+        ("failed", timedelta(minutes=2)),
+        ("pending", timedelta(hours=25)),
+        ("completed", timedelta(minutes=4)),
+        ("completed", timedelta(minutes=5)),
+        ("completed", -timedelta(hours=1)),
+        ("pending", timedelta(minutes=1)),
+        ("processing", timedelta(hours=1)),
+    ]
+    for status, expired_for in tasks:
+        task_id = str(uuid.uuid4())
+        (tmp_path / f"{task_id}.pdf").write_bytes(b"x" * 10)
+        make_task(
+            task_id=task_id,
+            file_key_source=f"{task_id}.pdf",
+            file_key_result=f"{task_id}.docx" if status == "completed" else None,
+            status=status,
+            expire_at=datetime.now() - expired_for,
+        )
+        if (status in ("completed", "failed") and expired_for > timedelta(0)) or expired_for > timedelta(hours=24):
+            expired_ids.append(task_id)
+        else:
+            alive_ids.append(task_id)
+
+    cleanup_expired_files()
+
+    db.expire_all()
+    assert {db.get(Task, task_id).status for task_id in expired_ids} == {"expired"}
+    assert [db.get(Task, task_id).status for task_id in alive_ids] == ["completed", "pending", "processing"]
+    assert sorted(p.name for p in tmp_path.glob("*.pdf")) == sorted(f"{task_id}.pdf" for task_id in alive_ids)
+
+
+def test_reconcile_orphan_files(tmp_path, monkeypatch, db, make_task):
+    """测试孤儿文件清理：只删除超过宽限期且无任务引用的文件，并删除空目录；断点续扫时处理断点的上级目录"""
+    import os
+    import time
+    import uuid
+    from app import reconciler
+    from app.config import settings
+
+    monkeypatch.setattr(settings, "STORAGE_BASE_PATH", str(tmp_path))
+    monkeypatch.setattr(reconciler, "_load_cursor", lambda: None)
+    monkeypatch.setattr(reconciler, "_save_cursor", lambda parts: None)
+    # 宽限期按 mtime 和 ctime 中较晚者判断，ctime 无法改到过去：宽限期设为 0，宽限期内的文件用未来的 mtime 表示
+    monkeypatch.setattr(settings, "ORPHAN_GRACE_HOURS", 0)
+
+    old = time.time() - 3600
+    future = time.time() + 3600
+    task_id = str(uuid.uuid4())
+    files = {
+        "uploads/2020/01/01/kept.pdf": old,
+        "uploads/2020/01/01/orphan.pdf": old,
+        "uploads/2020/01/02/orphan.pdf": old,
+        "uploads/2020/01/03/recent.pdf": future,
+        f"results/2020/01/01/{task_id}.docx": old,
+        f"results/2020/01/01/{uuid.uuid4()}.docx": old,
+    }
+    for key, mtime in files.items():
+        path = tmp_path / key
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_bytes(b"x" * 10)
+        os.utime(path, (mtime, mtime))
+    for day in ("01", "02"):
+        os.utime(tmp_path / "uploads/2020/01" / day, (old, old))
+
+    make_task(task_id=task_id, file_key_source="uploads/2020/01/01/kept.pdf", status="completed")
+    time.sleep(0.01)
+
+    stats = reconciler.reconcile(db)
+
+    remaining = sorted(str(p.relative_to(tmp_path)) for p in tmp_path.rglob("*") if p.is_file())
+    assert remaining == sorted(
+        ["uploads/2020/01/01/kept.pdf", "uploads/2020/01/03/recent.pdf", f"results/2020/01/01/{task_id}.docx"]
+    )
+    assert stats["deleted"] == 3
+    assert stats["freed_bytes"] == 30
+    assert stats["finished"]
+    assert not (tmp_path / "uploads/2020/01/02").exists()
+
+    # 从 uploads/2020/01/01 之后继续：已处理的目录跳过，尚未处理的上级目录 uploads/2020/01 不跳过
+    (tmp_path / "uploads/2020/01/stray.pdf").write_bytes(b"x")
+    (tmp_path / "uploads/2020/01/01/skipped.pdf").write_bytes(b"x")
+    monkeypatch.setattr(reconciler, "_load_cursor", lambda: ("uploads", "2020", "01", "01"))
+    time.sleep(0.01)
+    reconciler.reconcile(db)
+    assert not (tmp_path / "uploads/2020/01/stray.pdf").exists()
+    assert (tmp_path / "uploads/2020/01/01/skipped.pdf").exists()
+
+    # 刚从结果缓存硬链接出的文件保留旧 mtime，仍在宽限期内
+    monkeypatch.setattr(settings, "ORPHAN_GRACE_HOURS", 48)
+    monkeypatch.setattr(reconciler, "_load_cursor", lambda: None)
+    cached = tmp_path / "cache" / "cached.docx"
+    cached.parent.mkdir()
+    cached.write_bytes(b"x")
+    stale = time.time() - 72 * 3600
+    os.utime(cached, (stale, stale))
+    linked = tmp_path / f"results/2020/01/01/{uuid.uuid4()}.docx"
+    os.link(cached, linked)
+    reconciler.reconcile(db)
+    assert linked.exists()
+
+
+def test_bucketed_storage_layout(tmp_path, monkeypatch, make_task):
+    """测试分桶存储布局：按保留类别和过期小时分桶，过期的桶整体删除，仍被未完成任务使用的桶保留"""
+    import json
+    import uuid
+    from datetime import datetime, timedelta
+    from app.config import settings
+    from app.storage import is_bucketed_key, storage_dir, to_file_key
+    from app.tasks import cleanup_expired_files
+
+    monkeypatch.setattr(settings, "STORAGE_BASE_PATH", str(tmp_path))
+    monkeypatch.setattr(settings, "STORAGE_LAYOUT", "bucketed")
+    monkeypatch.setattr(settings, "TASK_VIEW_CACHE_ENABLED", False)
+
+    now = datetime(2024, 5, 1, 10, 20)
+    path = storage_dir("uploads", "a.pdf", is_paid=False, now=now)
+    assert to_file_key(path).split("/")[:3] == ["uploads", "free", "2024050112"]
+    assert storage_dir("results", "a.pdf", True, datetime(2024, 5, 2, 9, 0)).endswith("2024050209" + path[-3:])
+
+    expire_at = datetime.now() - timedelta(hours=settings.STORAGE_BUCKET_GRACE_HOURS + 1)
+    alive_expire = datetime.now() + timedelta(hours=1)
+    keys = {}
+    for name, when in (("old", expire_at), ("alive", alive_expire)):
+        task_id = str(uuid.uuid4())
+        file_path = f"{storage_dir('results', task_id + '.docx', False, when)}/{task_id}.docx"
+        open(file_path, "wb").write(b"x")
+        keys[name] = to_file_key(file_path)
+        assert is_bucketed_key(keys[name])
+        make_task(task_id=task_id, file_key_result=keys[name], status="completed", expire_at=when)
+
+    # 按上传时间已过期的桶中的源文件仍被排队中的 merge 任务使用
+    source_dir = storage_dir("uploads", "in-use.pdf", False, expire_at)
+    open(f"{source_dir}/in-use.pdf", "wb").write(b"x")
+    in_use = to_file_key(f"{source_dir}/in-use.pdf")
+    make_task(task_type="merge", file_key_source="uploads/x.pdf", merge_file_keys=json.dumps(["uploads/x.pdf", in_use]))
+
+    cleanup_expired_files()
+
+    assert not (tmp_path / keys["old"]).parent.parent.exists()
+    assert (tmp_path / keys["alive"]).exists()
+    assert (tmp_path / in_use).exists()
+
+
+def test_hourly_stats_rollup(db, make_task):
+    """测试小时统计汇总：计数、字节数和耗时分位数，任务过期后统计不变，迟到完成的任务计入创建时的小时，每日统计读取汇总表"""
+    import uuid
+    from datetime import datetime, timedelta
+    from app.config import settings
+    from app.models import Task, TaskStatsHourly
+    from app.routes.admin import get_current_admin
+    from app.stats_rollup import floor_hour, percentile, rollup
+
+    assert percentile([1, 2, 3, 4], 50) == 2
+    assert percentile([1, 2, 3, 4], 99) == 4
+    assert percentile([], 50) is None
+
+    task_type = f"stats-{uuid.uuid4().hex[:8]}"
+    hour = floor_hour(datetime.now()) - timedelta(hours=1)
+
+    for i in range(10):
+        created = hour + timedelta(minutes=i)
+        failed = i == 9
+        make_task(
+            file_size=100,
+            task_type=task_type,
+            status="failed" if failed else "completed",
+            is_paid=i < 2,
+            error_msg="boom" if failed else None,
+            created_at=created,
+            completed_at=created + timedelta(seconds=i + 1),
+        )
+    make_task(file_size=100, task_type=task_type, created_at=hour)
+
+    rollup(db)
+    db.execute(Task.__table__.update().where(Task.task_type == task_type).values(status="expired"))
+    db.commit()
+    rollup(db)
+
+    row = db.get(TaskStatsHourly, (hour, task_type))
+    assert (row.total_tasks, row.completed_tasks, row.failed_tasks, row.paid_tasks) == (11, 9, 1, 2)
+    # 只统计完成任务的字节数，失败和未完成的任务不计入
+    assert row.bytes_processed == 900
+    assert (row.duration_p50, row.duration_p90, row.duration_p99) == (5.0, 9.0, 9.0)
+
+    # 汇总窗口之前创建、之后才完成的任务，所在的小时重新汇总
+    late_hour = hour - timedelta(hours=settings.STATS_ROLLUP_LOOKBACK_HOURS + 2)
+    late = make_task(file_size=100, task_type=task_type, created_at=late_hour)
+    rollup(db)
+    assert db.get(TaskStatsHourly, (late_hour, task_type)) is None
+    late.completed_at = datetime.now()
+    db.commit()
+    rollup(db)
+    db.expire_all()
+    assert db.get(TaskStatsHourly, (late_hour, task_type)).completed_tasks == 1
+
+    app.dependency_overrides[get_current_admin] = lambda: "admin"
+    try:
+        stats = client.get("/admin/stats/daily").json()
+        hourly = client.get("/admin/stats/hourly").json()
+    finally:
+        app.dependency_overrides.pop(get_current_admin)
+    assert [s["date"] for s in stats] == sorted((s["date"] for s in stats), reverse=True)
+    assert str(hour.date()) in {s["date"] for s in stats}
+    assert any(h["task_type"] == task_type and h["duration_p90"] == 9.0 for h in hourly)
+
+
+def test_revenue_ledger(db):
+    """测试收入台账：订单新增、状态变化、删除时在同一事务中增量更新，统计接口按日期读取"""
+    import uuid
+    from datetime import datetime
+    from sqlalchemy import delete
+    from app.database import init_db
+    from app.models import Order, RevenueLedger
+    from app.revenue_ledger import ALL_TIME, rebuild
+    from app.routes.admin import get_current_admin
+
+    day = datetime(2022, 3, 4, 12)
+    period = day.strftime("%Y-%m-%d")
+
+    orders = [
+        Order(order_id=str(uuid.uuid4()), client_id="c", amount=amount, status=status, created_at=day)
+        for amount, status in ((10.0, "unpaid"), (20.0, "paid"), (30.0, "paid"), (5.0, None))
+    ]
+    db.add_all(orders)
+    db.commit()
+
+    orders[0].status = "paid"
+    orders[2].status = "refunded"
+    db.commit()
+    db.delete(orders[3])
+    db.commit()
+
+    # 未加载旧值（对象已过期）时修改金额
+    db.expire(orders[1])
+    orders[1].amount = 25.0
+    db.commit()
+
+    row = db.get(RevenueLedger, period)
+    db.refresh(row)
+    assert (row.total_orders, row.paid_amount, row.refunded_amount) == (3, 35.0, 30.0)
+    total = db.get(RevenueLedger, ALL_TIME)
+    db.refresh(total)
+    assert (total.total_orders, total.paid_amount, total.refunded_amount) == (3, 35.0, 30.0)
+
+    # 重新计算的结果与增量维护一致
+    rebuild(db)
+    db.commit()
+    db.expire_all()
+    assert db.get(RevenueLedger, period).paid_amount == 35.0
+
+    app.dependency_overrides[get_current_admin] = lambda: "admin"
+    try:
+        stats = client.get(f"/admin/stats/revenue?start_date={period}&end_date={period}").json()
+        bad = client.get("/admin/stats/revenue?start_date=2001-02-01&end_date=2001-01-01")
+    finally:
+        app.dependency_overrides.pop(get_current_admin)
+    assert stats == {"total_orders": 3, "total_revenue": 35.0, "refunded_amount": 30.0, "net_revenue": 5.0}
+    assert bad.status_code == 400
+
+    # 台账为空（升级部署，已有历史订单）时 init_db 自动重建
+    db.execute(delete(RevenueLedger))
+    db.commit()
+    init_db()
+    assert db.get(RevenueLedger, period).paid_amount == 35.0
+    assert db.get(RevenueLedger, ALL_TIME).total_orders == 3
+
+
+def test_admin_tasks_keyset_pagination(db, make_task):
+    """测试管理后台任务列表：按 (created_at, task_id) 游标翻页并筛选"""
+    import uuid
+    from datetime import datetime, timedelta
+    from app.models import Task
+    from app.pagination import decode_cursor, encode_cursor
+    from app.routes.admin import get_current_admin
+
+    created = datetime(2020, 3, 1, 8, 0)
+    assert decode_cursor(encode_cursor(created, "abc")) == (created, "abc")
+
+    client_id = f"admin-list-{uuid.uuid4().hex[:8]}"
+    for i in range(7):
+        make_task(
+            client_id=client_id,
+            status="completed",
+            is_paid=i % 2 == 0,
+            # 两两同一时刻，验证相同 created_at 时按 task_id 继续翻页
+            created_at=created + timedelta(minutes=i // 2),
+        )
+    expected = [
+        t.task_id
+        for t in sorted(db.query(Task).filter(Task.client_id == client_id), key=lambda t: (t.created_at, t.task_id))
+    ][::-1]
+
+    app.dependency_overrides[get_current_admin] = lambda: "admin"
+    try:
+        seen, cursor = [], None
+        while True:
+            params = {"client_id": client_id, "limit": 3}
+            if cursor:
+                params["cursor"] = cursor
+            response = client.get("/admin/tasks", params=params)
+            assert response.status_code == 200
+            seen += [t["task_id"] for t in response.json()]
+            cursor = response.headers.get("X-Next-Cursor")
+            if not cursor:
+                break
+
+        paid = client.get(
+            "/admin/tasks",
+            params={"client_id": client_id, "is_paid": True, "start_date": "2020-03-01", "end_date": "2020-03-01"},
+        ).json()
+        bad = client.get("/admin/tasks", params={"cursor": "not-a-cursor"})
+    finally:
+        app.dependency_overrides.pop(get_current_admin)
+
+    assert seen == expected
+    assert len(paid) == 4 and all(t["is_paid"] for t in paid)
+    assert bad.status_code == 400
+
+
+def test_history_cursor_and_projection(make_task):
+    """测试历史记录：游标翻页、只返回付费任务、字段投影"""
+    import uuid
+    from datetime import datetime, timedelta
+
+    client_id = f"history-{uuid.uuid4().hex[:8]}"
+    created = datetime(2021, 6, 1, 9, 0)
+    for i in range(5):
+        make_task(
+            client_id=client_id,
+            file_name=f"{i}.pdf",
+            status="completed",
+            is_paid=i != 0,
+            error_msg="x" * 1000,
+            created_at=created + timedelta(minutes=i),
+        )
+
+    first = client.get("/api/v1/history", params={"client_id": client_id, "limit": 3})
+    assert [t["file_name"] for t in first.json()] == ["4.pdf", "3.pdf", "2.pdf"]
+    cursor = first.headers["X-Next-Cursor"]
+
+    second = client.get("/api/v1/history", params={"client_id": client_id, "limit": 3, "cursor": cursor})
+    assert [t["file_name"] for t in second.json()] == ["1.pdf"]
+    assert "X-Next-Cursor" not in second.headers
+    assert second.json()[0]["error_msg"] is None
+
+    projected = client.get("/api/v1/history", params={"client_id": client_id, "fields": "status", "limit": 1})
+    assert set(projected.json()[0]) == {"task_id", "status", "created_at"}
+    assert "X-Next-Cursor" in projected.headers
+
+    bad = client.get("/api/v1/history", params={"client_id": client_id, "fields": "file_key_source"})
+    assert bad.status_code == 400
+
+
+def test_runtime_config_hot_reload(monkeypatch, db):
+    """测试运行时配置：管理后台修改后本进程立即生效，并通过 Redis 通知其它进程"""
+    import fakeredis
+    from app import runtime_config
+    from app.config import settings
+    from app.models import SystemConfig
+    from app.routes.admin import get_current_admin
+
+    fake = fakeredis.FakeRedis(decode_responses=True)
+    monkeypatch.setattr(runtime_config, "get_redis", lambda: fake)
+    pubsub = fake.pubsub(ignore_subscribe_messages=True)
+    pubsub.subscribe(settings.RUNTIME_CONFIG_CHANNEL)
+    pubsub.get_message(timeout=1)  # 订阅确认
+
+    db.merge(SystemConfig(config_key="max_file_size_mb", config_value=str(settings.MAX_FILE_SIZE_MB)))
+    db.commit()
+
+    app.dependency_overrides[get_current_admin] = lambda: "admin"
+    try:
+        assert runtime_config.current().max_file_size_mb == settings.MAX_FILE_SIZE_MB
+
+        bad = client.put("/admin/configs", json={"config_key": "max_file_size_mb", "config_value": "abc"})
+        assert bad.status_code == 400
+
+        response = client.put("/admin/configs", json={"config_key": "max_file_size_mb", "config_value": "1"})
+        assert response.status_code == 200
+        assert runtime_config.current().max_file_size_mb == 1
+        assert pubsub.get_message(timeout=1)["data"] == "max_file_size_mb"
+
+        response = client.post(
+            "/api/v1/tasks",
+            json={"file_key": "x.pdf", "task_type": "pdf2word", "file_name": "x.pdf", "file_size": 2 * 1024 * 1024, "client_id": "c"},
+        )
+        assert response.status_code == 400
+        assert "1MB" in response.json()["detail"]
+    finally:
+        app.dependency_overrides.pop(get_current_admin)
+        db.delete(db.get(SystemConfig, "max_file_size_mb"))
+        db.commit()
+        runtime_config.reload()
+
+
+def test_convert_queue_routing(monkeypatch):
+    """测试转换任务按付费状态和任务类型路由到不同队列，队列内小文件优先"""
+    from app.celery_app import QUEUE_FREE, QUEUE_PAID, QUEUE_RENDER, celery_app, convert_route
+    from app.routes import tasks as task_routes
+
+    assert convert_route("pdf2ppt", True, 100 * 1024 * 1024) == {"queue": QUEUE_PAID, "priority": 0}
+    assert convert_route("pdf2ppt", False, 1024)["queue"] == QUEUE_RENDER
+    small, large = convert_route("pdf2word", False, 1024), convert_route("pdf2word", False, 40 * 1024 * 1024)
+    assert small["queue"] == large["queue"] == QUEUE_FREE
+    assert small["priority"] < large["priority"]
+    assert {QUEUE_PAID, QUEUE_FREE, QUEUE_RENDER} <= {q.name for q in celery_app.conf.task_queues}
+
+    sent = []
+    monkeypatch.setattr(task_routes.convert_pdf_task, "apply_async", lambda args, **kwargs: sent.append(kwargs))
+    response = client.post(
+        "/api/v1/tasks",
+        json={"file_key": "x.pdf", "task_type": "pdf2ppt", "file_name": "x.pdf", "file_size": 1024, "client_id": "c"},
+    )
+    assert response.status_code == 200
+    assert sent == [{"queue": QUEUE_RENDER, "priority": 3}]
+
+
+def test_rate_limit_and_admission(monkeypatch):
+    """测试令牌桶限流（客户端、IP 分别计数）和队列积压时的准入控制"""
+    from app import rate_limit, runtime_config
+    from app.celery_app import QUEUE_FREE, convert_route
+    from app.routes import tasks as task_routes
+
+    broker = rate_limit.get_broker_redis()
+    config = runtime_config.RuntimeConfig(
+        rate_limit_client_per_minute=60, rate_limit_client_burst=2, rate_limit_ip_burst=3, queue_max_depth=2
+    )
+    monkeypatch.setattr(runtime_config, "current", lambda: config)
+
+    assert [rate_limit.acquire("task", "a", "1.1.1.1") for _ in range(2)] == [0, 0]
+    wait = rate_limit.acquire("task", "a", "1.1.1.1")
+    assert 0 < wait <= 1
+    # 被拒绝的请求不扣减 IP 桶：另一个客户端还能用掉 IP 桶剩下的 1 个令牌
+    assert rate_limit.acquire("task", "b", "1.1.1.1") == 0
+    assert rate_limit.acquire("task", "c", "1.1.1.1") > 0
+    # 上传与创建任务分别计数
+    assert rate_limit.acquire("upload", "a", "2.2.2.2") == 0
+
+    sent = []
+    monkeypatch.setattr(task_routes.convert_pdf_task, "apply_async", lambda args, **kwargs: sent.append(kwargs))
+    payload = {"file_key": "x.pdf", "task_type": "pdf2word", "file_name": "x.pdf", "file_size": 1024, "client_id": "d"}
+
+    assert client.post("/api/v1/tasks", json=payload).status_code == 200
+    assert convert_route("pdf2word", False, 1024)["queue"] == QUEUE_FREE
+    broker.rpush(QUEUE_FREE, "job")
+    broker.rpush(f"{QUEUE_FREE}{rate_limit.PRIORITY_SEP}3", "job")
+    assert rate_limit.queue_depth(QUEUE_FREE) == 2
+
+    rejected = client.post("/api/v1/tasks", json=payload)
+    assert rejected.status_code == 503
+    assert rejected.headers["Retry-After"]
+
+    limited = client.post("/api/v1/tasks", json=payload)
+    assert limited.status_code == 429
+    assert int(limited.headers["Retry-After"]) >= 1
+    assert len(sent) == 1
+
+
+def _write_table_pdf(path, pages):
+    """生成每页一个 2x2 表格的 PDF，单元格内容为 页码-行-列"""
+    import fitz
+
+    doc = fitz.open()
+    for n in range(pages):
+        page = doc.new_page()
+        for r in range(3):
+            page.draw_line((50, 50 + r * 30), (250, 50 + r * 30))
+        for c in range(3):
+            page.draw_line((50 + c * 100, 50), (50 + c * 100, 110))
+        for r in range(2):
+            for c in range(2):
+                page.insert_text((60 + c * 100, 70 + r * 30), f"{n}-{r}-{c}")
+    doc.save(str(path))
+    doc.close()
+
+
+def _convert_in_pool_child(args):
+    """在 billiard 进程池（与 Celery prefork 相同的 daemon 子进程）中执行转换，返回回退警告"""
+    from app import converters
+
+    warnings = []
+
+    class _Logger:
+        def info(self, *a, **kw):
+            pass
+
+        def warning(self, event, **kw):
+            warnings.append(event)
+
+    converter, input_path, output_path = args
+    converters.logger = _Logger()
+    getattr(converters, converter)(input_path, output_path)
+    return warnings
+
+
+def test_pdf2excel_parallel_in_daemon_process(tmp_path, monkeypatch):
+    """测试 pdf2excel 并行提取可以在 Celery prefork 的 daemon 子进程中运行"""
+    import billiard
+    from openpyxl import load_workbook
+    from app.config import settings
+
+    monkeypatch.setattr(settings, "PDF2EXCEL_PARALLEL_MIN_PAGES", 2)
+    monkeypatch.setattr(settings, "PDF2EXCEL_PAGES_PER_CHUNK", 1)
+    monkeypatch.setattr(settings, "CONVERT_PROCESS_WORKERS", 2)
+
+    source, output = tmp_path / "tables.pdf", tmp_path / "tables.xlsx"
+    _write_table_pdf(source, 4)
+
+    with billiard.Pool(1) as pool:
+        warnings = pool.apply(_convert_in_pool_child, (("convert_pdf2excel", str(source), str(output)),))
+
+    assert warnings == []
+    wb = load_workbook(output)
+    assert [ws.cell(1, 1).value for ws in wb.worksheets] == ["0-0-0", "1-0-0", "2-0-0", "3-0-0"]
+
+
+def test_migrate_existing_tasks_table(tmp_path):
+    """测试已有的 tasks 表补齐新增列和索引，重复执行不报错"""
+    from sqlalchemy import create_engine, inspect, text
+    from app.database import MIGRATION_INDEXES, migrate
+
+    engine = create_engine(f"sqlite:///{tmp_path / 'old.db'}")
+    with engine.begin() as conn:
+        conn.execute(text(
+            "CREATE TABLE tasks (task_id VARCHAR(64) PRIMARY KEY, client_id VARCHAR(64), "
+            "file_key_source VARCHAR(255), task_type VARCHAR(50), status VARCHAR(50), "
+            "is_paid BOOLEAN, expire_at DATETIME, created_at DATETIME)"
+        ))
+        conn.execute(text("INSERT INTO tasks (task_id, client_id, status) VALUES ('t1', 'c1', 'pending')"))
+
+    migrate(engine)
+    migrate(engine)
+
+    inspector = inspect(engine)
+    assert "file_hash" in {column["name"] for column in inspector.get_columns("tasks")}
+    assert set(MIGRATION_INDEXES["tasks"]) <= {index["name"] for index in inspector.get_indexes("tasks")}
+    with engine.connect() as conn:
+        assert conn.execute(text("SELECT task_id, file_hash FROM tasks")).all() == [("t1", None)]
+
+
+def test_pdf2word_parallel_in_daemon_process(tmp_path, monkeypatch):
+    """测试 pdf2word 在 daemon 子进程中并行解析，合并后的文档与单进程转换一致"""
+    import billiard
+    import fitz
+    from docx import Document
+    from app import converters
+    from app.config import settings
+
+    monkeypatch.setattr(settings, "PDF2WORD_PARALLEL_MIN_PAGES", 2)
+    monkeypatch.setattr(settings, "CONVERT_PROCESS_WORKERS", 2)
+
+    source = tmp_path / "pages.pdf"
+    doc = fitz.open()
+    for n in range(5):
+        doc.new_page().insert_text((72, 72), f"page {n} text")
+    doc.save(str(source))
+    doc.close()
+
+    parallel = tmp_path / "parallel.docx"
+    with billiard.Pool(1) as pool:
+        warnings = pool.apply(_convert_in_pool_child, (("convert_pdf2word", str(source), str(parallel)),))
+    assert warnings == []
+
+    monkeypatch.setattr(settings, "PDF2WORD_PARALLEL_MIN_PAGES", 100)
+    sequential = tmp_path / "sequential.docx"
+    converters.convert_pdf2word(str(source), str(sequential))
+
+    def texts(path):
+        return [p.text for p in Document(str(path)).paragraphs if p.text.strip()]
+
+    assert texts(parallel) == [f"page {n} text" for n in range(5)]
+    assert texts(parallel) == texts(sequential)
+
+
+def test_convert_task_hashes_only_cacheable(tmp_path, monkeypatch, make_task):
+    """测试 worker 只在结果缓存开启且任务可缓存（非 merge）时计算源文件哈希"""
+    import fakeredis
+    import pikepdf
+    from app import events, progress, tasks
+    from app.config import settings
+
+    redis = fakeredis.FakeRedis(decode_responses=True)
+    monkeypatch.setattr(events, "get_redis", lambda: redis)
+    monkeypatch.setattr(progress, "get_redis", lambda: redis)
+    monkeypatch.setattr(settings, "STORAGE_BASE_PATH", str(tmp_path))
+    monkeypatch.setattr(settings, "TASK_VIEW_CACHE_ENABLED", False)
+    monkeypatch.setattr(settings, "STATUS_PIPELINE", "direct")
+
+    hashed = []
+    file_sha256 = tasks.file_sha256
+    monkeypatch.setattr(tasks, "file_sha256", lambda path: hashed.append(path) or file_sha256(path))
+
+    for name in ("a.pdf", "b.pdf"):
+        pdf = pikepdf.new()
+        pdf.add_blank_page()
+        pdf.save(tmp_path / name)
+
+    def run(task_type, file_keys=None):
+        task_id = make_task(file_key_source="a.pdf", task_type=task_type).task_id
+        hashed.clear()
+        tasks.convert_pdf_task(task_id, "a.pdf", task_type, {"ranges": "1"}, file_keys)
+        return len(hashed)
+
+    monkeypatch.setattr(settings, "RESULT_CACHE_ENABLED", True)
+    assert run("merge", ["a.pdf", "b.pdf"]) == 0
+    assert run("split") == 1
+
+    monkeypatch.setattr(settings, "RESULT_CACHE_ENABLED", False)
+    assert run("split") == 0
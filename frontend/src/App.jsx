@@ -107,6 +107,7 @@ function App() {
       formData.append('file', file)
 
       const uploadRes = await axios.post(`${API_BASE_URL}/upload`, formData, {
+        params: { client_id: getClientId() },
         headers: { 'Content-Type': 'multipart/form-data' },
         onUploadProgress: (progressEvent) => {
           const percentCompleted = Math.round((progressEvent.loaded * 50) / progressEvent.total)
@@ -128,28 +129,62 @@ function App() {
 
       const taskId = taskRes.data.task_id
 
-      // 3. 轮询任务状态
-      const pollTask = async () => {
-        const statusRes = await axios.get(`${API_BASE_URL}/tasks/${taskId}`)
-        const status = statusRes.data.status
-
-        if (status === 'completed') {
+      // 3. 订阅任务状态（SSE），浏览器不支持或连接失败时退回轮询
+      const finishTask = async (event) => {
+        if (event.status === 'completed') {
+          const statusRes = await axios.get(`${API_BASE_URL}/tasks/${taskId}`)
           setProgress(100)
           setResult(statusRes.data)
           message.success('转换完成！')
           setConverting(false)
-        } else if (status === 'failed') {
-          message.error('转换失败: ' + statusRes.data.error_msg)
+          return true
+        } else if (event.status === 'failed') {
+          message.error('转换失败: ' + event.error_msg)
           setConverting(false)
-        } else if (status === 'processing') {
-          setProgress(prev => Math.min(prev + 10, 90))
-          setTimeout(pollTask, 2000)
-        } else {
+          return true
+        } else if (event.status === 'expired') {
+          message.error('文件已过期')
+          setConverting(false)
+          return true
+        } else if (event.status === 'processing') {
+          if (typeof event.progress === 'number') {
+            // 上传占前 50%，转换进度映射到 50% - 99%
+            setProgress(50 + Math.min(Math.floor(event.progress / 2), 49))
+          } else {
+            setProgress(prev => Math.min(prev + 10, 90))
+          }
+        }
+        return false
+      }
+
+      const pollTask = async () => {
+        const statusRes = await axios.get(`${API_BASE_URL}/tasks/${taskId}`)
+        if (!(await finishTask(statusRes.data))) {
           setTimeout(pollTask, 2000)
         }
       }
 
-      setTimeout(pollTask, 2000)
+      if (window.EventSource) {
+        const source = new EventSource(`${API_BASE_URL}/tasks/${taskId}/events`)
+        let done = false
+        source.onmessage = async (e) => {
+          const event = JSON.parse(e.data)
+          if (['completed', 'failed', 'expired'].includes(event.status)) {
+            done = true
+            source.close()
+          }
+          await finishTask(event)
+        }
+        source.onerror = () => {
+          // 服务端在终态后主动关闭连接；其它情况（如达到连接时长上限）改为轮询
+          source.close()
+          if (!done) {
+            setTimeout(pollTask, 2000)
+          }
+        }
+      } else {
+        setTimeout(pollTask, 2000)
+      }
 
     } catch (error) {
       console.error('Upload error:', error)
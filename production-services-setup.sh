@@ -41,7 +41,7 @@ Group=www-data
 WorkingDirectory=/opt/pdfshift/production/backend
 Environment="PATH=/opt/pdfshift/production/venv/bin"
 EnvironmentFile=/opt/pdfshift/production/.env
-ExecStart=/opt/pdfshift/production/venv/bin/celery -A app.celery worker --loglevel=info --concurrency=2
+ExecStart=/opt/pdfshift/production/venv/bin/celery -A app.celery worker --loglevel=info -Q celery,convert.paid,convert.free,convert.render --concurrency=2
 
 Restart=always
 RestartSec=10
@@ -114,6 +114,10 @@ OSS_ENDPOINT=oss-cn-hangzhou.aliyuncs.com
 # JWT 密钥 (至少 32 个字符)
 JWT_SECRET=your_random_secret_key_change_me_in_production_at_least_32_chars
 
+# 下载链接签名 (与 nginx secure_link_hmac_secret 保持一致)
+DOWNLOAD_URL_SECRET=your_random_download_secret_change_me
+DOWNLOAD_ACCEL_REDIRECT_PREFIX=/_protected/
+
 # 管理员账号
 ADMIN_USERNAME=admin
 ADMIN_PASSWORD=Admin@2026!ChangeMe
@@ -188,6 +192,26 @@ server {
         }
     }
 
+    # 签名下载链接：装有 ngx_http_hmac_secure_link_module 时取消注释，
+    # nginx 直接校验签名并返回文件；未安装时请求落到 /api/ 由应用校验
+    # location /api/v1/files/ {
+    #     secure_link_hmac "$arg_st,$arg_ts,$arg_e";
+    #     secure_link_hmac_secret "与 DOWNLOAD_URL_SECRET 相同";
+    #     secure_link_hmac_message "$uri|$arg_ts|$arg_e";
+    #     secure_link_hmac_algorithm sha256;
+    #     if ($secure_link_hmac != "1") {
+    #         return 403;
+    #     }
+    #     alias /opt/pdfshift/storage/;
+    #     add_header Content-Disposition "attachment";
+    # }
+
+    # 应用校验签名后通过 X-Accel-Redirect 转到这里发送文件
+    location /_protected/ {
+        internal;
+        alias /opt/pdfshift/storage/;
+    }
+
     # API 代理
     location /api/ {
         proxy_pass http://127.0.0.1:8000;
@@ -262,10 +286,21 @@ StandardError=append:/opt/pdfshift/logs/api.log
 WantedBy=multi-user.target
 EOF
 
-# Celery Worker
-cat > /etc/systemd/system/pdfshift-worker.service << 'EOF'
+# Celery Worker：按队列分池（队列定义见 backend/app/celery_app.py）
+# - pdfshift-worker-paid：convert.paid，付费任务独占，免费任务再多也不会占用这些进程
+# - pdfshift-worker-render：convert.render，免费 pdf2ppt 等 CPU 密集型渲染，进程数按 CPU 核数调整
+# - pdfshift-worker-free：convert.free
+# - pdfshift-worker-maint：默认队列 celery（定时清理、统计），单独一个进程，不会排在免费任务积压之后
+# 进程数可在运行脚本前通过环境变量调整；单个渲染任务内部还会按 CONVERT_PROCESS_WORKERS 并行
+WORKER_PAID_CONCURRENCY=${WORKER_PAID_CONCURRENCY:-2}
+WORKER_RENDER_CONCURRENCY=${WORKER_RENDER_CONCURRENCY:-2}
+WORKER_FREE_CONCURRENCY=${WORKER_FREE_CONCURRENCY:-2}
+
+write_worker_unit() {
+    local name=$1 queues=$2 concurrency=$3
+    cat > /etc/systemd/system/pdfshift-worker-${name}.service << EOF
 [Unit]
-Description=PDFShift Celery Worker
+Description=PDFShift Celery Worker (${queues})
 After=network.target redis-server.service
 
 [Service]
@@ -275,17 +310,23 @@ Group=www-data
 WorkingDirectory=/opt/pdfshift/backend
 Environment="PATH=/opt/pdfshift/venv/bin"
 EnvironmentFile=/opt/pdfshift/.env
-ExecStart=/opt/pdfshift/venv/bin/celery -A app.celery worker --loglevel=info --concurrency=2 --max-tasks-per-child=50
+ExecStart=/opt/pdfshift/venv/bin/celery -A app.celery worker --loglevel=info -Q ${queues} -n ${name}@%%h --concurrency=${concurrency} --max-tasks-per-child=50
 
 Restart=always
 RestartSec=10
 
-StandardOutput=append:/opt/pdfshift/logs/worker.log
-StandardError=append:/opt/pdfshift/logs/worker.log
+StandardOutput=append:/opt/pdfshift/logs/worker-${name}.log
+StandardError=append:/opt/pdfshift/logs/worker-${name}.log
 
 [Install]
 WantedBy=multi-user.target
 EOF
+}
+
+write_worker_unit paid convert.paid "$WORKER_PAID_CONCURRENCY"
+write_worker_unit render convert.render "$WORKER_RENDER_CONCURRENCY"
+write_worker_unit free convert.free "$WORKER_FREE_CONCURRENCY"
+write_worker_unit maint celery 1
 
 # Celery Beat
 cat > /etc/systemd/system/pdfshift-beat.service << 'EOF'
@@ -312,6 +353,31 @@ StandardError=append:/opt/pdfshift/logs/celery-beat.log
 WantedBy=multi-user.target
 EOF
 
+# 任务状态批量写入（STATUS_PIPELINE=redis_stream 时启用，只运行一个实例）
+cat > /etc/systemd/system/pdfshift-status-writer.service << 'EOF'
+[Unit]
+Description=PDFShift Task Status Writer
+After=network.target redis-server.service
+
+[Service]
+Type=simple
+User=www-data
+Group=www-data
+WorkingDirectory=/opt/pdfshift/backend
+Environment="PATH=/opt/pdfshift/venv/bin"
+EnvironmentFile=/opt/pdfshift/.env
+ExecStart=/opt/pdfshift/venv/bin/python -m app.status_writer
+
+Restart=always
+RestartSec=5
+
+StandardOutput=append:/opt/pdfshift/logs/status-writer.log
+StandardError=append:/opt/pdfshift/logs/status-writer.log
+
+[Install]
+WantedBy=multi-user.target
+EOF
+
 # ========== 11. 创建备份脚本 ==========
 echo -e "${GREEN}11. 创建备份脚本...${NC}"
 
@@ -341,7 +407,7 @@ systemctl daemon-reload
 
 # 启用服务
 systemctl enable redis-server nginx
-systemctl enable pdfshift-api pdfshift-worker pdfshift-beat
+systemctl enable pdfshift-api pdfshift-worker-paid pdfshift-worker-render pdfshift-worker-free pdfshift-worker-maint pdfshift-beat
 
 # 启动 Redis 和 Nginx
 systemctl restart redis-server
@@ -370,8 +436,11 @@ echo "   sudo -u www-data /opt/pdfshift/venv/bin/pip install -r /opt/pdfshift/ba
 echo ""
 echo "4. 启动服务:"
 echo "   sudo systemctl start pdfshift-api"
-echo "   sudo systemctl start pdfshift-worker"
+echo "   sudo systemctl start pdfshift-worker-paid pdfshift-worker-render pdfshift-worker-free pdfshift-worker-maint"
+echo "   # 从单个 pdfshift-worker 升级时先停用旧服务: sudo systemctl disable --now pdfshift-worker"
 echo "   sudo systemctl start pdfshift-beat"
+echo "   # .env 中设置 STATUS_PIPELINE=redis_stream 时还需要:"
+echo "   sudo systemctl enable --now pdfshift-status-writer"
 echo ""
 echo "5. 检查状态:"
 echo "   sudo systemctl status pdfshift-api"
@@ -276,7 +276,7 @@ Group=www-data
 WorkingDirectory=/opt/pdfshift/staging/backend
 Environment="PATH=/opt/pdfshift/staging/venv/bin"
 EnvironmentFile=/opt/pdfshift/staging/.env
-ExecStart=/opt/pdfshift/staging/venv/bin/celery -A app.celery worker --loglevel=info --concurrency=1
+ExecStart=/opt/pdfshift/staging/venv/bin/celery -A app.celery worker --loglevel=info -Q celery,convert.paid,convert.free,convert.render --concurrency=1
 
 Restart=always
 RestartSec=10
@@ -326,7 +326,7 @@ Group=www-data
 WorkingDirectory=/opt/pdfshift/production/backend
 Environment="PATH=/opt/pdfshift/production/venv/bin"
 EnvironmentFile=/opt/pdfshift/production/.env
-ExecStart=/opt/pdfshift/production/venv/bin/celery -A app.celery worker --loglevel=info --concurrency=2
+ExecStart=/opt/pdfshift/production/venv/bin/celery -A app.celery worker --loglevel=info -Q celery,convert.paid,convert.free,convert.render --concurrency=2
 
 Restart=always
 RestartSec=10